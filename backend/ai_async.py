@@ -0,0 +1,111 @@
+"""
+Async Model Fallback Chain
+The non-blocking counterpart of app.call_models, used by asgi.py. Every model
+attempt is a task on the event loop that shares one pooled aiohttp session, so a
+request waiting on a model costs a coroutine rather than a worker thread.
+
+Hedging: when AI_HEDGE_AFTER_MS is set and a model has not answered within
+that time, the next model in the chain is started alongside it. The first
+accepted answer wins and the attempts still running are cancelled. A failed
+attempt starts the next model straight away, as the blocking chain does.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import aiohttp
+
+import metrics
+
+# 0 disables hedging: models are then tried strictly one after another
+AI_HEDGE_AFTER_MS = float(os.getenv('AI_HEDGE_AFTER_MS', '0'))
+# Upper bound on concurrent connections to the model API
+AI_MAX_CONNECTIONS = int(os.getenv('AI_MAX_CONNECTIONS', '2000'))
+
+
+class ModelError(Exception):
+    """A model answered, but not with something the route can use"""
+
+
+class AsyncModelClient:
+    """Runs chat completions against an OpenAI-compatible API on the event loop"""
+
+    def __init__(self, url: str, headers: dict, models: List[str], hedge_after_ms: float = AI_HEDGE_AFTER_MS,
+                 max_connections: int = AI_MAX_CONNECTIONS, logger: Optional[logging.Logger] = None):
+        self.url = url
+        self.headers = headers
+        self.models = list(models)
+        self.hedge_after = hedge_after_ms / 1000 if hedge_after_ms > 0 else None
+        self.max_connections = max_connections
+        self.logger = logger or logging.getLogger(__name__)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        # Created lazily, so it binds to the event loop the server runs
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.max_connections)
+            self._session = aiohttp.ClientSession(headers=self.headers, connector=connector)
+        return self._session
+
+    async def aclose(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def complete(self, feature: str, model: str, payload: dict, timeout: float,
+                       accept: Optional[Callable] = None):
+        """One model attempt; returns the accepted text or raises"""
+        start = time.perf_counter()
+        outcome = 'exception'
+        try:
+            async with self.session.post(self.url, json=dict(payload, model=model),
+                                         timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                outcome = str(response.status)
+                if response.status != 200:
+                    raise ModelError(f"Status {response.status}: {(await response.text())[:200]}")
+                response_data = await response.json(content_type=None)
+            text = response_data['choices'][0]['message']['content']
+            return accept(text) if accept else text
+        except asyncio.CancelledError:
+            outcome = 'cancelled'
+            raise
+        finally:
+            metrics.llm_latency.observe(time.perf_counter() - start, feature, model, outcome)
+
+    async def call_models(self, feature: str, payload: dict, timeout: float,
+                          accept: Optional[Callable] = None) -> Tuple[object, Optional[str]]:
+        """Returns (result, None), or (None, last_error) when every model failed.
+        Cancelling the caller (e.g. on client disconnect) cancels every attempt."""
+        remaining = iter(self.models)
+        pending: Dict[asyncio.Future, str] = {}
+        last_error = None
+
+        def launch():
+            model = next(remaining, None)
+            if model is not None:
+                pending[asyncio.ensure_future(self.complete(feature, model, payload, timeout, accept))] = model
+
+        launch()
+        try:
+            while pending:
+                done, _ = await asyncio.wait(pending, timeout=self.hedge_after,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # Slow model: hedge with the next one, keep waiting on both
+                    launch()
+                    continue
+                for task in done:
+                    model = pending.pop(task)
+                    if task.exception() is None:
+                        return task.result(), None
+                    last_error = str(task.exception())
+                    self.logger.warning("%s model %s failed: %s", feature, model, last_error)
+                    launch()
+            return None, last_error
+        finally:
+            for task in pending:
+                task.cancel()
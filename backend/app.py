@@ -1,24 +1,43 @@
-from flask import Flask, jsonify, request
+from flask import Flask, jsonify, request, make_response, g
 from flask_cors import CORS
 import sqlite3
 from datetime import datetime
 import time
 import threading
+import logging
+import hmac
 import os
 import requests
 import json
+import re
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
 load_dotenv()
 
 # Import our advanced data structures
-from data_structures import health_aggregator, HealthRecord, Doctor, Severity
+from data_structures import health_aggregator, autocomplete_index, HealthDataCache
+from date_resolver import resolve_record_and_follow_up
+from versioning import table_versions
+from serialization import (rows_response, json_response, dumps, encode_batches, batches_response,
+                           negotiate_encoding)
+from auth import (SessionStore, hash_password, verify_password, needs_rehash, public_user,
+                  dummy_password_hash, normalize_email)
+import search
+from changelog import ChangeLog, wait_for_any
+from cohort_analytics import cohort_engine
+from replica import AggregatorReplica
+from shards import ShardSet, ShardLayoutError
+from maintenance import MaintenanceScheduler
+import archive
+import metrics
+from profiling import profiler
 
 # Configure Hugging Face Inference API
 HUGGINGFACE_API_KEY = os.getenv('HUGGINGFACE_API_KEY', 'your-huggingface-api-key-here')
-# Use Hugging Face Router endpoint (OpenAI-compatible)
-HUGGINGFACE_API_URL = "https://router.huggingface.co/v1/chat/completions"
+# Use Hugging Face Router endpoint (OpenAI-compatible); override to point at
+# any compatible server, e.g. benchmarks/llm_stub.py for load tests
+HUGGINGFACE_API_URL = os.getenv('HUGGINGFACE_API_URL', "https://router.huggingface.co/v1/chat/completions")
 # Alternative models to try if primary fails
 HUGGINGFACE_MODELS = [
     "mistralai/Mistral-7B-Instruct-v0.2",  # Reliable and powerful
@@ -27,48 +46,472 @@ HUGGINGFACE_MODELS = [
 ]
 
 app = Flask(__name__)
-CORS(app)  # Enable CORS for all routes
+CORS(app, expose_headers=['ETag', 'X-Change-Cursor', 'X-Profile-Id'])  # Enable CORS for all routes; expose ETag to the client query cache
+# LOG_LEVEL=DEBUG turns on request tracing in the AI routes; above DEBUG it costs nothing
+app.logger.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
 
 # Localhost configuration
-PORT = 5000
+PORT = int(os.getenv('PORT', '5000'))
 
-# SQLite database file path
+# SQLite database file path (shard 0 and the catalog when sharded)
 DATABASE = 'phr_database.db'
 
-_write_lock = threading.Lock()
-
-def get_connection(read_only=False):
-    """Return a new sqlite3 connection with timeout and row factory.
-    read_only is kept for future extension (e.g., URI mode)."""
+# Users and their records are spread over SHARD_COUNT SQLite files by user_id
+# (see shards.py), each with its own writer. Changing the count needs
+# `python rebalance_shards.py --shards N` with the server stopped.
+SHARD_COUNT = int(os.getenv('SHARD_COUNT', '1'))
+SHARD_POOL_SIZE = int(os.getenv('SHARD_POOL_SIZE', '8'))  # idle connections kept per shard
+# Seconds before retrying a failed copy of doctors to the other shards
+DOCTOR_COPY_RETRY_SECONDS = float(os.getenv('DOCTOR_COPY_RETRY_SECONDS', '5'))
+
+# Shared secret for /admin endpoints and header-triggered profiling; unset disables both
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+
+# Several worker processes serving one database (gunicorn -w N, uvicorn --workers N).
+# Each worker follows the change log before every GET and in the background, and
+# re-reads cached sessions after SESSION_REVALIDATE_SECONDS so a logout on one
+# worker reaches the others.
+MULTI_PROCESS = os.getenv('MULTI_PROCESS', 'False').lower() == 'true'
+STATE_SYNC_INTERVAL = float(os.getenv('STATE_SYNC_INTERVAL', '0.5'))
+SESSION_REVALIDATE_SECONDS = float(os.getenv('SESSION_REVALIDATE_SECONDS', '5'))
+
+# Aggregator snapshot loaded at startup in place of a full rebuild (see snapshot.py),
+# rewritten every AGGREGATOR_SNAPSHOT_INTERVAL seconds. An empty path disables it.
+AGGREGATOR_SNAPSHOT_PATH = os.getenv('AGGREGATOR_SNAPSHOT_PATH', 'phr_database.snapshot')
+AGGREGATOR_SNAPSHOT_INTERVAL = float(os.getenv('AGGREGATOR_SNAPSHOT_INTERVAL', '300'))
+
+# Background database maintenance (see maintenance.py). WAL files past
+# WAL_CHECKPOINT_BYTES are checkpointed every MAINTENANCE_INTERVAL seconds;
+# ANALYZE/optimize, incremental vacuum and backups into BACKUP_DIR run once
+# per interval inside MAINTENANCE_WINDOW (local time, empty for any time).
+# An interval of 0 or an empty BACKUP_DIR turns that task off.
+MAINTENANCE_ENABLED = os.getenv('MAINTENANCE_ENABLED', 'True').lower() == 'true'
+MAINTENANCE_INTERVAL = float(os.getenv('MAINTENANCE_INTERVAL', '60'))
+MAINTENANCE_WINDOW = os.getenv('MAINTENANCE_WINDOW', '02:00-05:00')
+WAL_CHECKPOINT_BYTES = int(os.getenv('WAL_CHECKPOINT_BYTES', str(16 << 20)))
+OPTIMIZE_INTERVAL = float(os.getenv('OPTIMIZE_INTERVAL', '86400'))
+VACUUM_INTERVAL = float(os.getenv('VACUUM_INTERVAL', '86400'))
+BACKUP_DIR = os.getenv('BACKUP_DIR', 'backups')
+BACKUP_INTERVAL = float(os.getenv('BACKUP_INTERVAL', '86400'))
+BACKUP_KEEP = int(os.getenv('BACKUP_KEEP', '7'))
+BACKUP_PAGES_PER_STEP = int(os.getenv('BACKUP_PAGES_PER_STEP', '256'))
+
+# Records older than ARCHIVE_AFTER_DAYS move to each shard's cold database
+# (see archive.py), ARCHIVE_BATCH_SIZE per transaction, once per
+# ARCHIVE_INTERVAL inside MAINTENANCE_WINDOW. ARCHIVE_AFTER_DAYS=0 disables it.
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', '730'))
+ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', '500'))
+ARCHIVE_INTERVAL = float(os.getenv('ARCHIVE_INTERVAL', '86400'))
+
+# Per-user dashboard cache; entries are also invalidated by the user's writes
+# through the table version counters. Set DASHBOARD_CACHE_TTL=0 to disable.
+DASHBOARD_CACHE_TTL = float(os.getenv('DASHBOARD_CACHE_TTL', '30'))
+dashboard_cache = HealthDataCache(max_size=500)
+
+def connect_database(path):
+    """Return a new sqlite3 connection with timeout and row factory."""
     # Increase timeout so busy connections wait instead of failing immediately.
-    conn = sqlite3.connect(DATABASE, timeout=10, check_same_thread=False)
+    conn = sqlite3.connect(path, timeout=10, check_same_thread=False, factory=metrics.TimedConnection)
     conn.row_factory = sqlite3.Row
+    # Archived rows, and the health_records_all / treatment_all full-history views
+    archive.attach(conn, archive.cold_path(path))
     return conn
 
+shards = ShardSet(DATABASE, SHARD_COUNT, connect_database, SHARD_POOL_SIZE)
+
+def get_connection(user_id=None):
+    """Pooled connection to the shard holding user_id's rows, or to the
+    catalog (shard 0: sessions, the user directory and doctors) without one."""
+    shard = shards.catalog if user_id is None else shards.for_user(user_id)
+    return shard.connection()
+
 def init_db_pragmas():
     """Configure WAL mode to reduce write contention."""
     try:
-        with get_connection() as conn:
-            conn.execute('PRAGMA journal_mode=WAL;')
-            conn.execute('PRAGMA synchronous=NORMAL;')
+        for shard in shards:
+            with shard.connection() as conn:
+                conn.execute('PRAGMA journal_mode=WAL;')
+                conn.execute('PRAGMA synchronous=NORMAL;')
     except Exception as e:
         app.logger.warning(f"Database pragma init failed: {e}")
 
+def init_db_shards():
+    """Create missing shard files and register existing users in the user directory."""
+    try:
+        shards.init_schema()
+        shards.backfill_directory()
+    except ShardLayoutError:
+        raise  # serving would look users up on the wrong shards
+    except Exception as e:
+        app.logger.warning(f"Shard init failed: {e}")
+
+archiver = archive.Archiver(shards, ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE)
+
+def init_db_archive():
+    """Create the cold tables that archived records move to."""
+    try:
+        archiver.init_schema()
+    except Exception as e:
+        app.logger.warning(f"Archive init failed: {e}")
+
+def init_db_indexes():
+    """Index the foreign-key columns used by per-user reads and cascading deletes."""
+    try:
+        for shard in shards:
+            with shard.connection() as conn:
+                conn.execute('CREATE INDEX IF NOT EXISTS idx_health_records_user ON health_records(user_id)')
+                conn.execute('CREATE INDEX IF NOT EXISTS idx_health_records_doctor ON health_records(doctor_id)')
+                conn.execute('CREATE INDEX IF NOT EXISTS idx_treatment_record ON treatment(record_id)')
+    except Exception as e:
+        app.logger.warning(f"Database index init failed: {e}")
+
+session_store = SessionStore(get_connection, revalidate_seconds=SESSION_REVALIDATE_SECONDS if MULTI_PROCESS else 0,
+                             connect_user=get_connection)
+
+def init_db_sessions():
+    """Create the sessions table backing login tokens."""
+    try:
+        session_store.init_schema()
+    except Exception as e:
+        app.logger.warning(f"Session table init failed: {e}")
+
+SEARCH_ENABLED = False
+
+def init_db_search():
+    """Create the FTS5 search indexes and their sync triggers, hot and cold."""
+    global SEARCH_ENABLED
+    try:
+        enabled = []
+        for shard in shards:
+            with shard.connection() as conn:
+                enabled.append(search.init_search_schema(conn))
+                enabled.append(search.init_search_schema(conn, 'cold'))
+        SEARCH_ENABLED = all(enabled)
+        if not SEARCH_ENABLED:
+            app.logger.warning("SQLite was built without FTS5; /search is disabled")
+    except Exception as e:
+        app.logger.warning(f"Search index init failed: {e}")
+
+# One change log per shard, each issuing seqs from its shard's id range; a
+# shared condition lets the unfiltered change stream wait on all of them
+change_signal = threading.Condition()
+change_logs = [ChangeLog(shard.connection, shard.id_base, shard.id_limit, change_signal) for shard in shards]
+replica = AggregatorReplica(shards, change_logs, health_aggregator, app.logger, autocomplete_index)
+
+def change_log_for(shard):
+    return change_logs[shard.index]
+
+def change_cursor():
+    """Every shard's latest seq, comma-separated: the resume point of the
+    unfiltered change stream for data read after this call"""
+    return ','.join(str(log.latest_seq) for log in change_logs)
+
+def init_aggregator():
+    """Load the health aggregator from its snapshot, or else from SQLite, and
+    the autocomplete indexes from SQLite; the change log keeps both current."""
+    try:
+        started = time.perf_counter()
+        if AGGREGATOR_SNAPSHOT_PATH and replica.restore(AGGREGATOR_SNAPSHOT_PATH):
+            source = 'snapshot'
+        else:
+            replica.rebuild()
+            source = 'database'
+        app.logger.info(f"Health aggregator loaded from {source} at seq {replica.applied_seqs} "
+                        f"in {time.perf_counter() - started:.2f}s")
+    except Exception as e:
+        app.logger.warning(f"Health aggregator load failed: {e}")
+    if AGGREGATOR_SNAPSHOT_PATH:
+        replica.start_snapshots(AGGREGATOR_SNAPSHOT_PATH, AGGREGATOR_SNAPSHOT_INTERVAL)
+    if MULTI_PROCESS:
+        replica.start_polling(STATE_SYNC_INTERVAL)
+
+maintenance = MaintenanceScheduler(
+    shards, app.logger, window=MAINTENANCE_WINDOW, interval=MAINTENANCE_INTERVAL,
+    checkpoint_bytes=WAL_CHECKPOINT_BYTES, optimize_interval=OPTIMIZE_INTERVAL,
+    vacuum_interval=VACUUM_INTERVAL, backup_dir=BACKUP_DIR, backup_interval=BACKUP_INTERVAL,
+    backup_keep=BACKUP_KEEP, backup_pages=BACKUP_PAGES_PER_STEP,
+    archiver=archiver if ARCHIVE_AFTER_DAYS > 0 else None, archive_interval=ARCHIVE_INTERVAL)
+
+def init_maintenance():
+    """Create the maintenance bookkeeping table and start the scheduler."""
+    try:
+        maintenance.init_schema()
+        if MAINTENANCE_ENABLED:
+            maintenance.start()
+    except Exception as e:
+        app.logger.warning(f"Database maintenance init failed: {e}")
+
+def init_change_log():
+    """Create the change_log table that clients follow for incremental sync."""
+    try:
+        for log in change_logs:
+            log.init_schema()
+    except Exception as e:
+        app.logger.warning(f"Change log init failed: {e}")
+
 # Initialize pragmas immediately at import time (Flask version here lacked before_first_request)
 init_db_pragmas()
-
-def execute_write(fn, retries=5, base_delay=0.15):
-    """Execute a write function with retry/backoff on 'database is locked'."""
+init_db_shards()
+init_db_archive()
+init_db_indexes()
+init_db_sessions()
+init_db_search()
+init_change_log()
+init_aggregator()
+init_maintenance()
+
+def execute_write(fn, shard=None, retries=5, base_delay=0.15):
+    """Execute a write function on shard (the catalog by default) with
+    retry/backoff on 'database is locked'."""
+    lock = (shard or shards.catalog).write_lock
     for attempt in range(retries):
         try:
-            with _write_lock:  # serialize writes to minimize lock clashes
-                return fn()
+            waited_from = time.perf_counter()
+            with lock:  # serialize writes per shard to minimize lock clashes
+                started = time.perf_counter()
+                metrics.db_write_lock_wait.observe(started - waited_from)
+                try:
+                    return fn()
+                finally:
+                    metrics.db_write_latency.observe(time.perf_counter() - started)
         except sqlite3.OperationalError as e:
             if 'locked' in str(e).lower() and attempt < retries - 1:
+                metrics.db_write_retries.inc()
                 time.sleep(base_delay * (attempt + 1))
                 continue
+            metrics.db_write_failures.inc()
+            raise
+        except Exception:
+            metrics.db_write_failures.inc()
             raise
 
+def compact_change_log(shard):
+    """Drop superseded and expired change_log entries of a shard (runs off the request thread)."""
+    log = change_log_for(shard)
+    def _compact():
+        with shard.connection() as conn:
+            return log.compact(conn)
+    try:
+        removed = execute_write(_compact, shard)
+        app.logger.info(f"Change log of shard {shard.index} compacted: {removed} entries removed, "
+                        f"floor at seq {log.floor_seq}")
+    except Exception as e:
+        app.logger.warning(f"Change log compaction failed: {e}")
+
+DOCTOR_COLUMNS = ('doctor_id', 'name', 'specialization', 'contact_number', 'email')
+
+def delete_doctor_history(conn, shard, doctor_id):
+    """Delete a doctor's health records and their treatments on shard,
+    archived history included, inside the caller's write transaction.
+    Set-based statements: no record ids are pulled into Python, so the size
+    of the history is bounded neither by memory nor by SQLite's variable
+    limit. Returns (records_deleted, treatments_deleted)."""
+    change_log = change_log_for(shard)
+    change_log.append_deletes(conn, 'treatment', 't.treatment_id', 'hr.user_id', """
+        treatment_all t JOIN health_records_all hr ON hr.record_id = t.record_id
+        WHERE hr.doctor_id = ?
+    """, (doctor_id,))
+    change_log.append_deletes(conn, 'health_records', 'record_id', 'user_id',
+                              "health_records_all WHERE doctor_id = ?", (doctor_id,))
+    records_deleted = treatments_deleted = 0
+    for schema in archive.SCHEMAS:
+        treatments_deleted += conn.execute(f"""
+            DELETE FROM {schema}.treatment
+            WHERE record_id IN (SELECT record_id FROM health_records_all WHERE doctor_id = ?)
+        """, (doctor_id,)).rowcount
+    for schema in archive.SCHEMAS:
+        records_deleted += conn.execute(f"DELETE FROM {schema}.health_records WHERE doctor_id = ?",
+                                        (doctor_id,)).rowcount
+    return records_deleted, treatments_deleted
+
+def copy_doctors(shard):
+    """Make shard's copy of doctors match the catalog, the only place doctors
+    are written. Rows that differ are upserted, doctors gone from the catalog
+    are deleted with their history there, and each change is logged on shard
+    for its users' feeds. Idempotent, so a failed run is caught up by the
+    next one. Returns (records_deleted, treatments_deleted)."""
+    columns = ', '.join(DOCTOR_COLUMNS)
+    with shards.catalog.connection() as conn:
+        catalog = {row[0]: tuple(row) for row in conn.execute(f"SELECT {columns} FROM doctors")}
+    records_deleted = treatments_deleted = 0
+    seq = None
+    change_log = change_log_for(shard)
+    with shard.connection() as conn:
+        copy = {row[0]: tuple(row) for row in conn.execute(f"SELECT {columns} FROM doctors")}
+        for doctor_id in copy.keys() - catalog.keys():
+            conn.execute("DELETE FROM doctors WHERE doctor_id = ?", (doctor_id,))
+            records, treatments = delete_doctor_history(conn, shard, doctor_id)
+            records_deleted += records
+            treatments_deleted += treatments
+            seq = change_log.append(conn, 'doctors', 'delete', doctor_id)
+        for doctor_id, row in catalog.items():
+            if copy.get(doctor_id) == row:
+                continue
+            conn.execute(f"""
+                INSERT INTO doctors ({columns}) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (doctor_id) DO UPDATE SET name = excluded.name,
+                    specialization = excluded.specialization,
+                    contact_number = excluded.contact_number, email = excluded.email
+            """, row)
+            seq = change_log.append(conn, 'doctors', 'update' if doctor_id in copy else 'insert',
+                                    doctor_id, None, dict(zip(DOCTOR_COLUMNS, row)))
+    if seq is not None:
+        publish_changes(seq, shard)
+    return records_deleted, treatments_deleted
+
+def sync_doctor_copies():
+    """Bring every other shard's doctors up to the catalog after a doctor
+    write; a shard that fails is retried in the background. Returns the
+    (records_deleted, treatments_deleted) totals of the shards copied."""
+    totals = [0, 0]
+    failed = False
+    for shard in shards.shards[1:]:
+        try:
+            deleted = execute_write(lambda: copy_doctors(shard), shard)
+        except Exception as e:
+            app.logger.warning(f"Copying doctors to shard {shard.index} failed: {e}")
+            failed = True
+            continue
+        totals[0] += deleted[0]
+        totals[1] += deleted[1]
+    if failed:
+        retry = threading.Timer(DOCTOR_COPY_RETRY_SECONDS, sync_doctor_copies)
+        retry.daemon = True
+        retry.start()
+    return totals
+
+def publish_changes(seq, shard=None):
+    """Apply a write committed on shard (the catalog by default) to the
+    aggregator and wake change-stream readers; compact the log when due."""
+    shard = shard or shards.catalog
+    log = change_log_for(shard)
+    log.notify(seq)
+    try:
+        replica.catch_up(shard.index)
+    except Exception as e:
+        # The write is committed; the next catch-up applies it
+        app.logger.warning(f"Aggregator catch-up failed: {e}")
+    if log.claim_compaction():
+        threading.Thread(target=compact_change_log, args=(shard,), daemon=True).start()
+
+# Catch up doctor copies a previous process left behind
+sync_doctor_copies()
+
+def record_shard(record_id):
+    """Shard holding a health record (and its treatments), archived or not, or None"""
+    return shards.locate("SELECT 1 FROM health_records_all WHERE record_id = ?", (record_id,))[0]
+
+def treatment_shard(treatment_id):
+    """Shard holding a treatment, archived or not, or None"""
+    return shards.locate("SELECT 1 FROM treatment_all WHERE treatment_id = ?", (treatment_id,))[0]
+
+def fan_out_rows(sql):
+    """rows_response for sql run on every shard, the shards queried in parallel"""
+    compact = request.args.get('format') == 'compact'
+    def _encode(conn):
+        cursor = conn.cursor()
+        cursor.row_factory = None  # plain tuples, as in rows_response
+        return encode_batches(cursor.execute(sql), compact)
+    return batches_response(shards.fan_out(_encode))
+
+def conditional_get(build, tables=(), user_id=None):
+    """Answer 304 Not Modified from the table version counters, or build the response.
+
+    Validators are read before build() queries SQLite, so a write racing the
+    query can only leave the ETag stale (forcing a refetch), never wrong.
+    Last-Modified is informational; with one-second resolution it cannot
+    distinguish writes within the same second, so only the ETag is validated.
+    The ETag also names the ?format= and the negotiated encoding: the same
+    data in another shape or encoding is another representation.
+    """
+    # Read first, like the validators: the stream from here misses nothing in the body
+    cursor = change_cursor()
+    etag, last_modified = table_versions.validators(tables, user_id)
+    representation = 'compact' if request.args.get('format') == 'compact' else 'json'
+    etag += f"-{representation}-{negotiate_encoding(request.accept_encodings) or 'identity'}"
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+    else:
+        response = make_response(build())
+    response.headers['X-Change-Cursor'] = cursor
+    response.vary.add('Accept-Encoding')
+    response.set_etag(etag, weak=True)
+    response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response
+
+def bearer_token():
+    """Return the token from an 'Authorization: Bearer <token>' header, or None."""
+    header = request.headers.get('Authorization', '')
+    if header.startswith('Bearer '):
+        return header[len('Bearer '):].strip() or None
+    return None
+
+def post_completion(feature, headers, payload, timeout):
+    """POST one chat completion to the Hugging Face router, timed per model."""
+    start = time.perf_counter()
+    outcome = 'exception'
+    try:
+        response = requests.post(HUGGINGFACE_API_URL, headers=headers, json=payload, timeout=timeout)
+        outcome = str(response.status_code)
+        return response
+    finally:
+        metrics.llm_latency.observe(time.perf_counter() - start, feature, payload['model'], outcome)
+
+def is_admin():
+    """True when the request carries the configured X-Admin-Token."""
+    token = request.headers.get('X-Admin-Token')
+    return bool(ADMIN_TOKEN) and token is not None and hmac.compare_digest(token, ADMIN_TOKEN)
+
+def _route_labels():
+    # The URL rule, not the path, keeps label cardinality bounded
+    return request.method, request.url_rule.rule if request.url_rule else 'unmatched'
+
+@app.before_request
+def start_request_metrics():
+    g.metrics_start = time.perf_counter()
+    metrics.http_in_flight.inc(*_route_labels())
+    if 'X-Profile' in request.headers and is_admin():
+        g.profile = profiler.start(request.method, request.full_path.rstrip('?'), 'header')
+    elif profiler.sample_rate and profiler.should_sample():
+        g.profile = profiler.start(request.method, request.full_path.rstrip('?'), 'sampled')
+
+@app.before_request
+def sync_worker_state():
+    # Reads see every write committed before they started, whichever worker
+    # made it; this also moves the version counters behind ETags
+    if MULTI_PROCESS and request.method == 'GET':
+        try:
+            replica.catch_up()
+        except Exception as e:
+            app.logger.warning(f"Aggregator catch-up failed: {e}")
+
+@app.after_request
+def record_request_metrics(response):
+    if 'metrics_start' in g:
+        method, route = _route_labels()
+        metrics.http_latency.observe(time.perf_counter() - g.metrics_start, method, route)
+        metrics.http_requests.inc(method, route, str(response.status_code))
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profiler.finish(profile, response.status_code)
+        response.headers['X-Profile-Id'] = str(profile.id)
+    return response
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    if 'metrics_start' in g:
+        metrics.http_in_flight.dec(*_route_labels())
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profiler.discard(profile)
+
+def _record_owner(cursor, record_id):
+    """Return the user_id owning a health record, or None."""
+    cursor.execute("SELECT user_id FROM health_records_all WHERE record_id = ?", (record_id,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
 # Health check endpoint
 @app.route('/', methods=['GET'])
 @app.route('/health', methods=['GET'])
@@ -79,37 +522,109 @@ def health_check():
         'timestamp': datetime.now().isoformat()
     })
 
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Request, SQLite and LLM metrics in the Prometheus text exposition format"""
+    return app.response_class(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/admin/profiles', methods=['GET'])
+def list_profiles():
+    """Slowest recently profiled requests (limit), slowest first"""
+    if not is_admin():
+        return jsonify({'success': False, 'message': 'Admin token required'}), 403
+    limit = min(max(request.args.get('limit', default=20, type=int), 1), 200)
+    return jsonify({
+        'profiles': [profile.summary() for profile in profiler.slowest(limit)],
+        'sample_rate': profiler.sample_rate,
+        'buffer_size': profiler.recent.maxlen
+    })
+
+@app.route('/admin/profiles/<int:profile_id>', methods=['GET'])
+def get_profile(profile_id):
+    """One profile with its SQL; format=folded returns stacks for flamegraph.pl or speedscope"""
+    if not is_admin():
+        return jsonify({'success': False, 'message': 'Admin token required'}), 403
+    profile = profiler.get(profile_id)
+    if profile is None:
+        return jsonify({'success': False, 'message': 'Profile not found or evicted'}), 404
+    if request.args.get('format') == 'folded':
+        return app.response_class(profile.folded(), mimetype='text/plain')
+    return jsonify(profile.detail())
+
+@app.route('/admin/maintenance', methods=['GET'])
+def maintenance_status():
+    """WAL and free page counts per shard, the last maintenance runs and the backup sets"""
+    if not is_admin():
+        return jsonify({'success': False, 'message': 'Admin token required'}), 403
+    return jsonify(maintenance.status())
+
+@app.route('/admin/maintenance/backup', methods=['POST'])
+def start_backup():
+    """Back up every shard now, in the background; the new set shows up in /admin/maintenance"""
+    if not is_admin():
+        return jsonify({'success': False, 'message': 'Admin token required'}), 403
+    if not BACKUP_DIR:
+        return jsonify({'success': False, 'message': 'Backups are disabled (BACKUP_DIR is empty)'}), 400
+
+    def _backup():
+        try:
+            app.logger.info(f"Backup written to {maintenance.backup()}")
+        except Exception as e:
+            app.logger.error(f"Backup failed: {e}")
+    threading.Thread(target=_backup, name='db-backup', daemon=True).start()
+    return jsonify({'success': True, 'message': 'Backup started'}), 202
+
 @app.route('/doctors', methods=['GET'])
 def get_doctors():
-    with get_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM doctors")
-        doctors = [dict(row) for row in cursor.fetchall()]
-    return jsonify(doctors)
+    def _build():
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM doctors")
+            return rows_response(cursor)
+    return conditional_get(_build, tables=['doctors'])
 
 @app.route('/users', methods=['GET'])
 def get_users():
-    with get_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM users")
-        users = [dict(row) for row in cursor.fetchall()]
-    return jsonify(users)
+    def _build():
+        # Credentials never leave the server; login is verified by /login
+        return fan_out_rows("SELECT user_id, name, age, gender, contact_number, email FROM users")
+    return conditional_get(_build, tables=['users'])
 
 @app.route('/health_records', methods=['GET'])
 def get_health_records():
-    with get_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM health_records")
-        records = [dict(row) for row in cursor.fetchall()]
-    return jsonify(records)
+    return conditional_get(lambda: fan_out_rows("SELECT * FROM health_records_all"), tables=['health_records'])
 
 @app.route('/treatment', methods=['GET'])
 def get_treatment():
-    with get_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM treatment")
-        treatments = [dict(row) for row in cursor.fetchall()]
-    return jsonify(treatments)
+    return conditional_get(lambda: fan_out_rows("SELECT * FROM treatment_all"), tables=['treatment'])
+
+@app.route('/users/<int:user_id>/health_records', methods=['GET'])
+def get_user_health_records(user_id):
+    """One user's health records, newest first, read from their shard only"""
+    def _build():
+        with get_connection(user_id) as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT * FROM health_records_all WHERE user_id = ?
+                ORDER BY record_date DESC, record_id DESC
+            """, (user_id,))
+            return rows_response(cursor)
+    return conditional_get(_build, user_id=user_id)
+
+@app.route('/users/<int:user_id>/treatments', methods=['GET'])
+def get_user_treatments(user_id):
+    """Treatments on one user's health records, read from their shard only"""
+    def _build():
+        with get_connection(user_id) as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT t.* FROM treatment_all t
+                JOIN health_records_all hr ON hr.record_id = t.record_id
+                WHERE hr.user_id = ?
+                ORDER BY t.treatment_id
+            """, (user_id,))
+            return rows_response(cursor)
+    return conditional_get(_build, user_id=user_id)
 
 # New enhanced endpoints using data structures
 @app.route('/users/<int:user_id>/health_summary', methods=['GET'])
@@ -149,6 +664,375 @@ def get_urgent_treatments():
         app.logger.error(f'Failed to get urgent treatments: {str(e)}')
         return jsonify({'error': 'Failed to get urgent treatments'}), 500
 
+DOCTOR_STATS_SORT_KEYS = ('patient_count', 'record_count', 'avg_severity_score', 'efficiency_score')
+
+@app.route('/doctors/stats', methods=['GET'])
+def get_doctor_stats():
+    """Per-doctor workload from the incrementally maintained analytics (sort, order)"""
+    sort_by = request.args.get('sort', 'patient_count')
+    if sort_by not in DOCTOR_STATS_SORT_KEYS:
+        return jsonify({'success': False, 'message': f'sort must be one of {", ".join(DOCTOR_STATS_SORT_KEYS)}'}), 400
+    descending = request.args.get('order', 'desc') != 'asc'
+    stats = health_aggregator.doctor_analytics.get_all_doctor_stats(sort_by, descending)
+    return jsonify({'doctors': stats, 'total': len(stats)})
+
+@app.route('/doctors/recommend', methods=['GET'])
+def recommend_doctors():
+    """Least-busy doctors (by live patient load), optionally for one specialization (k max 50)"""
+    specialization = request.args.get('specialization', '').strip() or None
+    k = min(max(request.args.get('k', default=3, type=int), 1), 50)
+    doctors = health_aggregator.doctor_analytics.recommend_doctors(specialization, k)
+    return jsonify({'specialization': specialization, 'doctors': doctors})
+
+@app.route('/doctors/<int:doctor_id>/stats', methods=['GET'])
+def get_single_doctor_stats(doctor_id):
+    stats = health_aggregator.doctor_analytics.get_doctor_stats(doctor_id)
+    if stats is None:
+        return jsonify({'success': False, 'message': 'Doctor not found'}), 404
+    return jsonify(stats)
+
+COHORT_TABLES = ('users', 'health_records', 'treatment')
+
+def cohort_query(query):
+    """Answer a cohort analytics query from the columnar engine.
+
+    The engine catches up with SQLite only when the table versions moved,
+    so repeated queries touch no rows at all.
+    """
+    if not cohort_engine.available:
+        return jsonify({'success': False, 'message': 'Cohort analytics require numpy'}), 503
+
+    def _build():
+        etag, _ = table_versions.validators(COHORT_TABLES)
+        with shards.connections() as conns:
+            cohort_engine.refresh(*conns, version=etag)
+        return jsonify(query())
+
+    try:
+        return conditional_get(_build, tables=COHORT_TABLES)
+    except Exception as e:
+        app.logger.error(f'Cohort analytics query failed: {str(e)}')
+        return jsonify({'error': 'Failed to compute analytics'}), 500
+
+def _cohort_by_param(default=None):
+    by = request.args.get('by', default)
+    if by not in (None, 'age', 'gender'):
+        raise ValueError('by must be age or gender')
+    return by
+
+def _date_param(name):
+    value = request.args.get(name)
+    return datetime.strptime(value, '%Y-%m-%d').date() if value else None
+
+@app.route('/analytics/visits', methods=['GET'])
+def get_visits_per_month():
+    """Visits and distinct patients per month; optional from/to (YYYY-MM-DD)"""
+    try:
+        start, end = _date_param('from'), _date_param('to')
+    except ValueError:
+        return jsonify({'success': False, 'message': 'from/to must be YYYY-MM-DD'}), 400
+    return cohort_query(lambda: {'months': cohort_engine.visits_per_month(start, end)})
+
+@app.route('/analytics/prevalence', methods=['GET'])
+def get_diagnosis_prevalence():
+    """Diagnosis prevalence per age band or gender (by=age|gender, top)"""
+    try:
+        by = _cohort_by_param('age')
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    top = min(max(request.args.get('top', default=10, type=int), 1), 100)
+    return cohort_query(lambda: {'by': by, 'cohorts': cohort_engine.diagnosis_prevalence(by, top)})
+
+@app.route('/analytics/doctors/workload', methods=['GET'])
+def get_doctor_workload_distribution():
+    """Records and patients per doctor: percentiles and histogram (bins)"""
+    bins = min(max(request.args.get('bins', default=10, type=int), 1), 100)
+    return cohort_query(lambda: cohort_engine.doctor_workload(bins))
+
+@app.route('/analytics/follow_ups', methods=['GET'])
+def get_follow_up_adherence():
+    """Follow-up adherence rate (grace_days, optional by=age|gender)"""
+    try:
+        by = _cohort_by_param()
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    grace_days = min(max(request.args.get('grace_days', default=14, type=int), 0), 365)
+    return cohort_query(lambda: cohort_engine.follow_up_adherence(grace_days, by))
+
+def build_user_dashboard(user_id, recent_limit=10, follow_up_limit=5):
+    """Build the joined dashboard view for a user from one indexed query."""
+    with get_connection(user_id) as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT hr.record_id, hr.doctor_id, hr.diagnosis, hr.record_date, hr.file_path,
+                   d.doctor_id IS NOT NULL AS doctor_exists, d.name AS doctor_name, d.specialization AS doctor_specialization,
+                   d.contact_number AS doctor_contact_number, d.email AS doctor_email,
+                   t.treatment_id, t.medication, t.procedure, t.follow_up_date
+            FROM health_records_all hr
+            LEFT JOIN doctors d ON d.doctor_id = hr.doctor_id
+            LEFT JOIN treatment_all t ON t.record_id = hr.record_id
+            WHERE hr.user_id = ?
+            ORDER BY hr.record_date DESC, hr.record_id DESC, t.treatment_id DESC
+        """, (user_id,))
+        rows = cursor.fetchall()
+
+    today = datetime.now().strftime('%Y-%m-%d')
+    records = {}
+    doctors = {}
+    treatments = []
+    for row in rows:
+        record_id = row['record_id']
+        if record_id not in records:
+            records[record_id] = {
+                'record_id': record_id,
+                'user_id': user_id,
+                'doctor_id': row['doctor_id'],
+                'diagnosis': row['diagnosis'],
+                'record_date': row['record_date'],
+                'file_path': row['file_path'],
+                'doctor_name': row['doctor_name'],
+                'doctor_specialization': row['doctor_specialization']
+            }
+            doctor = doctors.get(row['doctor_id'])
+            if doctor is not None:
+                doctor['visits'] += 1
+            elif row['doctor_exists']:
+                # Rows arrive newest first, so the first visit seen is the latest;
+                # records can outlive a deleted doctor, who is not listed
+                doctors[row['doctor_id']] = {
+                    'doctor_id': row['doctor_id'],
+                    'name': row['doctor_name'],
+                    'specialization': row['doctor_specialization'],
+                    'contact_number': row['doctor_contact_number'],
+                    'email': row['doctor_email'],
+                    'visits': 1,
+                    'last_visit': row['record_date']
+                }
+
+        if row['treatment_id'] is not None:
+            treatments.append({
+                'treatment_id': row['treatment_id'],
+                'record_id': record_id,
+                'medication': row['medication'],
+                'procedure': row['procedure'],
+                'follow_up_date': row['follow_up_date'],
+                'diagnosis': row['diagnosis'],
+                'record_date': row['record_date'],
+                'doctor_id': row['doctor_id'],
+                'doctor_name': row['doctor_name'] or 'Unknown Doctor',
+                'doctor_specialization': row['doctor_specialization']
+            })
+
+    active_treatments = sorted(
+        (t for t in treatments if t['follow_up_date'] and t['follow_up_date'] >= today),
+        key=lambda t: t['follow_up_date']
+    )
+    overdue = sum(1 for t in treatments if t['follow_up_date'] and t['follow_up_date'] < today)
+
+    return {
+        'user_id': user_id,
+        'counts': {
+            'total_records': len(records),
+            'total_treatments': len(treatments),
+            'visited_doctors': len(doctors),
+            'active_treatments': len(active_treatments),
+            'overdue_follow_ups': overdue
+        },
+        'recent_records': list(records.values())[:recent_limit],
+        'active_treatments': active_treatments,
+        'upcoming_follow_ups': [
+            {
+                'treatment_id': t['treatment_id'],
+                'follow_up_date': t['follow_up_date'],
+                'medication': t['medication'],
+                'diagnosis': t['diagnosis'],
+                'doctor_name': t['doctor_name']
+            }
+            for t in active_treatments[:follow_up_limit]
+        ],
+        'treatment_history': treatments,
+        'visited_doctors': list(doctors.values())
+    }
+
+@app.route('/users/<int:user_id>/dashboard', methods=['GET'])
+def get_user_dashboard(user_id):
+    """Get the user's pre-joined dashboard (records, treatments, doctors, follow-ups)"""
+    try:
+        recent_limit = max(request.args.get('recent', default=10, type=int), 0)
+
+        def _build():
+            etag, _ = table_versions.validators(user_id=user_id)
+            cache_key = f"dashboard_{user_id}_{recent_limit}"
+            if DASHBOARD_CACHE_TTL > 0:
+                cached = dashboard_cache.get(cache_key)
+                if cached and cached[0] == etag and cached[1] > time.time():
+                    return json_response(cached[2])
+
+            body = dumps(build_user_dashboard(user_id, recent_limit))
+            if DASHBOARD_CACHE_TTL > 0:
+                dashboard_cache.put(cache_key, (etag, time.time() + DASHBOARD_CACHE_TTL, body))
+            return json_response(body)
+
+        return conditional_get(_build, user_id=user_id)
+    except Exception as e:
+        app.logger.error(f'Failed to get dashboard: {str(e)}')
+        return jsonify({'error': 'Failed to get dashboard'}), 500
+
+CHANGE_STREAM_HEARTBEAT = 15    # seconds between keep-alive comments
+CHANGE_STREAM_MAX_SECONDS = 300  # clients reconnect with Last-Event-ID afterwards
+
+def _change_cursor(change_log):
+    """Resume point: Last-Event-ID (set by EventSource on reconnect), ?since=, or now."""
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+    if last_event_id is not None:
+        return last_event_id
+    return request.args.get('since', default=change_log.latest_seq, type=int)
+
+def _change_feed_shard(user_id):
+    """The shard whose change log carries user_id's changes (and the shared
+    doctors table), or None when the feed would span shards"""
+    if user_id is not None:
+        return shards.for_user(user_id)
+    return shards.catalog if len(shards) == 1 else None
+
+@app.route('/changes', methods=['GET'])
+def get_changes():
+    """Change-log entries after ?since=<seq> for ?user_id (plus shared tables); 410 means resync"""
+    user_id = request.args.get('user_id', type=int)
+    shard = _change_feed_shard(user_id)
+    if shard is None:
+        return jsonify({'success': False, 'message': 'user_id is required when data is sharded'}), 400
+    change_log = change_log_for(shard)
+    since = _change_cursor(change_log)
+    limit = min(max(request.args.get('limit', default=500, type=int), 1), 1000)
+    if change_log.needs_resync(since):
+        return jsonify({'resync': True, 'latest_seq': change_log.latest_seq}), 410
+    try:
+        with shard.connection() as conn:
+            changes = change_log.changes_since(conn, since, user_id, limit)
+        return jsonify({
+            'changes': changes,
+            'next_since': changes[-1]['seq'] if changes else since,
+            'has_more': len(changes) == limit
+        })
+    except Exception as e:
+        app.logger.error(f'Failed to read change log: {str(e)}')
+        return jsonify({'error': 'Failed to read changes'}), 500
+
+def _stream_cursors(logs):
+    """Per-log resume points for the change stream, from Last-Event-ID, ?since=
+    (comma-separated seqs, one per log) or now; None when they don't fit logs"""
+    value = request.headers.get('Last-Event-ID') or request.args.get('since')
+    if not value:
+        return [log.latest_seq for log in logs]
+    try:
+        cursors = [int(seq) for seq in value.split(',')]
+    except ValueError:
+        return None
+    return cursors if len(cursors) == len(logs) else None
+
+@app.route('/changes/stream', methods=['GET'])
+def stream_changes():
+    """Server-Sent Events feed of change-log entries, resumable by seq.
+
+    With ?user_id the feed is that user's shard's log filtered to the user;
+    without it, every shard's log unfiltered, with doctor changes from the
+    catalog's log only. Events: 'change' (id = the
+    cursor after it, data = entry) and 'resync' when the cursor predates
+    compaction and the client must refetch its data.
+    """
+    user_id = request.args.get('user_id', type=int)
+    feed_shards = [shards.for_user(user_id)] if user_id is not None else list(shards)
+    logs = [change_log_for(shard) for shard in feed_shards]
+    since = _stream_cursors(logs)
+
+    def _events():
+        cursors = since
+        if cursors is None or any(log.needs_resync(seq) for log, seq in zip(logs, cursors)):
+            cursors = [log.latest_seq for log in logs]
+            yield f"id: {','.join(map(str, cursors))}\nevent: resync\ndata: {{}}\n\n"
+        deadline = time.time() + CHANGE_STREAM_MAX_SECONDS
+        while time.time() < deadline:
+            # Read before querying: everything up to seen is committed, so an
+            # empty result means none of it is for this feed
+            seen = [log.latest_seq for log in logs]
+            sent = False
+            for index, (shard, change_log) in enumerate(zip(feed_shards, logs)):
+                with shard.connection() as conn:
+                    # Every shard logs its copy of a doctor change; unfiltered, the catalog's stands for all
+                    changes = change_log.changes_since(conn, cursors[index], user_id,
+                                                       shared=user_id is not None or shard is shards.catalog)
+                for change in changes:
+                    cursors[index] = change['seq']
+                    yield f"id: {','.join(map(str, cursors))}\nevent: change\ndata: {json.dumps(change)}\n\n"
+                sent = sent or bool(changes)
+            if sent:
+                continue
+            cursors = [max(seq, latest) for seq, latest in zip(cursors, seen)]
+            if not wait_for_any(logs, seen, CHANGE_STREAM_HEARTBEAT):
+                yield ": keep-alive\n\n"
+
+    response = app.response_class(_events(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/search', methods=['GET'])
+def search_records():
+    """Full-text search over diagnoses, medications and procedures.
+
+    Query params: q (required), user_id, type (all|records|treatments),
+    limit (max 100), offset.
+    """
+    if not SEARCH_ENABLED:
+        return jsonify({'success': False, 'message': 'Search is not available'}), 503
+
+    query = request.args.get('q', '').strip()
+    search_type = request.args.get('type', 'all')
+    if not query:
+        return jsonify({'success': False, 'message': 'q is required'}), 400
+    if search_type not in search.SEARCH_TYPES:
+        return jsonify({'success': False, 'message': f'type must be one of {", ".join(search.SEARCH_TYPES)}'}), 400
+
+    user_id = request.args.get('user_id', type=int)
+    limit = min(max(request.args.get('limit', default=20, type=int), 1), 100)
+    offset = max(request.args.get('offset', default=0, type=int), 0)
+    try:
+        if user_id is not None:
+            with get_connection(user_id) as conn:
+                results = search.search(conn, query, user_id, search_type, limit, offset, archive.SCHEMAS)
+        else:
+            # Every shard's best limit + offset hits, merged into the requested page
+            results = search.merge_results(shards.fan_out(
+                lambda conn: search.search(conn, query, None, search_type, limit + offset, 0, archive.SCHEMAS)),
+                limit, offset)
+        return jsonify({
+            'success': True,
+            'query': query,
+            'results': results,
+            'limit': limit,
+            'offset': offset,
+            'has_more': len(results) == limit
+        })
+    except Exception as e:
+        app.logger.error(f'Search failed: {str(e)}')
+        return jsonify({'success': False, 'message': 'Search failed'}), 500
+
+@app.route('/autocomplete', methods=['GET'])
+def autocomplete():
+    """Suggest diagnoses, medications or specializations by prefix, most frequent first"""
+    field = request.args.get('field', 'diagnosis')
+    if field not in autocomplete_index.FIELDS:
+        return jsonify({'success': False, 'message': f'field must be one of {", ".join(autocomplete_index.FIELDS)}'}), 400
+    prefix = request.args.get('q', '')
+    limit = min(max(request.args.get('limit', default=10, type=int), 1), 50)
+    suggestions = autocomplete_index.suggest(field, prefix, limit)
+    return jsonify({
+        'field': field,
+        'query': prefix,
+        'suggestions': [{'text': text, 'count': count} for text, count in suggestions]
+    })
+
 # POST endpoints for adding new data
 @app.route('/health_records', methods=['POST'])
 def add_health_record():
@@ -157,8 +1041,10 @@ def add_health_record():
         if not data:
             return jsonify({'success': False, 'message': 'No data provided'}), 400
 
+        shard = shards.for_user(data['user_id'])
+
         def _insert():
-            with get_connection() as conn:
+            with shard.connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute("""
                     INSERT INTO health_records (user_id, doctor_id, diagnosis, record_date, file_path)
@@ -181,11 +1067,13 @@ def add_health_record():
                     'record_date': data.get('record_date', datetime.now().strftime('%Y-%m-%d')),
                     'file_path': data.get('file_path', None)
                 }
-                health_aggregator.add_health_record(record_data)
+                seq = change_log_for(shard).append(conn, 'health_records', 'insert', record_id, data['user_id'], record_data)
                 
-                return record_id
+            publish_changes(seq, shard)
+            table_versions.bump('health_records', user_id=data['user_id'])
+            return record_id
 
-        record_id = execute_write(_insert)
+        record_id = execute_write(_insert, shard)
         return jsonify({'success': True,'message': 'Health record added successfully','record_id': record_id}), 201
     except Exception as e:
         app.logger.error(f'Error adding health record: {str(e)}')
@@ -198,8 +1086,11 @@ def add_treatment():
         if not data:
             return jsonify({'success': False, 'message': 'No data provided'}), 400
 
+        # Next to its record; a treatment for an unknown record stays in the catalog
+        shard = record_shard(data['record_id']) or shards.catalog
+
         def _insert():
-            with get_connection() as conn:
+            with shard.connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute("""
                     INSERT INTO treatment (record_id, medication, procedure, follow_up_date)
@@ -211,31 +1102,23 @@ def add_treatment():
                     data.get('follow_up_date', None)
                 ))
                 treatment_id = cursor.lastrowid
+                owner_id = _record_owner(cursor, data['record_id'])
+                if data.get('follow_up_date'):
+                    # Rejects a malformed date before it reaches the priority queue
+                    datetime.fromisoformat(data['follow_up_date'])
+                seq = change_log_for(shard).append(conn, 'treatment', 'insert', treatment_id, owner_id, {
+                    'treatment_id': treatment_id,
+                    'record_id': data['record_id'],
+                    'medication': data['medication'],
+                    'procedure': data.get('procedure', None),
+                    'follow_up_date': data.get('follow_up_date', None)
+                })
                 
-                # Add to priority queue if follow-up date exists
-                if data.get('follow_up_date') and treatment_id is not None:
-                    follow_up_date = datetime.fromisoformat(data['follow_up_date'])
-                    # Determine severity from associated health record
-                    cursor.execute("SELECT diagnosis FROM health_records WHERE record_id = ?", (data['record_id'],))
-                    diagnosis_row = cursor.fetchone()
-                    
-                    if diagnosis_row:
-                        # Create temporary HealthRecord to determine severity
-                        temp_record = HealthRecord(
-                            record_id=data['record_id'],
-                            user_id=0,  # Not needed for severity calculation
-                            doctor_id=0,  # Not needed for severity calculation
-                            diagnosis=diagnosis_row[0],
-                            record_date=datetime.now()
-                        )
-                        
-                        health_aggregator.treatment_queue.add_treatment(
-                            treatment_id, follow_up_date, temp_record.severity
-                        )
-                
-                return treatment_id
+            publish_changes(seq, shard)
+            table_versions.bump('treatment', user_id=owner_id)
+            return treatment_id
 
-        treatment_id = execute_write(_insert)
+        treatment_id = execute_write(_insert, shard)
         return jsonify({'success': True,'message': 'Treatment added successfully','treatment_id': treatment_id}), 201
     except Exception as e:
         app.logger.error(f'Error adding treatment: {str(e)}')
@@ -261,21 +1144,21 @@ def add_doctor():
                     data.get('email', None)
                 ))
                 doctor_id = cursor.lastrowid
+                seq = change_log_for(shards.catalog).append(conn, 'doctors', 'insert', doctor_id, None, {
+                    'doctor_id': doctor_id,
+                    'name': data['name'],
+                    'specialization': data.get('specialization', None),
+                    'contact_number': data.get('contact_number', None),
+                    'email': data.get('email', None)
+                })
                 
-                # Add to doctor analytics
-                if doctor_id is not None:
-                    doctor = Doctor(
-                        doctor_id=doctor_id,
-                        name=data['name'],
-                        specialization=data.get('specialization', ''),
-                        contact_number=data.get('contact_number', ''),
-                        email=data.get('email', '')
-                    )
-                    health_aggregator.doctor_analytics.add_doctor(doctor)
-                
-                return doctor_id
+            publish_changes(seq)
+            return doctor_id
 
+        # Written to the catalog only; the other shards copy it from there
         doctor_id = execute_write(_insert)
+        sync_doctor_copies()
+        table_versions.bump('doctors')
         return jsonify({'success': True,'message': 'Doctor added successfully','doctor_id': doctor_id}), 201
     except Exception as e:
         app.logger.error(f'Error adding doctor: {str(e)}')
@@ -288,41 +1171,160 @@ def add_user():
         if not data:
             return jsonify({'success': False, 'message': 'No data provided'}), 400
 
-        def _insert():
+        # Hash outside the write lock; the KDF is deliberately slow
+        password_hash = hash_password(data['password'])
+        email = normalize_email(data['email'])
+
+        def _reserve():
             with get_connection() as conn:
+                return shards.reserve_user_id(conn, email)
+
+        # The id decides the shard, so the catalog's user directory issues it first
+        user_id = execute_write(_reserve)
+        shard = shards.for_user(user_id)
+
+        def _insert():
+            with shard.connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute("""
-                    INSERT INTO users (name, age, gender, contact_number, email, password)
-                    VALUES (?, ?, ?, ?, ?, ?)
+                    INSERT INTO users (user_id, name, age, gender, contact_number, email, password)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
                 """, (
+                    user_id,
                     data['name'],
                     data.get('age', None),
                     data['gender'],
                     data['contact_number'],
-                    data['email'],
-                    data['password']
+                    email,
+                    password_hash
                 ))
-                return cursor.lastrowid
-
-        user_id = execute_write(_insert)
+                seq = change_log_for(shard).append(conn, 'users', 'insert', user_id, user_id, {
+                    'user_id': user_id,
+                    'name': data['name'],
+                    'age': data.get('age', None),
+                    'gender': data['gender'],
+                    'contact_number': data['contact_number'],
+                    'email': email
+                })
+            publish_changes(seq, shard)
+            table_versions.bump('users', user_id=user_id)
+
+        execute_write(_insert, shard)
         return jsonify({'success': True,'message': 'User registered successfully','user_id': user_id}), 201
     except Exception as e:
         app.logger.error(f'Error registering user: {str(e)}')
         return jsonify({'success': False,'message': 'Error registering user'}), 400
 
+# ============== AUTHENTICATION ENDPOINTS ==============
+@app.route('/login', methods=['POST'])
+def login():
+    """Verify credentials with indexed lookups (email in the user directory, then
+    the user's row on their shard) and issue a session token"""
+    try:
+        data = request.get_json()
+        if not data or not data.get('email') or not data.get('password'):
+            return jsonify({'success': False, 'message': 'Email and password are required'}), 400
+
+        row = None
+        email = normalize_email(data['email'])
+        user_id = shards.lookup_user_id(email)
+        if user_id is None and email != data['email']:
+            # Registered before emails were normalized
+            user_id = shards.lookup_user_id(data['email'])
+        if user_id is not None:
+            with get_connection(user_id) as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
+                row = cursor.fetchone()
+
+        if row is None:
+            # Spend the KDF time a wrong password would, so timing doesn't reveal registered emails
+            verify_password(data['password'], dummy_password_hash())
+        if row is None or not verify_password(data['password'], row['password']):
+            return jsonify({'success': False, 'message': 'Invalid email or password'}), 401
+
+        user = public_user(row)
+        # Upgrade legacy plaintext or outdated-cost hashes while we know the password
+        new_hash = hash_password(data['password']) if needs_rehash(row['password']) else None
+
+        def _rehash():
+            with get_connection(user_id) as conn:
+                conn.execute("UPDATE users SET password = ? WHERE user_id = ?", (new_hash, user_id))
+
+        def _create_session():
+            with get_connection() as conn:
+                return session_store.create(conn, user)
+
+        if new_hash:
+            execute_write(_rehash, shards.for_user(user_id))
+        token, expires_at = execute_write(_create_session)
+        return jsonify({
+            'success': True,
+            'user': user,
+            'token': token,
+            'expires_at': datetime.fromtimestamp(expires_at).isoformat()
+        }), 200
+    except Exception as e:
+        app.logger.error(f'Error logging in: {str(e)}')
+        return jsonify({'success': False, 'message': 'Login failed'}), 500
+
+@app.route('/session', methods=['GET'])
+def get_session():
+    """Return the user for the bearer token, served from the session cache"""
+    user = session_store.get_user(bearer_token())
+    if user is None:
+        return jsonify({'success': False, 'message': 'Invalid or expired session'}), 401
+    return jsonify({'success': True, 'user': user}), 200
+
+@app.route('/logout', methods=['POST'])
+def logout():
+    try:
+        token = bearer_token()
+        if not token:
+            return jsonify({'success': False, 'message': 'No session token provided'}), 400
+
+        def _delete():
+            with get_connection() as conn:
+                return session_store.delete(conn, token)
+
+        execute_write(_delete)
+        return jsonify({'success': True, 'message': 'Logged out successfully'}), 200
+    except Exception as e:
+        app.logger.error(f'Error logging out: {str(e)}')
+        return jsonify({'success': False, 'message': 'Error logging out'}), 400
+
 # DELETE endpoints for removing data
 @app.route('/health_records/<int:record_id>', methods=['DELETE'])
 def delete_health_record(record_id):
     try:
+        shard = record_shard(record_id)
+        if shard is None:
+            return jsonify({'success': False,'message': 'Health record not found'}), 404
+
         def _delete():
-            with get_connection() as conn:
+            with shard.connection() as conn:
                 cursor = conn.cursor()
-                cursor.execute("DELETE FROM treatment WHERE record_id = ?", (record_id,))
-                cursor.execute("DELETE FROM health_records WHERE record_id = ?", (record_id,))
-                if cursor.rowcount == 0:
+                # Archived records and their treatments are deleted from the cold tables
+                treatments, row = [], None
+                for schema in archive.SCHEMAS:
+                    cursor.execute(f"DELETE FROM {schema}.treatment WHERE record_id = ? RETURNING treatment_id, medication",
+                                   (record_id,))
+                    treatments += cursor.fetchall()
+                    cursor.execute(f"DELETE FROM {schema}.health_records WHERE record_id = ? "
+                                   f"RETURNING user_id, diagnosis, doctor_id", (record_id,))
+                    row = cursor.fetchone() or row
+                if row is None:
                     return False
-                return True
-        deleted = execute_write(_delete)
+                change_log = change_log_for(shard)
+                for treatment in treatments:
+                    change_log.append(conn, 'treatment', 'delete', treatment[0], row[0])
+                seq = change_log.append(conn, 'health_records', 'delete', record_id, row[0])
+            publish_changes(seq, shard)
+            cohort_engine.invalidate('health_records', [record_id])
+            cohort_engine.invalidate('treatment', [t[0] for t in treatments])
+            table_versions.bump('health_records', 'treatment', user_id=row[0])
+            return True
+        deleted = execute_write(_delete, shard)
         if not deleted:
             return jsonify({'success': False,'message': 'Health record not found'}), 404
         return jsonify({'success': True,'message': 'Health record deleted successfully'}), 200
@@ -333,14 +1335,26 @@ def delete_health_record(record_id):
 @app.route('/treatment/<int:treatment_id>', methods=['DELETE'])
 def delete_treatment(treatment_id):
     try:
+        shard = treatment_shard(treatment_id)
+        if shard is None:
+            return jsonify({'success': False,'message': 'Treatment not found'}), 404
+
         def _delete():
-            with get_connection() as conn:
+            with shard.connection() as conn:
                 cursor = conn.cursor()
-                cursor.execute("DELETE FROM treatment WHERE treatment_id = ?", (treatment_id,))
-                if cursor.rowcount == 0:
+                schema = archive.where(conn, 'treatment', 'treatment_id', treatment_id) or 'main'
+                cursor.execute(f"DELETE FROM {schema}.treatment WHERE treatment_id = ? RETURNING record_id, medication",
+                               (treatment_id,))
+                row = cursor.fetchone()
+                if row is None:
                     return False
-                return True
-        deleted = execute_write(_delete)
+                owner_id = _record_owner(cursor, row[0])
+                seq = change_log_for(shard).append(conn, 'treatment', 'delete', treatment_id, owner_id)
+            publish_changes(seq, shard)
+            cohort_engine.invalidate('treatment', [treatment_id])
+            table_versions.bump('treatment', user_id=owner_id)
+            return True
+        deleted = execute_write(_delete, shard)
         if not deleted:
             return jsonify({'success': False,'message': 'Treatment not found'}), 404
         return jsonify({'success': True,'message': 'Treatment deleted successfully'}), 200
@@ -352,59 +1366,41 @@ def delete_treatment(treatment_id):
 def delete_doctor(doctor_id):
     try:
         def _delete():
-            """Cascade delete doctor:
-            1. Collect all health record IDs for this doctor.
-            2. Delete related treatments.
-            3. Delete related health records.
-            4. Delete doctor.
+            """Delete the doctor from the catalog with the history stored there
+            (rowcount of the RETURNING doubles as the existence check).
             Returns dict with counts or status flags.
             """
             with get_connection() as conn:
                 cursor = conn.cursor()
-
-                # Confirm doctor exists first
-                cursor.execute("SELECT 1 FROM doctors WHERE doctor_id = ?", (doctor_id,))
+                cursor.execute("DELETE FROM doctors WHERE doctor_id = ? RETURNING doctor_id", (doctor_id,))
                 if cursor.fetchone() is None:
                     return {'status': 'NOT_FOUND'}
-
-                # Gather related health records
-                cursor.execute("SELECT record_id FROM health_records WHERE doctor_id = ?", (doctor_id,))
-                rec_rows = cursor.fetchall()
-                record_ids = [row[0] for row in rec_rows]
-
-                treatments_deleted = 0
-                records_deleted = 0
-
-                if record_ids:
-                    # Delete treatments referencing those records (chunk if large)
-                    # (Using simple approach; record_ids list is usually small for this app.)
-                    placeholders = ','.join(['?'] * len(record_ids))
-                    cursor.execute(f"DELETE FROM treatment WHERE record_id IN ({placeholders})", record_ids)
-                    treatments_deleted = cursor.rowcount
-
-                    # Delete health records
-                    cursor.execute(f"DELETE FROM health_records WHERE record_id IN ({placeholders})", record_ids)
-                    records_deleted = cursor.rowcount
-
-                # Finally delete doctor
-                cursor.execute("DELETE FROM doctors WHERE doctor_id = ?", (doctor_id,))
-                doctor_deleted = cursor.rowcount
-
-                return {
-                    'status': 'DELETED' if doctor_deleted else 'NOT_FOUND',
-                    'records_deleted': records_deleted,
-                    'treatments_deleted': treatments_deleted
-                }
+                records_deleted, treatments_deleted = delete_doctor_history(conn, shards.catalog, doctor_id)
+                seq = change_log_for(shards.catalog).append(conn, 'doctors', 'delete', doctor_id)
+
+            publish_changes(seq)
+            return {
+                'status': 'DELETED',
+                'records_deleted': records_deleted,
+                'treatments_deleted': treatments_deleted
+            }
 
         result = execute_write(_delete)
-        if result and result.get('status') == 'NOT_FOUND':
+        if result['status'] == 'NOT_FOUND':
             return jsonify({'success': False, 'message': 'Doctor not found'}), 404
+        # The copies on the other shards, with the records of their patients there
+        records_deleted, treatments_deleted = sync_doctor_copies()
+        result['records_deleted'] += records_deleted
+        result['treatments_deleted'] += treatments_deleted
+        cohort_engine.invalidate('health_records')
+        cohort_engine.invalidate('treatment')
+        table_versions.bump('doctors', 'health_records', 'treatment', all_users=True)
         return jsonify({
             'success': True,
             'message': 'Doctor and related data deleted successfully',
             'details': {
-                'health_records_deleted': result.get('records_deleted', 0) if result else 0,
-                'treatments_deleted': result.get('treatments_deleted', 0) if result else 0
+                'health_records_deleted': result['records_deleted'],
+                'treatments_deleted': result['treatments_deleted']
             }
         }), 200
     except Exception as e:
@@ -422,12 +1418,7 @@ def update_doctor(doctor_id):
         def _update():
             with get_connection() as conn:
                 cursor = conn.cursor()
-                
-                # Check if doctor exists
-                cursor.execute("SELECT 1 FROM doctors WHERE doctor_id = ?", (doctor_id,))
-                if cursor.fetchone() is None:
-                    return {'status': 'NOT_FOUND'}
-                
+
                 # Update doctor
                 cursor.execute("""
                     UPDATE doctors 
@@ -441,11 +1432,24 @@ def update_doctor(doctor_id):
                     doctor_id
                 ))
                 
-                return {'status': 'UPDATED'}
+                if cursor.rowcount == 0:
+                    return {'status': 'NOT_FOUND'}
+                seq = change_log_for(shards.catalog).append(conn, 'doctors', 'update', doctor_id, None, {
+                    'doctor_id': doctor_id,
+                    'name': data.get('name'),
+                    'specialization': data.get('specialization'),
+                    'contact_number': data.get('contact_number'),
+                    'email': data.get('email')
+                })
+            publish_changes(seq)
+            return {'status': 'UPDATED'}
 
         result = execute_write(_update)
-        if result and result.get('status') == 'NOT_FOUND':
+        if result['status'] == 'NOT_FOUND':
             return jsonify({'success': False, 'message': 'Doctor not found'}), 404
+        sync_doctor_copies()
+        # Doctor details are embedded in every patient's views
+        table_versions.bump('doctors', all_users=True)
         
         return jsonify({'success': True, 'message': 'Doctor updated successfully'}), 200
     except Exception as e:
@@ -459,20 +1463,23 @@ def update_health_record(record_id):
         if not data:
             return jsonify({'success': False, 'message': 'No data provided'}), 400
 
+        shard = record_shard(record_id)
+        if shard is None:
+            return jsonify({'success': False, 'message': 'Health record not found'}), 404
+
         def _update():
-            with get_connection() as conn:
+            with shard.connection() as conn:
                 cursor = conn.cursor()
-                
-                # Check if record exists
-                cursor.execute("SELECT 1 FROM health_records WHERE record_id = ?", (record_id,))
-                if cursor.fetchone() is None:
-                    return {'status': 'NOT_FOUND'}
-                
+
+                # Archived records are updated where they are
+                schema = archive.where(conn, 'health_records', 'record_id', record_id) or 'main'
+
                 # Update health record
-                cursor.execute("""
-                    UPDATE health_records 
+                cursor.execute(f"""
+                    UPDATE {schema}.health_records
                     SET doctor_id = ?, diagnosis = ?, record_date = ?, file_path = ?
                     WHERE record_id = ?
+                    RETURNING user_id, record_id, doctor_id, diagnosis, record_date, file_path
                 """, (
                     data.get('doctor_id'),
                     data.get('diagnosis'),
@@ -480,10 +1487,16 @@ def update_health_record(record_id):
                     data.get('file_path'),
                     record_id
                 ))
-                
-                return {'status': 'UPDATED'}
+                row = cursor.fetchone()
+                if row is None:
+                    return {'status': 'NOT_FOUND'}
+                seq = change_log_for(shard).append(conn, 'health_records', 'update', record_id, row[0], dict(row))
+            publish_changes(seq, shard)
+            cohort_engine.invalidate('health_records', [record_id])
+            table_versions.bump('health_records', user_id=row[0])
+            return {'status': 'UPDATED'}
 
-        result = execute_write(_update)
+        result = execute_write(_update, shard)
         if result and result.get('status') == 'NOT_FOUND':
             return jsonify({'success': False, 'message': 'Health record not found'}), 404
         
@@ -499,30 +1512,39 @@ def update_treatment(treatment_id):
         if not data:
             return jsonify({'success': False, 'message': 'No data provided'}), 400
 
+        shard = treatment_shard(treatment_id)
+        if shard is None:
+            return jsonify({'success': False, 'message': 'Treatment not found'}), 404
+
         def _update():
-            with get_connection() as conn:
+            with shard.connection() as conn:
                 cursor = conn.cursor()
-                
-                # Check if treatment exists
-                cursor.execute("SELECT 1 FROM treatment WHERE treatment_id = ?", (treatment_id,))
-                if cursor.fetchone() is None:
-                    return {'status': 'NOT_FOUND'}
-                
+
+                schema = archive.where(conn, 'treatment', 'treatment_id', treatment_id) or 'main'
+
                 # Update treatment
-                cursor.execute("""
-                    UPDATE treatment 
+                cursor.execute(f"""
+                    UPDATE {schema}.treatment
                     SET medication = ?, procedure = ?, follow_up_date = ?
                     WHERE treatment_id = ?
+                    RETURNING record_id, treatment_id, medication, procedure, follow_up_date
                 """, (
                     data.get('medication'),
                     data.get('procedure'),
                     data.get('follow_up_date'),
                     treatment_id
                 ))
-                
-                return {'status': 'UPDATED'}
-
-        result = execute_write(_update)
+                row = cursor.fetchone()
+                if row is None:
+                    return {'status': 'NOT_FOUND'}
+                owner_id = _record_owner(cursor, row[0])
+                seq = change_log_for(shard).append(conn, 'treatment', 'update', treatment_id, owner_id, dict(row))
+            publish_changes(seq, shard)
+            cohort_engine.invalidate('treatment', [treatment_id])
+            table_versions.bump('treatment', user_id=owner_id)
+            return {'status': 'UPDATED'}
+
+        result = execute_write(_update, shard)
         if result and result.get('status') == 'NOT_FOUND':
             return jsonify({'success': False, 'message': 'Treatment not found'}), 404
         
@@ -531,77 +1553,138 @@ def update_treatment(treatment_id):
         app.logger.error(f'Error updating treatment: {str(e)}')
         return jsonify({'success': False, 'message': 'Error updating treatment'}), 400
 
-# ============== AI HEALTH INSIGHTS ENDPOINT ==============
-@app.route('/api/health-insights/<int:user_id>', methods=['GET'])
-def get_health_insights(user_id):
-    """Generate personalized health insights using Hugging Face AI"""
+# ============== AI ROUTES: SHARED MODEL CALLS ==============
+# Each AI route is split into prepare (DB reads and the prompt), the model
+# fallback chain, and finish (parsing the answer). The Flask routes below run
+# the chain with blocking calls; asgi.py serves the same routes with the chain
+# awaited, so a request waiting on a model does not hold a worker thread.
+# prepare_* returns (payload, state), or (None, (body, status)) when the
+# request is answered without a model.
+
+def completion_headers():
+    return {
+        'Authorization': f'Bearer {HUGGINGFACE_API_KEY}',
+        'Content-Type': 'application/json'
+    }
+
+def completion_payload(messages, max_tokens, temperature):
+    """Chat completion body; 'model' is set per attempt by the fallback chain."""
+    return {"messages": messages, "max_tokens": max_tokens, "temperature": temperature}
+
+def completion_text(response_data):
+    """Assistant text of an OpenAI-format chat completion."""
+    return response_data['choices'][0]['message']['content']
+
+def call_models(feature, payload, timeout, accept=None):
+    """Try HUGGINGFACE_MODELS in order until one answers 200 and its text passes
+    accept (which may transform it, or raise to reject the model's answer).
+    Returns (result, None), or (None, last_error) when every model failed."""
+    headers = completion_headers()
+    last_error = None
+    for model_name in HUGGINGFACE_MODELS:
+        try:
+            app.logger.info("%s trying model: %s", feature, model_name)
+            response = post_completion(feature, headers, dict(payload, model=model_name), timeout=timeout)
+            if response.status_code != 200:
+                last_error = f"Status {response.status_code}: {response.text[:200]}"
+                app.logger.warning("%s model %s failed: %s", feature, model_name, last_error)
+                continue
+            text = completion_text(response.json())
+            result = accept(text) if accept else text
+            app.logger.info("%s success with model: %s", feature, model_name)
+            return result, None
+        except Exception as e:
+            last_error = str(e)
+            app.logger.warning("%s model %s failed: %s", feature, model_name, last_error)
+    return None, last_error
+
+def run_ai_route(feature, *args):
+    """Serve an AI route with blocking model calls; returns (body, status)."""
+    route = AI_FEATURES[feature]
     try:
-        with get_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Fetch user's health records
-            cursor.execute("""
-                SELECT hr.*, d.name as doctor_name, d.specialization 
-                FROM health_records hr
-                LEFT JOIN doctors d ON hr.doctor_id = d.doctor_id
-                WHERE hr.user_id = ?
-                ORDER BY hr.record_date DESC
-            """, (user_id,))
-            records = [dict(row) for row in cursor.fetchall()]
-            
-            # Fetch user's treatments
-            cursor.execute("""
-                SELECT t.*, hr.diagnosis 
-                FROM treatment t
-                LEFT JOIN health_records hr ON t.record_id = hr.record_id
-                WHERE hr.user_id = ?
-                ORDER BY t.treatment_id DESC
-            """, (user_id,))
-            treatments = [dict(row) for row in cursor.fetchall()]
-            
-            # Fetch visited doctors
-            cursor.execute("""
-                SELECT DISTINCT d.* 
-                FROM doctors d
-                INNER JOIN health_records hr ON d.doctor_id = hr.doctor_id
-                WHERE hr.user_id = ?
-            """, (user_id,))
-            doctors = [dict(row) for row in cursor.fetchall()]
-        
-        # If no data, return default insights
-        if not records and not treatments:
-            return jsonify({
-                'success': True,
-                'insights': {
-                    'summary': 'Welcome to LifeTrack! Start by adding your first health record to receive personalized insights.',
-                    'trends': [],
-                    'recommendations': ['Add your first doctor visit', 'Record any ongoing treatments', 'Upload medical documents'],
-                    'statistics': {
-                        'total_records': 0,
-                        'total_doctors': 0,
-                        'total_treatments': 0
-                    }
-                }
-            }), 200
-        
-        # Prepare data for AI analysis with enhanced prompt
-        
-        # Get most recent records
-        recent_records = records[:15] if len(records) > 15 else records
-        recent_treatments = treatments[:15] if len(treatments) > 15 else treatments
+        payload, state = route['prepare'](*args)
+        if payload is None:
+            return state
+        result, last_error = call_models(feature, payload, route['timeout'], route['accept'])
+        return route['finish'](state, result, last_error)
+    except Exception as e:
+        return route['error'](e)
+
+def history_tables(full_history):
+    """(records, treatments) to read a user's history from: the hot tables,
+    or with full_history the views that add archived rows"""
+    return ('health_records_all', 'treatment_all') if full_history else ('health_records', 'treatment')
+
+# ============== AI HEALTH INSIGHTS ENDPOINT ==============
+def prepare_health_insights(user_id, full_history=False):
+    """Fetch the user's history (recent unless full_history) and build the insights prompt"""
+    records_table, treatments_table = history_tables(full_history)
+    with get_connection(user_id) as conn:
+        cursor = conn.cursor()
         
-        # Extract unique diagnoses
-        unique_diagnoses = list(set([r['diagnosis'] for r in records]))
+        # Fetch user's health records
+        cursor.execute(f"""
+            SELECT hr.*, d.name as doctor_name, d.specialization 
+            FROM {records_table} hr
+            LEFT JOIN doctors d ON hr.doctor_id = d.doctor_id
+            WHERE hr.user_id = ?
+            ORDER BY hr.record_date DESC
+        """, (user_id,))
+        records = [dict(row) for row in cursor.fetchall()]
         
-        # Calculate time span
-        if records:
-            oldest_date = min([r['record_date'] for r in records if r['record_date']])
-            newest_date = max([r['record_date'] for r in records if r['record_date']])
-            time_span = f"from {oldest_date} to {newest_date}"
-        else:
-            time_span = "recent period"
+        # Fetch user's treatments
+        cursor.execute(f"""
+            SELECT t.*, hr.diagnosis 
+            FROM {treatments_table} t
+            LEFT JOIN {records_table} hr ON t.record_id = hr.record_id
+            WHERE hr.user_id = ?
+            ORDER BY t.treatment_id DESC
+        """, (user_id,))
+        treatments = [dict(row) for row in cursor.fetchall()]
         
-        health_summary = f"""
+        # Fetch visited doctors
+        cursor.execute(f"""
+            SELECT DISTINCT d.* 
+            FROM doctors d
+            INNER JOIN {records_table} hr ON d.doctor_id = hr.doctor_id
+            WHERE hr.user_id = ?
+        """, (user_id,))
+        doctors = [dict(row) for row in cursor.fetchall()]
+    
+    # If no data, return default insights
+    if not records and not treatments:
+        return None, ({
+            'success': True,
+            'insights': {
+                'summary': 'Welcome to LifeTrack! Start by adding your first health record to receive personalized insights.',
+                'trends': [],
+                'recommendations': ['Add your first doctor visit', 'Record any ongoing treatments', 'Upload medical documents'],
+                'statistics': {
+                    'total_records': 0,
+                    'total_doctors': 0,
+                    'total_treatments': 0
+                }
+            }
+        }, 200)
+
+    # Prepare data for AI analysis with enhanced prompt
+    
+    # Get most recent records
+    recent_records = records[:15] if len(records) > 15 else records
+    recent_treatments = treatments[:15] if len(treatments) > 15 else treatments
+    
+    # Extract unique diagnoses
+    unique_diagnoses = list(set([r['diagnosis'] for r in records]))
+    
+    # Calculate time span
+    if records:
+        oldest_date = min([r['record_date'] for r in records if r['record_date']])
+        newest_date = max([r['record_date'] for r in records if r['record_date']])
+        time_span = f"from {oldest_date} to {newest_date}"
+    else:
+        time_span = "recent period"
+    
+    health_summary = f"""
 You are a healthcare analytics AI assistant. Analyze this patient's medical history and provide actionable health insights.
 
 PATIENT HEALTH PROFILE:
@@ -655,149 +1738,115 @@ Output ONLY valid JSON in this exact format:
   "trends": ["string1", "string2", "string3", "string4", "string5"],
   "recommendations": ["string1", "string2", "string3", "string4", "string5"]
 }}
-        """
-        
-        # Generate insights using Hugging Face Router API (OpenAI-compatible)
-        headers = {
-            'Authorization': f'Bearer {HUGGINGFACE_API_KEY}',
-            'Content-Type': 'application/json'
-        }
-        payload = {
-            "model": HUGGINGFACE_MODELS[0],
-            "messages": [
-                {"role": "user", "content": health_summary}
-            ],
-            "max_tokens": 800,
-            "temperature": 0.3
-        }
-        
-        hf_response = None
-        last_error = None
-        
-        # Try each model until one works
-        for model_name in HUGGINGFACE_MODELS:
-            try:
-                app.logger.info(f"Trying model: {model_name}")
-                payload["model"] = model_name
-                hf_response = requests.post(HUGGINGFACE_API_URL, headers=headers, json=payload, timeout=60)
-                
-                app.logger.info(f"Response status: {hf_response.status_code}")
-                if hf_response.status_code == 200:
-                    app.logger.info(f"Success with model: {model_name}")
-                    break  # Success! Use this model
-                else:
-                    last_error = f"Status {hf_response.status_code}: {hf_response.text}"
-                    app.logger.warning(f"Model {model_name} failed: {last_error}")
-            except Exception as e:
-                last_error = str(e)
-                app.logger.error(f"Exception with model {model_name}: {last_error}")
-                continue
-        
-        if not hf_response or hf_response.status_code != 200:
-            app.logger.error(f"All models failed. Last error: {last_error}")
-            raise Exception(f"All Hugging Face models failed. Last error: {last_error}")
-        
-        # Parse AI response from Hugging Face (OpenAI format)
-        response_data = hf_response.json()
-        ai_text = response_data['choices'][0]['message']['content']
-        
-        # Try to extract JSON from response
-        import json
-        import re
-        
-        app.logger.info(f"AI Response: {ai_text[:200]}...")  # Log first 200 chars for debugging
-        
-        # Clean up markdown code blocks if present
-        ai_text_cleaned = re.sub(r'```json\s*|\s*```', '', ai_text)
-        
-        # Look for JSON in the response
-        json_match = re.search(r'\{[^{}]*"summary"[^{}]*"trends"[^{}]*"recommendations"[^{}]*\}', ai_text_cleaned, re.DOTALL)
-        
-        if json_match:
-            try:
-                ai_insights = json.loads(json_match.group())
-                # Ensure we have all required fields
-                if not all(key in ai_insights for key in ['summary', 'trends', 'recommendations']):
-                    raise ValueError("Missing required fields")
-                # Ensure trends and recommendations are lists with at least some items
-                if not isinstance(ai_insights['trends'], list) or len(ai_insights['trends']) == 0:
-                    ai_insights['trends'] = ['Health data analysis in progress']
-                if not isinstance(ai_insights['recommendations'], list) or len(ai_insights['recommendations']) == 0:
-                    ai_insights['recommendations'] = ['Continue regular health monitoring']
-            except Exception as e:
-                app.logger.warning(f"JSON parsing failed: {e}, attempting fallback parsing")
-                # Fallback: Try to parse structured text
-                ai_insights = {
-                    'summary': ai_text[:400] if len(ai_text) > 400 else ai_text,
-                    'trends': ['Analyzing your health patterns...'],
-                    'recommendations': ['Keep maintaining your health records']
-                }
-        else:
-            app.logger.warning("No JSON found in AI response, using fallback")
-            # Smart fallback - try to extract meaningful content
-            lines = [line.strip() for line in ai_text.split('\n') if line.strip()]
+    """
+    
+    # Generate insights using Hugging Face Router API (OpenAI-compatible)
+    payload = completion_payload([{"role": "user", "content": health_summary}], max_tokens=800, temperature=0.3)
+    return payload, {'records': records, 'treatments': treatments, 'doctors': doctors}
+
+def finish_health_insights(state, ai_text, last_error):
+    if ai_text is None:
+        app.logger.error(f"All models failed. Last error: {last_error}")
+        raise Exception(f"All Hugging Face models failed. Last error: {last_error}")
+    records, treatments, doctors = state['records'], state['treatments'], state['doctors']
+
+    # Try to extract JSON from response
+    app.logger.info(f"AI Response: {ai_text[:200]}...")  # Log first 200 chars for debugging
+    
+    # Clean up markdown code blocks if present
+    ai_text_cleaned = re.sub(r'```json\s*|\s*```', '', ai_text)
+    
+    # Look for JSON in the response
+    json_match = re.search(r'\{[^{}]*"summary"[^{}]*"trends"[^{}]*"recommendations"[^{}]*\}', ai_text_cleaned, re.DOTALL)
+    
+    if json_match:
+        try:
+            ai_insights = json.loads(json_match.group())
+            # Ensure we have all required fields
+            if not all(key in ai_insights for key in ['summary', 'trends', 'recommendations']):
+                raise ValueError("Missing required fields")
+            # Ensure trends and recommendations are lists with at least some items
+            if not isinstance(ai_insights['trends'], list) or len(ai_insights['trends']) == 0:
+                ai_insights['trends'] = ['Health data analysis in progress']
+            if not isinstance(ai_insights['recommendations'], list) or len(ai_insights['recommendations']) == 0:
+                ai_insights['recommendations'] = ['Continue regular health monitoring']
+        except Exception as e:
+            app.logger.warning(f"JSON parsing failed: {e}, attempting fallback parsing")
+            # Fallback: Try to parse structured text
             ai_insights = {
-                'summary': lines[0] if lines else 'Health data analysis complete.',
-                'trends': [line.lstrip('•-*123456789. ') for line in lines[1:6] if line] or ['Regular health monitoring detected'],
-                'recommendations': [line.lstrip('•-*123456789. ') for line in lines[6:11] if line] or ['Keep updating your health records']
-            }
-        
-        # Add statistics
-        insights_response = {
-            'success': True,
-            'insights': {
-                'summary': ai_insights.get('summary', 'Analysis complete'),
-                'trends': ai_insights.get('trends', [])[:5],
-                'recommendations': ai_insights.get('recommendations', [])[:5],
-                'statistics': {
-                    'total_records': len(records),
-                    'total_doctors': len(doctors),
-                    'total_treatments': len(treatments),
-                    'recent_visits': len([r for r in records if r['record_date'] and r['record_date'].startswith('2025')])
-                }
+                'summary': ai_text[:400] if len(ai_text) > 400 else ai_text,
+                'trends': ['Analyzing your health patterns...'],
+                'recommendations': ['Keep maintaining your health records']
             }
+    else:
+        app.logger.warning("No JSON found in AI response, using fallback")
+        # Smart fallback - try to extract meaningful content
+        lines = [line.strip() for line in ai_text.split('\n') if line.strip()]
+        ai_insights = {
+            'summary': lines[0] if lines else 'Health data analysis complete.',
+            'trends': [line.lstrip('•-*123456789. ') for line in lines[1:6] if line] or ['Regular health monitoring detected'],
+            'recommendations': [line.lstrip('•-*123456789. ') for line in lines[6:11] if line] or ['Keep updating your health records']
         }
-        
-        return jsonify(insights_response), 200
-        
-    except Exception as e:
-        app.logger.error(f"Error generating health insights: {str(e)}")
-        return jsonify({
-            'success': False,
-            'message': 'Error generating insights',
-            'insights': {
-                'summary': 'Unable to generate insights at this time.',
-                'trends': [],
-                'recommendations': ['Try again later'],
-                'statistics': {'total_records': 0, 'total_doctors': 0, 'total_treatments': 0}
+    
+    # Add statistics
+    insights_response = {
+        'success': True,
+        'insights': {
+            'summary': ai_insights.get('summary', 'Analysis complete'),
+            'trends': ai_insights.get('trends', [])[:5],
+            'recommendations': ai_insights.get('recommendations', [])[:5],
+            'statistics': {
+                'total_records': len(records),
+                'total_doctors': len(doctors),
+                'total_treatments': len(treatments),
+                'recent_visits': len([r for r in records if r['record_date'] and r['record_date'].startswith('2025')])
             }
-        }), 500
+        }
+    }
+    
+    return insights_response, 200
+
+def health_insights_error(e):
+    app.logger.error(f"Error generating health insights: {str(e)}")
+    return {
+        'success': False,
+        'message': 'Error generating insights',
+        'insights': {
+            'summary': 'Unable to generate insights at this time.',
+            'trends': [],
+            'recommendations': ['Try again later'],
+            'statistics': {'total_records': 0, 'total_doctors': 0, 'total_treatments': 0}
+        }
+    }, 500
+
+@app.route('/api/health-insights/<int:user_id>', methods=['GET'])
+def get_health_insights(user_id):
+    """Generate personalized health insights using Hugging Face AI
+    (from recent records; ?history=full includes archived ones)"""
+    body, status = run_ai_route('health_insights', user_id, request.args.get('history') == 'full')
+    return jsonify(body), status
 
 # ============== VOICE-TO-RECORD AI PARSING ENDPOINT ==============
-@app.route('/api/parse-voice-record', methods=['POST'])
-def parse_voice_record():
-    """Parse voice input and extract medical record information using Hugging Face AI"""
-    try:
-        data = request.get_json()
-        voice_text = data.get('text', '')
-        user_id = data.get('user_id')
-        
-        if not voice_text:
-            return jsonify({
-                'success': False,
-                'message': 'No voice input provided'
-            }), 400
-        
-        # Get user's doctors for context
-        with get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT doctor_id, name, specialization FROM doctors")
-            all_doctors = [dict(row) for row in cursor.fetchall()]
-        
-        # Create prompt for AI to parse the voice input
-        doctors_list = "\n".join([f"- Dr. {d['name']} (ID: {d['doctor_id']}, {d['specialization']})" for d in all_doctors])
-        
-        parse_prompt = f"""Extract medical information from this text and respond ONLY with a JSON object. Do not write code or explanations.
+def prepare_voice_record(data):
+    """Build the voice-to-record prompt with the known doctors"""
+    voice_text = data.get('text', '')
+
+    if not voice_text:
+        return None, ({
+            'success': False,
+            'message': 'No voice input provided'
+        }, 400)
+
+    # Get user's doctors for context
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT doctor_id, name, specialization FROM doctors")
+        all_doctors = [dict(row) for row in cursor.fetchall()]
+    
+    # Create prompt for AI to parse the voice input
+    doctors_list = "\n".join([f"- Dr. {d['name']} (ID: {d['doctor_id']}, {d['specialization']})" for d in all_doctors])
+    
+    parse_prompt = f"""Extract medical information from this text and respond ONLY with a JSON object. Do not write code or explanations.
 
 Voice input: "{voice_text}"
 
@@ -823,209 +1872,170 @@ Rules:
 - Extract dosage/frequency only (no medication name) for dosage field
 - Use YYYY-MM-DD format for dates
 - Respond with ONLY the JSON object, nothing else"""
-        
-        # Call Hugging Face Router API (OpenAI-compatible)
-        headers = {
-            'Authorization': f'Bearer {HUGGINGFACE_API_KEY}',
-            'Content-Type': 'application/json'
-        }
-        payload = {
-            "model": HUGGINGFACE_MODELS[0],
-            "messages": [
-                {"role": "user", "content": parse_prompt}
-            ],
-            "max_tokens": 500,
-            "temperature": 0.2
-        }
-        
-        hf_response = None
-        
-        # Try each model
-        for model_name in HUGGINGFACE_MODELS:
-            try:
-                payload["model"] = model_name
-                hf_response = requests.post(HUGGINGFACE_API_URL, headers=headers, json=payload, timeout=60)
-                
-                if hf_response.status_code == 200:
-                    break
-            except Exception as e:
-                continue
-        
-        if not hf_response or hf_response.status_code != 200:
-            error_msg = f"AI API failed with status: {hf_response.status_code if hf_response else 'No response'}"
-            if hf_response:
-                error_msg += f" - {hf_response.text[:200]}"
-            app.logger.error(error_msg)
-            raise Exception(error_msg)
-        
-        # Parse AI response from Hugging Face (OpenAI format)
-        response_data = hf_response.json()
-        ai_text = response_data['choices'][0]['message']['content']
-        
-        app.logger.info(f"AI Response: {ai_text[:500]}")
-        
-        # Extract JSON from response
-        import json
-        import re
-        from datetime import datetime
-        
-        # Clean the response - remove markdown, code blocks, explanations
-        ai_text_cleaned = ai_text.strip()
-        ai_text_cleaned = re.sub(r'```(?:json)?\s*', '', ai_text_cleaned)  # Remove code blocks
-        ai_text_cleaned = re.sub(r'```\s*', '', ai_text_cleaned)
-        
-        # Try to find JSON object
-        json_match = re.search(r'\{.*?\}', ai_text_cleaned, re.DOTALL)
-        
-        if json_match:
-            try:
-                parsed_data = json.loads(json_match.group())
-                
-                # Validate and set defaults
-                if not parsed_data.get('date'):
-                    parsed_data['date'] = datetime.now().strftime('%Y-%m-%d')
-                
-                if not parsed_data.get('diagnosis'):
-                    parsed_data['diagnosis'] = 'General Consultation'
-                
-                # If doctor_id is null but doctor_name exists, try to find matching doctor
-                if not parsed_data.get('doctor_id') and parsed_data.get('doctor_name'):
-                    doctor_name_lower = parsed_data['doctor_name'].lower()
-                    for doc in all_doctors:
-                        if doctor_name_lower in doc['name'].lower():
-                            parsed_data['doctor_id'] = doc['doctor_id']
-                            break
-            except json.JSONDecodeError as je:
-                app.logger.error(f"JSON parsing failed: {je}")
-                raise Exception("AI returned invalid JSON")
-            
-            return jsonify({
-                'success': True,
-                'parsed_data': parsed_data,
-                'message': 'Voice input parsed successfully'
-            }), 200
-        else:
-            app.logger.error(f"No JSON found in AI response: {ai_text}")
-            return jsonify({
-                'success': False,
-                'message': 'Could not parse voice input. Please speak more clearly or try again.'
-            }), 400
-            
-    except Exception as e:
-        app.logger.error(f"AI parsing failed, trying fallback parser: {str(e)}", exc_info=True)
-        
-        # FALLBACK: Use regex-based parsing if AI fails
+    
+    # Call Hugging Face Router API (OpenAI-compatible)
+    payload = completion_payload([{"role": "user", "content": parse_prompt}], max_tokens=500, temperature=0.2)
+    return payload, {'voice_text': voice_text, 'all_doctors': all_doctors}
+
+def finish_voice_record(state, ai_text, last_error):
+    voice_text, all_doctors = state['voice_text'], state['all_doctors']
+    if ai_text is None:
+        app.logger.error(f"AI parsing failed, trying fallback parser: {last_error}")
+        return fallback_voice_record(voice_text, all_doctors)
+
+    app.logger.info(f"AI Response: {ai_text[:500]}")
+    
+    # Clean the response - remove markdown, code blocks, explanations
+    ai_text_cleaned = ai_text.strip()
+    ai_text_cleaned = re.sub(r'```(?:json)?\s*', '', ai_text_cleaned)  # Remove code blocks
+    ai_text_cleaned = re.sub(r'```\s*', '', ai_text_cleaned)
+    
+    # Try to find JSON object
+    json_match = re.search(r'\{.*?\}', ai_text_cleaned, re.DOTALL)
+    
+    if json_match:
         try:
-            import re
-            from datetime import datetime
+            parsed_data = json.loads(json_match.group())
             
-            parsed_data = {
-                'doctor_id': None,
-                'doctor_name': None,
-                'diagnosis': None,
-                'date': datetime.now().strftime('%Y-%m-%d'),
-                'medication': None,
-                'dosage': None,
-                'follow_up_date': None,
-                'confidence': 'Low'
-            }
+            # Resolve spoken dates locally; the model has no notion of today's date
+            record_date, follow_up_date = resolve_record_and_follow_up(voice_text)
+            if record_date:
+                parsed_data['date'] = record_date.strftime('%Y-%m-%d')
+            if follow_up_date:
+                parsed_data['follow_up_date'] = follow_up_date.strftime('%Y-%m-%d')
             
-            # Extract doctor name patterns
-            doctor_patterns = [
-                r'(?:visited|saw|met|consulted)\s+(?:Dr\.?|Doctor)\s+([A-Z][a-z]+)',
-                r'(?:Dr\.?|Doctor)\s+([A-Z][a-z]+)',
-            ]
-            for pattern in doctor_patterns:
-                match = re.search(pattern, voice_text, re.IGNORECASE)
-                if match:
-                    parsed_data['doctor_name'] = match.group(1)
-                    # Try to match with existing doctors
-                    for doc in all_doctors:
-                        if match.group(1).lower() in doc['name'].lower():
-                            parsed_data['doctor_id'] = doc['doctor_id']
-                            break
-                    break
+            # Validate and set defaults
+            if not parsed_data.get('date'):
+                parsed_data['date'] = datetime.now().strftime('%Y-%m-%d')
             
-            # Extract diagnosis/condition
-            diagnosis_patterns = [
-                r'for\s+([a-z\s]+?)(?:\s+on|\s+and|\s+he|\s+she|\.|$)',
-                r'diagnosed\s+with\s+([a-z\s]+?)(?:\s+on|\s+and|\.|$)',
-                r'treating\s+([a-z\s]+?)(?:\s+on|\s+and|\.|$)',
-            ]
-            for pattern in diagnosis_patterns:
-                match = re.search(pattern, voice_text, re.IGNORECASE)
-                if match:
-                    parsed_data['diagnosis'] = match.group(1).strip().title()
-                    break
-            
-            # Extract medication and dosage
-            med_patterns = [
-                r'prescribed\s+([a-z]+)\s+(\d+\s*(?:mg|ml|g|mcg)[a-z\s]*)',
-                r'gave\s+me\s+([a-z]+)\s+(\d+\s*(?:mg|ml|g|mcg)[a-z\s]*)',
-                r'([a-z]+)\s+(\d+\s*(?:mg|ml|g|mcg)[a-z\s]*)',
-            ]
-            for pattern in med_patterns:
-                match = re.search(pattern, voice_text, re.IGNORECASE)
-                if match:
-                    parsed_data['medication'] = match.group(1).capitalize()
-                    parsed_data['dosage'] = match.group(2).strip()
-                    break
-            
-            # Extract date
-            date_patterns = [
-                r'on\s+([A-Z][a-z]+\s+\d{1,2}(?:st|nd|rd|th)?)',
-                r'yesterday',
-                r'today',
-            ]
-            for pattern in date_patterns:
-                match = re.search(pattern, voice_text, re.IGNORECASE)
-                if match:
-                    if 'yesterday' in match.group(0).lower():
-                        from datetime import timedelta
-                        yesterday = datetime.now() - timedelta(days=1)
-                        parsed_data['date'] = yesterday.strftime('%Y-%m-%d')
-                    elif 'today' not in match.group(0).lower():
-                        # Try to parse date (simplified)
-                        parsed_data['date'] = datetime.now().strftime('%Y-%m-%d')
-                    break
-            
-            # Set defaults if nothing extracted
-            if not parsed_data['diagnosis']:
+            if not parsed_data.get('diagnosis'):
                 parsed_data['diagnosis'] = 'General Consultation'
             
-            app.logger.info(f"Fallback parser result: {parsed_data}")
-            
-            return jsonify({
-                'success': True,
-                'parsed_data': parsed_data,
-                'message': 'Voice input parsed successfully (fallback mode)',
-                'fallback': True
-            }), 200
-            
-        except Exception as fallback_error:
-            app.logger.error(f"Fallback parser also failed: {str(fallback_error)}")
-            return jsonify({
-                'success': False,
-                'message': f'Error processing voice input: {str(e)}'
-            }), 500
+            # If doctor_id is null but doctor_name exists, try to find matching doctor
+            if not parsed_data.get('doctor_id') and parsed_data.get('doctor_name'):
+                doctor_name_lower = parsed_data['doctor_name'].lower()
+                for doc in all_doctors:
+                    if doctor_name_lower in doc['name'].lower():
+                        parsed_data['doctor_id'] = doc['doctor_id']
+                        break
+        except Exception as e:
+            # Invalid JSON, or JSON of the wrong shape
+            app.logger.error(f"AI parsing failed, trying fallback parser: {e}")
+            return fallback_voice_record(voice_text, all_doctors)
+
+        return {
+            'success': True,
+            'parsed_data': parsed_data,
+            'message': 'Voice input parsed successfully'
+        }, 200
+    else:
+        app.logger.error(f"No JSON found in AI response: {ai_text}")
+        return {
+            'success': False,
+            'message': 'Could not parse voice input. Please speak more clearly or try again.'
+        }, 400
+
+def fallback_voice_record(voice_text, all_doctors):
+    """Regex-based parsing used when the models fail"""
+    parsed_data = {
+        'doctor_id': None,
+        'doctor_name': None,
+        'diagnosis': None,
+        'date': datetime.now().strftime('%Y-%m-%d'),
+        'medication': None,
+        'dosage': None,
+        'follow_up_date': None,
+        'confidence': 'Low'
+    }
+    
+    # Extract doctor name patterns
+    doctor_patterns = [
+        r'(?:visited|saw|met|consulted)\s+(?:Dr\.?|Doctor)\s+([A-Z][a-z]+)',
+        r'(?:Dr\.?|Doctor)\s+([A-Z][a-z]+)',
+    ]
+    for pattern in doctor_patterns:
+        match = re.search(pattern, voice_text, re.IGNORECASE)
+        if match:
+            parsed_data['doctor_name'] = match.group(1)
+            # Try to match with existing doctors
+            for doc in all_doctors:
+                if match.group(1).lower() in doc['name'].lower():
+                    parsed_data['doctor_id'] = doc['doctor_id']
+                    break
+            break
+    
+    # Extract diagnosis/condition
+    diagnosis_patterns = [
+        r'for\s+([a-z\s]+?)(?:\s+on|\s+and|\s+he|\s+she|\.|$)',
+        r'diagnosed\s+with\s+([a-z\s]+?)(?:\s+on|\s+and|\.|$)',
+        r'treating\s+([a-z\s]+?)(?:\s+on|\s+and|\.|$)',
+    ]
+    for pattern in diagnosis_patterns:
+        match = re.search(pattern, voice_text, re.IGNORECASE)
+        if match:
+            parsed_data['diagnosis'] = match.group(1).strip().title()
+            break
+    
+    # Extract medication and dosage
+    med_patterns = [
+        r'prescribed\s+([a-z]+)\s+(\d+\s*(?:mg|ml|g|mcg)[a-z\s]*)',
+        r'gave\s+me\s+([a-z]+)\s+(\d+\s*(?:mg|ml|g|mcg)[a-z\s]*)',
+        r'([a-z]+)\s+(\d+\s*(?:mg|ml|g|mcg)[a-z\s]*)',
+    ]
+    for pattern in med_patterns:
+        match = re.search(pattern, voice_text, re.IGNORECASE)
+        if match:
+            parsed_data['medication'] = match.group(1).capitalize()
+            parsed_data['dosage'] = match.group(2).strip()
+            break
+    
+    # Extract visit and follow-up dates ("on March 5th", "follow up in 10 days")
+    record_date, follow_up_date = resolve_record_and_follow_up(voice_text)
+    if record_date:
+        parsed_data['date'] = record_date.strftime('%Y-%m-%d')
+    if follow_up_date:
+        parsed_data['follow_up_date'] = follow_up_date.strftime('%Y-%m-%d')
+    
+    # Set defaults if nothing extracted
+    if not parsed_data['diagnosis']:
+        parsed_data['diagnosis'] = 'General Consultation'
+    
+    app.logger.info(f"Fallback parser result: {parsed_data}")
+    
+    return {
+        'success': True,
+        'parsed_data': parsed_data,
+        'message': 'Voice input parsed successfully (fallback mode)',
+        'fallback': True
+    }, 200
+
+def voice_record_error(e):
+    app.logger.error(f"Fallback parser also failed: {str(e)}")
+    return {
+        'success': False,
+        'message': f'Error processing voice input: {str(e)}'
+    }, 500
+
+@app.route('/api/parse-voice-record', methods=['POST'])
+def parse_voice_record():
+    """Parse voice input and extract medical record information using Hugging Face AI"""
+    body, status = run_ai_route('parse_voice_record', request.get_json())
+    return jsonify(body), status
 
 # ============== VOICE-TO-DOCTOR AI PARSING ENDPOINT ==============
-@app.route('/api/parse-voice-doctor', methods=['POST'])
-def parse_voice_doctor():
-    """Parse voice input and extract doctor information using Hugging Face AI"""
-    try:
-        data = request.get_json()
-        voice_text = data.get('text', '')
-        user_id = data.get('user_id')
-        
-        if not voice_text:
-            return jsonify({
-                'success': False,
-                'message': 'No voice input provided'
-            }), 400
-        
-        # Create prompt for AI to parse the voice input for doctor information
-        parse_prompt = f"""
+def prepare_voice_doctor(data):
+    """Build the voice-to-doctor prompt"""
+    voice_text = data.get('text', '')
+    user_id = data.get('user_id')
+
+    if not voice_text:
+        return None, ({
+            'success': False,
+            'message': 'No voice input provided'
+        }, 400)
+
+    # Create prompt for AI to parse the voice input for doctor information
+    parse_prompt = f"""
 You are a doctor information parser. Extract structured information from this voice input about a doctor.
 
 VOICE INPUT: "{voice_text}"
@@ -1058,201 +2068,167 @@ Examples:
 
 Return ONLY the JSON. No explanations.
 """
+    
+    app.logger.debug("voice_doctor.request user_id=%s text=%r", user_id, voice_text)
+    
+    payload = completion_payload([{"role": "user", "content": parse_prompt}], max_tokens=500, temperature=0.2)
+    return payload, {'voice_text': voice_text}
+
+def parse_doctor_json(response_text):
+    """accept hook for the voice-doctor chain: an answer that is not JSON fails the model"""
+    response_text = response_text.strip()
+    app.logger.debug("voice_doctor.response text=%r", response_text)
+
+    # Try to extract JSON from markdown code blocks
+    if '```json' in response_text:
+        json_start = response_text.find('```json') + 7
+        json_end = response_text.find('```', json_start)
+        response_text = response_text[json_start:json_end].strip()
+    elif '```' in response_text:
+        json_start = response_text.find('```') + 3
+        json_end = response_text.find('```', json_start)
+        response_text = response_text[json_start:json_end].strip()
+    
+    # Remove any leading/trailing whitespace and newlines
+    response_text = response_text.strip()
+    
+    parsed_data = json.loads(response_text)
+    return parsed_data
+
+def finish_voice_doctor(state, parsed_data, last_error):
+    voice_text = state['voice_text']
+    if parsed_data:
+        # Ensure required fields with defaults
+        if not parsed_data.get('name'):
+            parsed_data['name'] = 'Unknown Doctor'
         
-        print(f"\n{'='*50}")
-        print(f"🎤 VOICE DOCTOR PARSING REQUEST")
-        print(f"{'='*50}")
-        print(f"📝 Voice Text: {voice_text}")
-        print(f"👤 User ID: {user_id}")
+        if not parsed_data.get('specialization'):
+            parsed_data['specialization'] = 'General Physician'
         
-        # Try Hugging Face models
-        parsed_data = None
-        last_error = None
+        app.logger.debug(
+            "voice_doctor.result name=%r specialization=%r phone=%r email=%r address=%r confidence=%r",
+            parsed_data.get('name'), parsed_data.get('specialization'), parsed_data.get('phone'),
+            parsed_data.get('email'), parsed_data.get('address'), parsed_data.get('confidence')
+        )
         
-        headers = {
-            'Authorization': f'Bearer {HUGGINGFACE_API_KEY}',
-            'Content-Type': 'application/json'
-        }
-        payload = {
-            "model": HUGGINGFACE_MODELS[0],
-            "messages": [
-                {"role": "user", "content": parse_prompt}
-            ],
-            "max_tokens": 500,
-            "temperature": 0.2
+        return {
+            'success': True,
+            'parsed_data': parsed_data,
+            'message': 'Voice input parsed successfully'
+        }, 200
+    else:
+        # Fallback: Basic parsing if AI fails
+        app.logger.warning("voice_doctor.fallback error=%s", last_error)
+        
+        # Simple regex-based extraction
+        
+        # Extract doctor name (look for "Dr." or "Doctor")
+        name_match = re.search(r'(?:Dr\.?|Doctor)\s+([A-Za-z]+(?:\s+[A-Za-z]+)*)', voice_text, re.IGNORECASE)
+        name = name_match.group(0) if name_match else "Unknown Doctor"
+        
+        # Extract specialization (common medical specializations)
+        specializations = ['cardiologist', 'dermatologist', 'neurologist', 'pediatrician', 
+                         'orthopedic', 'psychiatrist', 'general physician', 'surgeon']
+        specialization = 'General Physician'
+        for spec in specializations:
+            if spec.lower() in voice_text.lower():
+                specialization = spec.title()
+                break
+        
+        # Extract phone (numbers)
+        phone_match = re.search(r'\b\d{3}[-.\s]?\d{4,5}\b|\b\d{6,10}\b', voice_text)
+        phone = phone_match.group(0) if phone_match else None
+        
+        # Extract email
+        email_match = re.search(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b', voice_text)
+        email = email_match.group(0) if email_match else None
+        
+        fallback_data = {
+            'name': name,
+            'specialization': specialization,
+            'phone': phone,
+            'email': email,
+            'address': None,
+            'notes': f"Parsed from: {voice_text}",
+            'confidence': 0.5
         }
         
-        for model_name in HUGGINGFACE_MODELS:
-            try:
-                print(f"\n🤖 Trying model: {model_name}")
-                payload["model"] = model_name
-                response = requests.post(HUGGINGFACE_API_URL, headers=headers, json=payload, timeout=60)
-                
-                if response and response.status_code == 200:
-                    response_data = response.json()
-                    # Extract generated text from OpenAI format
-                    response_text = response_data['choices'][0]['message']['content'].strip()
-                    
-                    print(f"📤 AI Response: {response_text}")
-                    
-                    # Try to extract JSON from markdown code blocks
-                    if '```json' in response_text:
-                        json_start = response_text.find('```json') + 7
-                        json_end = response_text.find('```', json_start)
-                        response_text = response_text[json_start:json_end].strip()
-                    elif '```' in response_text:
-                        json_start = response_text.find('```') + 3
-                        json_end = response_text.find('```', json_start)
-                        response_text = response_text[json_start:json_end].strip()
-                    
-                    # Remove any leading/trailing whitespace and newlines
-                    response_text = response_text.strip()
-                    
-                    parsed_data = json.loads(response_text)
-                    print(f"✅ Successfully parsed with {model_name}")
-                    break
-                    
-            except Exception as model_error:
-                last_error = str(model_error)
-                print(f"⚠️ Model {model_name} failed: {last_error}")
-                continue
+        app.logger.debug("voice_doctor.fallback_result name=%r specialization=%r",
+                         fallback_data['name'], fallback_data['specialization'])
         
-        if parsed_data:
-            # Ensure required fields with defaults
-            if not parsed_data.get('name'):
-                parsed_data['name'] = 'Unknown Doctor'
-            
-            if not parsed_data.get('specialization'):
-                parsed_data['specialization'] = 'General Physician'
-            
-            print(f"\n✅ PARSED DOCTOR DATA:")
-            print(f"👨‍⚕️ Name: {parsed_data.get('name')}")
-            print(f"🏥 Specialization: {parsed_data.get('specialization')}")
-            print(f"📞 Phone: {parsed_data.get('phone', 'N/A')}")
-            print(f"📧 Email: {parsed_data.get('email', 'N/A')}")
-            print(f"📍 Address: {parsed_data.get('address', 'N/A')}")
-            print(f"📝 Notes: {parsed_data.get('notes', 'N/A')}")
-            confidence = parsed_data.get('confidence', 0)
-            if isinstance(confidence, (int, float)):
-                print(f"🎯 Confidence: {confidence:.2f}")
-            else:
-                print(f"🎯 Confidence: {confidence}")
-            
-            return jsonify({
-                'success': True,
-                'parsed_data': parsed_data,
-                'message': 'Voice input parsed successfully'
-            }), 200
-        else:
-            # Fallback: Basic parsing if AI fails
-            print(f"\n⚠️ All AI models failed, using fallback parser. Last error: {last_error}")
-            
-            # Simple regex-based extraction
-            import re
-            
-            # Extract doctor name (look for "Dr." or "Doctor")
-            name_match = re.search(r'(?:Dr\.?|Doctor)\s+([A-Za-z]+(?:\s+[A-Za-z]+)*)', voice_text, re.IGNORECASE)
-            name = name_match.group(0) if name_match else "Unknown Doctor"
-            
-            # Extract specialization (common medical specializations)
-            specializations = ['cardiologist', 'dermatologist', 'neurologist', 'pediatrician', 
-                             'orthopedic', 'psychiatrist', 'general physician', 'surgeon']
-            specialization = 'General Physician'
-            for spec in specializations:
-                if spec.lower() in voice_text.lower():
-                    specialization = spec.title()
-                    break
-            
-            # Extract phone (numbers)
-            phone_match = re.search(r'\b\d{3}[-.\s]?\d{4,5}\b|\b\d{6,10}\b', voice_text)
-            phone = phone_match.group(0) if phone_match else None
-            
-            # Extract email
-            email_match = re.search(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b', voice_text)
-            email = email_match.group(0) if email_match else None
-            
-            fallback_data = {
-                'name': name,
-                'specialization': specialization,
-                'phone': phone,
-                'email': email,
-                'address': None,
-                'notes': f"Parsed from: {voice_text}",
-                'confidence': 0.5
-            }
-            
-            print(f"\n✅ FALLBACK PARSED DATA:")
-            print(f"👨‍⚕️ Name: {fallback_data['name']}")
-            print(f"🏥 Specialization: {fallback_data['specialization']}")
-            
-            return jsonify({
-                'success': True,
-                'parsed_data': fallback_data,
-                'message': 'Voice input parsed successfully (basic mode)'
-            }), 200
-            
-    except Exception as e:
-        app.logger.error(f"Error parsing voice doctor: {str(e)}")
-        return jsonify({
-            'success': False,
-            'message': 'Error processing voice input'
-        }), 500
+        return {
+            'success': True,
+            'parsed_data': fallback_data,
+            'message': 'Voice input parsed successfully (basic mode)'
+        }, 200
 
-@app.route('/chatbot/query', methods=['POST'])
-def chatbot_query():
-    """Handle chatbot queries based on user's medical data"""
-    try:
-        data = request.get_json()
-        if not data:
-            return jsonify({'success': False, 'message': 'No data provided'}), 400
+def voice_doctor_error(e):
+    app.logger.error(f"Error parsing voice doctor: {str(e)}")
+    return {
+        'success': False,
+        'message': 'Error processing voice input'
+    }, 500
+
+@app.route('/api/parse-voice-doctor', methods=['POST'])
+def parse_voice_doctor():
+    """Parse voice input and extract doctor information using Hugging Face AI"""
+    body, status = run_ai_route('parse_voice_doctor', request.get_json())
+    return jsonify(body), status
+
+# ============== CHATBOT ENDPOINT ==============
+def prepare_chatbot(data):
+    """Fetch the user's medical data and build the chatbot prompt"""
+    if not data:
+        return None, ({'success': False, 'message': 'No data provided'}, 400)
+
+    user_id = data.get('user_id')
+    question = data.get('question', '').strip()
+
+    if not user_id or not question:
+        return None, ({'success': False, 'message': 'user_id and question are required'}, 400)
+
+    # Fetch user's medical data: recent records unless full_history is set
+    records_table, treatments_table = history_tables(data.get('full_history'))
+    with get_connection(user_id) as conn:
+        cursor = conn.cursor()
         
-        user_id = data.get('user_id')
-        question = data.get('question', '').strip()
+        # Get user info
+        cursor.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
+        user = cursor.fetchone()
+        if not user:
+            return None, ({'success': False, 'message': 'User not found'}, 404)
         
-        if not user_id or not question:
-            return jsonify({'success': False, 'message': 'user_id and question are required'}), 400
+        # Get health records with doctor info
+        cursor.execute(f"""
+            SELECT hr.*, d.name as doctor_name, d.specialization
+            FROM {records_table} hr
+            LEFT JOIN doctors d ON hr.doctor_id = d.doctor_id
+            WHERE hr.user_id = ?
+            ORDER BY hr.record_date DESC
+        """, (user_id,))
+        records = [dict(row) for row in cursor.fetchall()]
         
-        # Fetch user's medical data
-        with get_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Get user info
-            cursor.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
-            user = cursor.fetchone()
-            if not user:
-                return jsonify({'success': False, 'message': 'User not found'}), 404
-            
-            # Get health records with doctor info
-            cursor.execute("""
-                SELECT hr.*, d.name as doctor_name, d.specialization
-                FROM health_records hr
-                LEFT JOIN doctors d ON hr.doctor_id = d.doctor_id
-                WHERE hr.user_id = ?
-                ORDER BY hr.record_date DESC
-            """, (user_id,))
-            records = [dict(row) for row in cursor.fetchall()]
-            
-            # Get treatments
-            cursor.execute("""
-                SELECT t.*, hr.diagnosis, hr.record_date
-                FROM treatment t
-                JOIN health_records hr ON t.record_id = hr.record_id
-                WHERE hr.user_id = ?
-                ORDER BY t.follow_up_date DESC
-            """, (user_id,))
-            treatments = [dict(row) for row in cursor.fetchall()]
-            
-            # Get doctors
-            cursor.execute("""
-                SELECT DISTINCT d.*
-                FROM doctors d
-                JOIN health_records hr ON d.doctor_id = hr.doctor_id
-                WHERE hr.user_id = ?
-            """, (user_id,))
-            doctors = [dict(row) for row in cursor.fetchall()]
+        # Get treatments
+        cursor.execute(f"""
+            SELECT t.*, hr.diagnosis, hr.record_date
+            FROM {treatments_table} t
+            JOIN {records_table} hr ON t.record_id = hr.record_id
+            WHERE hr.user_id = ?
+            ORDER BY t.follow_up_date DESC
+        """, (user_id,))
+        treatments = [dict(row) for row in cursor.fetchall()]
         
-        # Build context for the chatbot
-        user_context = f"""
+        # Get doctors
+        cursor.execute(f"""
+            SELECT DISTINCT d.*
+            FROM doctors d
+            JOIN {records_table} hr ON d.doctor_id = hr.doctor_id
+            WHERE hr.user_id = ?
+        """, (user_id,))
+        doctors = [dict(row) for row in cursor.fetchall()]
+    
+    # Build context for the chatbot
+    user_context = f"""
 PATIENT INFORMATION:
 - Name: {user['name']}
 - Age: {user['age']} years
@@ -1260,32 +2236,32 @@ PATIENT INFORMATION:
 
 MEDICAL HISTORY ({len(records)} records):
 """
-        for record in records[:10]:  # Last 10 records
-            user_context += f"• {record['record_date']}: {record['diagnosis']}"
-            if record.get('doctor_name'):
-                user_context += f" (Dr. {record['doctor_name']} - {record['specialization']})"
+    for record in records[:10]:  # Last 10 records
+        user_context += f"• {record['record_date']}: {record['diagnosis']}"
+        if record.get('doctor_name'):
+            user_context += f" (Dr. {record['doctor_name']} - {record['specialization']})"
+        user_context += "\n"
+    
+    if treatments:
+        user_context += f"\nCURRENT TREATMENTS ({len(treatments)} active):\n"
+        for treatment in treatments[:10]:
+            user_context += f"• {treatment['medication']} for {treatment['diagnosis']}"
+            if treatment.get('procedure'):
+                user_context += f" - {treatment['procedure']}"
+            if treatment.get('follow_up_date'):
+                user_context += f" | Follow-up: {treatment['follow_up_date']}"
             user_context += "\n"
-        
-        if treatments:
-            user_context += f"\nCURRENT TREATMENTS ({len(treatments)} active):\n"
-            for treatment in treatments[:10]:
-                user_context += f"• {treatment['medication']} for {treatment['diagnosis']}"
-                if treatment.get('procedure'):
-                    user_context += f" - {treatment['procedure']}"
-                if treatment.get('follow_up_date'):
-                    user_context += f" | Follow-up: {treatment['follow_up_date']}"
-                user_context += "\n"
-        
-        if doctors:
-            user_context += f"\nHEALTHCARE PROVIDERS:\n"
-            for doctor in doctors:
-                user_context += f"• Dr. {doctor['name']} - {doctor['specialization']}"
-                if doctor.get('contact_number'):
-                    user_context += f" | {doctor['contact_number']}"
-                user_context += "\n"
-        
-        # Create chatbot prompt
-        chatbot_prompt = f"""You are a helpful medical assistant chatbot for LifeTrack, a personal health records system.
+    
+    if doctors:
+        user_context += f"\nHEALTHCARE PROVIDERS:\n"
+        for doctor in doctors:
+            user_context += f"• Dr. {doctor['name']} - {doctor['specialization']}"
+            if doctor.get('contact_number'):
+                user_context += f" | {doctor['contact_number']}"
+            user_context += "\n"
+    
+    # Create chatbot prompt
+    chatbot_prompt = f"""You are a helpful medical assistant chatbot for LifeTrack, a personal health records system.
 
 {user_context}
 
@@ -1302,73 +2278,59 @@ INSTRUCTIONS:
 
 Respond in a natural, conversational tone:"""
 
-        # Call Hugging Face Inference API
-        headers = {
-            'Authorization': f'Bearer {HUGGINGFACE_API_KEY}',
-            'Content-Type': 'application/json'
-        }
-        
-        payload = {
-            "model": HUGGINGFACE_MODELS[0],
-            "messages": [
-                {"role": "system", "content": "You are a helpful medical records assistant."},
-                {"role": "user", "content": chatbot_prompt}
-            ],
-            "max_tokens": 500,
-            "temperature": 0.7
-        }
-        
-        hf_response = None
-        last_error = None
-        
-        # Try each model until one works
-        for model_name in HUGGINGFACE_MODELS:
-            try:
-                app.logger.info(f"Chatbot trying model: {model_name}")
-                payload["model"] = model_name
-                hf_response = requests.post(HUGGINGFACE_API_URL, headers=headers, json=payload, timeout=30)
-                
-                if hf_response.status_code == 200:
-                    app.logger.info(f"Chatbot success with model: {model_name}")
-                    break
-                else:
-                    last_error = f"Status {hf_response.status_code}: {hf_response.text}"
-                    app.logger.warning(f"Model {model_name} failed: {last_error}")
-            except Exception as e:
-                last_error = str(e)
-                app.logger.error(f"Exception with model {model_name}: {last_error}")
-                continue
-        
-        if not hf_response or hf_response.status_code != 200:
-            # Fallback response
-            fallback_response = f"I'm having trouble connecting to the AI service right now. However, I can tell you that you have {len(records)} health records and {len(treatments)} treatments in your history. Please try again in a moment or contact your healthcare provider directly."
-            return jsonify({
-                'success': True,
-                'response': fallback_response,
-                'fallback': True
-            }), 200
-        
-        # Parse AI response
-        result = hf_response.json()
-        ai_response = result.get('choices', [{}])[0].get('message', {}).get('content', '').strip()
-        
-        if not ai_response:
-            ai_response = "I apologize, but I couldn't generate a response. Please try rephrasing your question."
-        
-        return jsonify({
+    # Call Hugging Face Inference API
+    payload = completion_payload([
+        {"role": "system", "content": "You are a helpful medical records assistant."},
+        {"role": "user", "content": chatbot_prompt}
+    ], max_tokens=500, temperature=0.7)
+    return payload, {'records': len(records), 'treatments': len(treatments), 'doctors': len(doctors)}
+
+def finish_chatbot(state, ai_text, last_error):
+    if ai_text is None:
+        # Fallback response
+        fallback_response = f"I'm having trouble connecting to the AI service right now. However, I can tell you that you have {state['records']} health records and {state['treatments']} treatments in your history. Please try again in a moment or contact your healthcare provider directly."
+        return {
             'success': True,
-            'response': ai_response,
-            'records_count': len(records),
-            'treatments_count': len(treatments),
-            'doctors_count': len(doctors)
-        }), 200
-        
-    except Exception as e:
-        app.logger.error(f'Chatbot error: {str(e)}')
-        return jsonify({
-            'success': False,
-            'message': f'Error processing chatbot query: {str(e)}'
-        }), 500
+            'response': fallback_response,
+            'fallback': True
+        }, 200
+
+    ai_response = ai_text.strip()
+    if not ai_response:
+        ai_response = "I apologize, but I couldn't generate a response. Please try rephrasing your question."
+
+    return {
+        'success': True,
+        'response': ai_response,
+        'records_count': state['records'],
+        'treatments_count': state['treatments'],
+        'doctors_count': state['doctors']
+    }, 200
+
+def chatbot_error(e):
+    app.logger.error(f'Chatbot error: {str(e)}')
+    return {
+        'success': False,
+        'message': f'Error processing chatbot query: {str(e)}'
+    }, 500
+
+@app.route('/chatbot/query', methods=['POST'])
+def chatbot_query():
+    """Handle chatbot queries based on user's medical data"""
+    body, status = run_ai_route('chatbot', request.get_json())
+    return jsonify(body), status
+
+# Feature name -> route pieces; also the metrics label of its model calls
+AI_FEATURES = {
+    'health_insights': {'prepare': prepare_health_insights, 'finish': finish_health_insights,
+                        'error': health_insights_error, 'accept': None, 'timeout': 60},
+    'parse_voice_record': {'prepare': prepare_voice_record, 'finish': finish_voice_record,
+                           'error': voice_record_error, 'accept': None, 'timeout': 60},
+    'parse_voice_doctor': {'prepare': prepare_voice_doctor, 'finish': finish_voice_doctor,
+                           'error': voice_doctor_error, 'accept': parse_doctor_json, 'timeout': 60},
+    'chatbot': {'prepare': prepare_chatbot, 'finish': finish_chatbot,
+                'error': chatbot_error, 'accept': None, 'timeout': 30},
+}
 
 if __name__ == '__main__':
     # Run on localhost only
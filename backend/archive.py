@@ -0,0 +1,143 @@
+"""
+Hot/Cold Record Archive
+Keeps health_records and treatment small enough to stay in the page cache:
+a batched job, run by the maintenance scheduler in its off-peak window,
+moves records dated before a cutoff, with their treatments, into a cold
+database next to each shard (<name>.cold.db) that every connection
+attaches as `cold`. Per-user reads of recent history then touch only the
+hot tables and their indexes.
+
+The TEMP views health_records_all and treatment_all are the full history
+(SQLite only lets temporary views span attached databases, so attach()
+creates them per connection). Everything that means "all records" reads
+them: the list endpoints, the dashboard, and the aggregator, autocomplete
+and cohort loaders. The AI insights and chatbot read the hot tables unless
+asked for full history.
+
+Archiving moves rows without changing them, so it is not written to the
+change log; replicas, cohort arrays and ETags read full history and stay
+valid. Records with a follow-up on or after the cutoff stay hot. Archived
+rows can still be updated and deleted, and the cold database has its own
+search indexes (search.py), so /search keeps covering them.
+
+Each batch is one transaction over both files. In WAL mode that is atomic
+per file only, so a crash can leave a batch in both until the next run,
+which copies with INSERT OR IGNORE and deletes the hot rows again.
+"""
+
+import os
+import re
+import time
+from datetime import date, timedelta
+from typing import Optional, Tuple
+
+from shards import Shard, ShardSet
+
+# Tables with a cold copy; each gets a <table>_all view
+ARCHIVED_TABLES = ('health_records', 'treatment')
+# Where an archived table's rows can be, hot first
+SCHEMAS = ('main', 'cold')
+COLD_INDEXES = [
+    'CREATE INDEX IF NOT EXISTS cold.idx_health_records_user ON health_records(user_id)',
+    'CREATE INDEX IF NOT EXISTS cold.idx_health_records_doctor ON health_records(doctor_id)',
+    'CREATE INDEX IF NOT EXISTS cold.idx_treatment_record ON treatment(record_id)',
+]
+
+
+def cold_path(path: str) -> str:
+    """Cold database next to the database at path"""
+    root, ext = os.path.splitext(path)
+    return f"{root}.cold{ext}"
+
+
+def attach(conn, path: Optional[str] = None):
+    """Attach the cold database at path as `cold` and create the full-history
+    views; without a path the views cover the hot tables alone"""
+    if path:
+        conn.execute("ATTACH DATABASE ? AS cold", (path,))
+    for table in ARCHIVED_TABLES:
+        sources = [f"SELECT * FROM main.{table}"] + ([f"SELECT * FROM cold.{table}"] if path else [])
+        conn.execute(f"CREATE TEMP VIEW IF NOT EXISTS {table}_all AS {' UNION ALL '.join(sources)}")
+
+
+def where(conn, table: str, key: str, row_id) -> Optional[str]:
+    """'main' or 'cold', whichever holds the row with key = row_id; None if neither"""
+    for schema in SCHEMAS:
+        if conn.execute(f"SELECT 1 FROM {schema}.{table} WHERE {key} = ?", (row_id,)).fetchone():
+            return schema
+    return None
+
+
+class Archiver:
+    """Moves old records and their treatments from each shard's hot tables to its cold database"""
+
+    def __init__(self, shards: ShardSet, after_days: int = 730, batch_size: int = 500, pause: float = 0.05):
+        self.shards = shards
+        self.after_days = after_days
+        self.batch_size = batch_size
+        self.pause = pause  # between batches, so request writes get the shard's lock
+
+    def init_schema(self):
+        """Create the cold tables, from the hot tables' own definitions, on every shard"""
+        for shard in self.shards:
+            with shard.connection() as conn:
+                conn.execute('PRAGMA cold.journal_mode=WAL')
+                for table in ARCHIVED_TABLES:
+                    sql = conn.execute("SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?",
+                                       (table,)).fetchone()[0]
+                    conn.execute(re.sub(r'^CREATE TABLE\s+["`\[]?\w+["`\]]?',
+                                        f'CREATE TABLE IF NOT EXISTS cold.{table}', sql, count=1))
+                for statement in COLD_INDEXES:
+                    conn.execute(statement)
+
+    def cutoff(self, today: Optional[date] = None) -> str:
+        """Records dated before this ISO date are archived"""
+        return ((today or date.today()) - timedelta(days=self.after_days)).isoformat()
+
+    def archive_batch(self, shard: Shard, cutoff: str, after_id: int = 0) -> Tuple[int, int, int]:
+        """Archive up to batch_size records past after_id; returns (records,
+        treatments, last record_id examined), the last 0 when there are no more"""
+        with shard.write_lock, shard.connection() as conn:
+            # Rowid order: each batch resumes where the last stopped, so the
+            # whole run reads the hot table once
+            record_ids = [row[0] for row in conn.execute("""
+                SELECT record_id FROM main.health_records hr
+                WHERE record_id > ? AND record_date < ?
+                  AND NOT EXISTS (SELECT 1 FROM main.treatment t
+                                  WHERE t.record_id = hr.record_id AND t.follow_up_date >= ?)
+                ORDER BY record_id LIMIT ?
+            """, (after_id, cutoff, cutoff, self.batch_size))]
+            if not record_ids:
+                return 0, 0, 0
+            marks = ','.join('?' * len(record_ids))
+            conn.execute(f"INSERT OR IGNORE INTO cold.treatment SELECT * FROM main.treatment "
+                         f"WHERE record_id IN ({marks})", record_ids)
+            conn.execute(f"INSERT OR IGNORE INTO cold.health_records SELECT * FROM main.health_records "
+                         f"WHERE record_id IN ({marks})", record_ids)
+            treatments = conn.execute(f"DELETE FROM main.treatment WHERE record_id IN ({marks})",
+                                      record_ids).rowcount
+            records = conn.execute(f"DELETE FROM main.health_records WHERE record_id IN ({marks})",
+                                   record_ids).rowcount
+        return records, treatments, record_ids[-1]
+
+    def archive_shard(self, shard: Shard, cutoff: Optional[str] = None) -> Tuple[int, int]:
+        """Archive every eligible record of shard in batches; returns (records, treatments)"""
+        cutoff = cutoff or self.cutoff()
+        total_records = total_treatments = 0
+        after_id = 0
+        while True:
+            records, treatments, after_id = self.archive_batch(shard, cutoff, after_id)
+            total_records += records
+            total_treatments += treatments
+            if not after_id:
+                return total_records, total_treatments
+            time.sleep(self.pause)
+
+    def run_once(self) -> str:
+        """Archive every shard; returns a summary for the maintenance log"""
+        cutoff = self.cutoff()
+        records = treatments = 0
+        for shard in self.shards:
+            moved = self.archive_shard(shard, cutoff)
+            records, treatments = records + moved[0], treatments + moved[1]
+        return f"{records} health records and {treatments} treatments dated before {cutoff} archived"
@@ -0,0 +1,248 @@
+"""
+ASGI Entry Point
+Serves the LLM-bound routes natively on the event loop and every other route
+through the Flask app. An AI request spends its model time as a coroutine
+waiting on the async fallback chain (see ai_async.py), so one process holds
+thousands of them. Their DB reads run on a small pool of their own, which
+keeps them from crowding out the CRUD routes on the Flask thread pool, and
+streamed responses (the change stream) are pulled on a pool of their own
+for the same reason.
+
+Run from the backend directory with
+    uvicorn asgi:app --port 5000
+
+Flask routes keep the request hooks (metrics, profiling). The native routes
+record the same http metrics; profiling only covers the Flask routes.
+"""
+
+import asyncio
+import io
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+import metrics
+from ai_async import AsyncModelClient
+from app import (app as flask_app, AI_FEATURES, HUGGINGFACE_API_URL, HUGGINGFACE_MODELS,
+                 completion_headers)
+from serialization import dumps
+
+# Threads running Flask routes; the CRUD concurrency limit
+ASGI_FLASK_THREADS = int(os.getenv('ASGI_FLASK_THREADS', '32'))
+# Threads for the AI routes' DB reads and prompt building
+ASGI_AI_DB_THREADS = int(os.getenv('ASGI_AI_DB_THREADS', '8'))
+# Threads pulling streamed responses; each open change stream holds one
+# while it waits for changes, so this caps the open streams
+ASGI_STREAM_THREADS = int(os.getenv('ASGI_STREAM_THREADS', '256'))
+
+# (method, path pattern, Flask rule for metric labels, feature)
+AI_ROUTES = [
+    ('GET', re.compile(r'/api/health-insights/(\d+)'), '/api/health-insights/<int:user_id>', 'health_insights'),
+    ('POST', re.compile(r'/api/parse-voice-record'), '/api/parse-voice-record', 'parse_voice_record'),
+    ('POST', re.compile(r'/api/parse-voice-doctor'), '/api/parse-voice-doctor', 'parse_voice_doctor'),
+    ('POST', re.compile(r'/chatbot/query'), '/chatbot/query', 'chatbot'),
+]
+
+flask_pool = ThreadPoolExecutor(ASGI_FLASK_THREADS, thread_name_prefix='flask')
+ai_db_pool = ThreadPoolExecutor(ASGI_AI_DB_THREADS, thread_name_prefix='ai-db')
+stream_pool = ThreadPoolExecutor(ASGI_STREAM_THREADS, thread_name_prefix='stream')
+models = AsyncModelClient(HUGGINGFACE_API_URL, completion_headers(), HUGGINGFACE_MODELS, logger=flask_app.logger)
+
+
+async def read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise ConnectionResetError('client disconnected')
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+# ============== NATIVE AI ROUTES ==============
+async def run_ai_route(feature, *args):
+    """Async counterpart of app.run_ai_route; returns (body, status)"""
+    route = AI_FEATURES[feature]
+    loop = asyncio.get_running_loop()
+    try:
+        payload, state = await loop.run_in_executor(ai_db_pool, lambda: route['prepare'](*args))
+        if payload is None:
+            return state
+        result, last_error = await models.call_models(feature, payload, route['timeout'], route['accept'])
+        return route['finish'](state, result, last_error)
+    except Exception as e:
+        return route['error'](e)
+
+
+async def send_json(send, status, body, cors):
+    data = dumps(body)
+    headers = [(b'content-type', b'application/json'), (b'content-length', str(len(data)).encode())]
+    if cors:
+        headers.append((b'access-control-allow-origin', b'*'))
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': data})
+
+
+async def serve_ai(scope, receive, send, rule, feature, match):
+    method = scope['method']
+    metrics.http_in_flight.inc(method, rule)
+    start = time.perf_counter()
+    status = 500
+    try:
+        if method == 'GET':
+            query = parse_qs(scope['query_string'].decode('latin-1'))
+            args = (int(match.group(1)), query.get('history') == ['full'])
+        else:
+            try:
+                body = await read_body(receive)
+            except ConnectionResetError:
+                status = 499
+                return
+            try:
+                args = (json.loads(body) if body else None,)
+            except ValueError:
+                status = 400
+                return await send_json(send, status, {'success': False, 'message': 'Invalid JSON body'}, True)
+
+        # A client that hangs up cancels its model calls
+        work = asyncio.ensure_future(run_ai_route(feature, *args))
+        watch = asyncio.ensure_future(wait_for_disconnect(receive))
+        await asyncio.wait({work, watch}, return_when=asyncio.FIRST_COMPLETED)
+        watch.cancel()
+        if not work.done():
+            work.cancel()
+            status = 499
+            return
+        body, status = work.result()
+        cors = any(name == b'origin' for name, _ in scope['headers'])
+        await send_json(send, status, body, cors)
+    finally:
+        metrics.http_in_flight.dec(method, rule)
+        metrics.http_latency.observe(time.perf_counter() - start, method, rule)
+        metrics.http_requests.inc(method, rule, str(status))
+
+
+# ============== FLASK ROUTES ==============
+def wsgi_environ(scope, body: bytes) -> dict:
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1] or 80),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'], environ['REMOTE_PORT'] = scope['client'][0], str(scope['client'][1])
+    for name, value in scope['headers']:
+        name, value = name.decode('latin-1'), value.decode('latin-1')
+        if name == 'content-length':
+            key = 'CONTENT_LENGTH'
+        elif name == 'content-type':
+            key = 'CONTENT_TYPE'
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+        environ[key] = environ[key] + ',' + value if key in environ else value
+    return environ
+
+
+def call_flask(environ):
+    """Run one Flask request on a pool thread. A body with a Content-Length is
+    read here in full; anything else (the change stream) is returned to be
+    iterated chunk by chunk."""
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+
+    iterable = flask_app(environ, start_response)
+    if any(name == b'content-length' for name, _ in started['headers']):
+        try:
+            return started, b''.join(iterable), None
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+    return started, None, iterable
+
+
+async def serve_flask(scope, receive, send):
+    loop = asyncio.get_running_loop()
+    try:
+        environ = wsgi_environ(scope, await read_body(receive))
+    except ConnectionResetError:
+        return
+    started, body, iterable = await loop.run_in_executor(flask_pool, call_flask, environ)
+    await send({'type': 'http.response.start', 'status': started['status'], 'headers': started['headers']})
+    if iterable is None:
+        return await send({'type': 'http.response.body', 'body': body})
+    await send_stream(receive, send, iterable)
+
+
+async def send_stream(receive, send, iterable):
+    """Send a streamed Flask response chunk by chunk. A chunk can take up to
+    a heartbeat to arrive, so chunks are pulled on stream_pool, off the CRUD
+    threads; a client that hangs up ends the stream at the next chunk."""
+    loop = asyncio.get_running_loop()
+    chunks = iter(iterable)
+    watch = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        while True:
+            step = loop.run_in_executor(stream_pool, next, chunks, None)
+            await asyncio.wait({step, watch}, return_when=asyncio.FIRST_COMPLETED)
+            # Let the pending chunk finish either way: a running generator can't be closed
+            chunk = await step
+            if watch.done() or chunk is None:
+                break
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        if not watch.done():
+            await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        watch.cancel()
+        if hasattr(iterable, 'close'):
+            await loop.run_in_executor(stream_pool, iterable.close)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await models.aclose()
+            flask_pool.shutdown(wait=False)
+            ai_db_pool.shutdown(wait=False)
+            stream_pool.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+    for method, pattern, rule, feature in AI_ROUTES:
+        match = pattern.fullmatch(scope['path'])
+        if match and scope['method'] == method:
+            return await serve_ai(scope, receive, send, rule, feature, match)
+    await serve_flask(scope, receive, send)
@@ -0,0 +1,188 @@
+"""
+Authentication: salted password hashing and session tokens
+Passwords are hashed with PBKDF2-HMAC-SHA256 at a tunable cost; sessions are
+cached in memory and persisted in SQLite so they survive restarts
+"""
+
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Callable, Optional, Tuple
+
+HASH_ALGORITHM = 'pbkdf2_sha256'
+# Tunable KDF cost; raising it upgrades existing hashes on their next login
+PASSWORD_HASH_ITERATIONS = int(os.getenv('PASSWORD_HASH_ITERATIONS', '600000'))
+SESSION_TTL_SECONDS = int(os.getenv('SESSION_TTL_SECONDS', str(7 * 24 * 3600)))
+# Sessions kept in memory per process; the least recently used are read
+# from SQLite again when they come back
+SESSION_CACHE_SIZE = int(os.getenv('SESSION_CACHE_SIZE', '10000'))
+
+PUBLIC_USER_FIELDS = ('user_id', 'name', 'age', 'gender', 'contact_number', 'email')
+
+
+def hash_password(password: str, iterations: int = None) -> str:
+    """Return 'pbkdf2_sha256$<iterations>$<salt>$<hash>' for password"""
+    iterations = iterations or PASSWORD_HASH_ITERATIONS
+    salt = secrets.token_bytes(16)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations)
+    return '$'.join([
+        HASH_ALGORITHM,
+        str(iterations),
+        base64.b64encode(salt).decode('ascii'),
+        base64.b64encode(digest).decode('ascii')
+    ])
+
+
+def is_password_hash(stored: str) -> bool:
+    return bool(stored) and stored.startswith(HASH_ALGORITHM + '$')
+
+
+def verify_password(password: str, stored: str) -> bool:
+    """Check password against a stored hash (or a legacy plaintext value)"""
+    if not stored:
+        return False
+    if not is_password_hash(stored):
+        # Rows created before hashing was introduced; upgraded on login
+        return hmac.compare_digest(password.encode('utf-8'), stored.encode('utf-8'))
+    try:
+        _, iterations, salt, expected = stored.split('$')
+        digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'),
+                                     base64.b64decode(salt), int(iterations))
+    except (ValueError, TypeError):
+        return False
+    return hmac.compare_digest(digest, base64.b64decode(expected))
+
+
+@lru_cache(maxsize=1)
+def dummy_password_hash() -> str:
+    """A hash no password matches, verified when a login names no user so
+    that unknown emails take as long to reject as wrong passwords"""
+    return hash_password(secrets.token_urlsafe(32))
+
+
+def normalize_email(email: str) -> str:
+    """Email as stored and looked up; registration and login must agree"""
+    return email.strip()
+
+
+def needs_rehash(stored: str) -> bool:
+    """True for plaintext values and hashes made with a different cost"""
+    if not is_password_hash(stored):
+        return True
+    return stored.split('$')[1] != str(PASSWORD_HASH_ITERATIONS)
+
+
+def public_user(row) -> dict:
+    """Strip credentials from a users row"""
+    return {field: row[field] for field in PUBLIC_USER_FIELDS}
+
+
+def _token_key(token: str) -> str:
+    # Only a digest of the token is stored, so a leaked sessions table
+    # cannot be replayed
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+class SessionStore:
+    """Session tokens cached in memory and persisted in the sessions table.
+
+    With revalidate_seconds set, a cached session older than that is read
+    again, so a token deleted by another process stops working within that
+    window. The cache holds at most cache_size sessions, least recently used
+    out first, and drops expired ones as they are seen.
+
+    connect opens the database holding sessions; connect_user(user_id) the
+    one holding that user's row, when users are sharded.
+    """
+
+    def __init__(self, connect: Callable, ttl_seconds: int = SESSION_TTL_SECONDS,
+                 revalidate_seconds: float = 0, connect_user: Optional[Callable] = None,
+                 cache_size: int = SESSION_CACHE_SIZE):
+        self.connect = connect
+        self.connect_user = connect_user or (lambda user_id: connect())
+        self.ttl_seconds = ttl_seconds
+        self.revalidate_seconds = revalidate_seconds
+        self.cache_size = cache_size
+        # token key -> {'user': ..., 'expires_at': ..., 'cached_at': ...}, least recently used first
+        self.sessions: 'OrderedDict[str, dict]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_schema(self):
+        with self.connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    token_hash TEXT PRIMARY KEY,
+                    user_id INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_sessions_user ON sessions(user_id)')
+
+    def create(self, conn, user: dict) -> Tuple[str, float]:
+        """Issue a token for user inside the caller's write transaction"""
+        token = secrets.token_urlsafe(32)
+        now = time.time()
+        expires_at = now + self.ttl_seconds
+        conn.execute("DELETE FROM sessions WHERE user_id = ? AND expires_at < ?", (user['user_id'], now))
+        conn.execute(
+            "INSERT INTO sessions (token_hash, user_id, created_at, expires_at) VALUES (?, ?, ?, ?)",
+            (_token_key(token), user['user_id'], now, expires_at)
+        )
+        self._cache(_token_key(token), {'user': user, 'expires_at': expires_at, 'cached_at': now})
+        return token, expires_at
+
+    def _cache(self, key: str, session: dict):
+        with self._lock:
+            self.sessions[key] = session
+            self.sessions.move_to_end(key)
+            while len(self.sessions) > self.cache_size:
+                self.sessions.popitem(last=False)
+
+    def get_user(self, token: str) -> Optional[dict]:
+        """Resolve a token to its user; only a cold (or due for revalidation) cache touches SQLite"""
+        if not token:
+            return None
+        key = _token_key(token)
+        now = time.time()
+        with self._lock:
+            session = self.sessions.get(key)
+            if session is not None:
+                self.sessions.move_to_end(key)
+        if session is not None and self.revalidate_seconds and now - session['cached_at'] > self.revalidate_seconds:
+            self.forget(token)
+            session = None
+        if session is None:
+            with self.connect() as conn:
+                row = conn.execute("SELECT user_id, expires_at FROM sessions WHERE token_hash = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            user_id, expires_at = row
+            if expires_at < now:
+                return None
+            with self.connect_user(user_id) as conn:
+                user = conn.execute("SELECT * FROM users WHERE user_id = ?", (user_id,)).fetchone()
+            if user is None:
+                return None
+            session = {'user': public_user(user), 'expires_at': expires_at, 'cached_at': now}
+            self._cache(key, session)
+        if session['expires_at'] < now:
+            self.forget(token)
+            return None
+        return session['user']
+
+    def forget(self, token: str):
+        """Drop a token from the in-memory cache (the caller deletes the row)"""
+        with self._lock:
+            self.sessions.pop(_token_key(token), None)
+
+    def delete(self, conn, token: str) -> bool:
+        self.forget(token)
+        cursor = conn.execute("DELETE FROM sessions WHERE token_hash = ?", (_token_key(token),))
+        return cursor.rowcount > 0
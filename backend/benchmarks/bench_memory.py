@@ -0,0 +1,84 @@
+"""
+Aggregator memory benchmark: traced memory per million health records
+
+Loads synthetic records into a fresh HealthMetricsAggregator and reports the
+memory it retains, plus load and summary timings. Each row gets its own
+string objects, as rows read from SQLite do.
+
+Usage:
+    python benchmarks/bench_memory.py [--records 1000000] [--users 10000] [--json]
+"""
+
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_structures import HealthMetricsAggregator  # noqa: E402
+
+BASE_DIAGNOSES = ['Hypertension', 'Type 2 Diabetes', 'Seasonal Allergies', 'Migraine',
+                  'Childhood Asthma', 'Common Cold', 'Osteoarthritis', 'Influenza']
+
+
+def generate_rows(count, users, seed=7):
+    rng = random.Random(seed)
+    vocabulary = BASE_DIAGNOSES + [f"Condition {i}" for i in range(2000)]
+    for record_id in range(1, count + 1):
+        yield {
+            'record_id': record_id,
+            'user_id': rng.randint(1, users),
+            'doctor_id': rng.randint(1, 500),
+            # Slicing forces a distinct str object, like a fresh sqlite3 row
+            'diagnosis': (rng.choice(vocabulary) + ' ')[:-1],
+            'record_date': f"20{rng.randint(15, 25)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            'file_path': None
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--records', type=int, default=1_000_000)
+    parser.add_argument('--users', type=int, default=10_000)
+    parser.add_argument('--json', action='store_true', help='emit machine-readable results')
+    args = parser.parse_args()
+
+    gc.collect()
+    tracemalloc.start()
+    aggregator = HealthMetricsAggregator()
+    start = time.perf_counter()
+    for row in generate_rows(args.records, args.users):
+        aggregator.add_health_record(row)
+    load_seconds = time.perf_counter() - start
+    gc.collect()
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for user_id in range(1, min(args.users, 1000) + 1):
+        aggregator.cache.put(f"user_summary_{user_id}", None)
+        aggregator.get_user_health_summary(user_id)
+    summary_ms = (time.perf_counter() - start) * 1000 / min(args.users, 1000)
+
+    result = {
+        'records': args.records,
+        'users': args.users,
+        'retained_mb': round(retained / 1e6, 1),
+        'mb_per_million_records': round(retained / 1e6 * 1_000_000 / args.records, 1),
+        'load_seconds': round(load_seconds, 2),
+        'user_summary_ms': round(summary_ms, 3)
+    }
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        for key, value in result.items():
+            print(f"{key:<24}{value}")
+
+
+if __name__ == '__main__':
+    main()
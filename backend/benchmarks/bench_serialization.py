@@ -0,0 +1,113 @@
+"""
+Serialization benchmark: payload size and encode time for large tables
+
+Compares the original jsonify path (dict per row, then the stdlib encoder)
+with serialization.encode_rows in object and compact form, and reports the
+compressed size of each payload.
+
+Usage:
+    python benchmarks/bench_serialization.py [--rows 100000] [--repeat 3] [--json]
+"""
+
+import argparse
+import gzip
+import json
+import os
+import random
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import serialization  # noqa: E402
+
+DIAGNOSES = ['Hypertension', 'Type 2 Diabetes', 'Seasonal Allergies', 'Migraine',
+             'Childhood Asthma', 'Common Cold', 'Osteoarthritis', 'Influenza']
+
+
+def build_table(rows):
+    conn = sqlite3.connect(':memory:')
+    conn.execute("""
+        CREATE TABLE health_records (
+            record_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            doctor_id INTEGER NOT NULL,
+            diagnosis VARCHAR(200) NOT NULL,
+            record_date DATE NOT NULL,
+            file_path VARCHAR(225)
+        )
+    """)
+    rng = random.Random(42)
+    conn.executemany(
+        "INSERT INTO health_records (user_id, doctor_id, diagnosis, record_date, file_path) VALUES (?, ?, ?, ?, ?)",
+        ((rng.randint(1, 5000), rng.randint(1, 200), rng.choice(DIAGNOSES),
+          f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+          f"files/report_{i}.pdf" if i % 3 == 0 else None) for i in range(rows))
+    )
+    return conn
+
+
+def encode_jsonify_style(conn):
+    conn.row_factory = sqlite3.Row
+    cursor = conn.execute("SELECT * FROM health_records")
+    records = [dict(row) for row in cursor.fetchall()]
+    conn.row_factory = None
+    return json.dumps(records, separators=(',', ':'), sort_keys=True).encode('utf-8')
+
+
+def encode_objects(conn):
+    return serialization.encode_rows(conn.execute("SELECT * FROM health_records"))
+
+
+def encode_compact(conn):
+    return serialization.encode_rows(conn.execute("SELECT * FROM health_records"), compact=True)
+
+
+def measure(fn, conn, repeat):
+    best = float('inf')
+    body = b''
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = fn(conn)
+        best = min(best, time.perf_counter() - start)
+    return best, body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', action='store_true', help='emit machine-readable results')
+    args = parser.parse_args()
+
+    conn = build_table(args.rows)
+    results = []
+    for name, fn in [('jsonify_style', encode_jsonify_style),
+                     ('encode_rows', encode_objects),
+                     ('encode_rows_compact', encode_compact)]:
+        seconds, body = measure(fn, conn, args.repeat)
+        result = {
+            'name': name,
+            'rows': args.rows,
+            'encode_ms': round(seconds * 1000, 2),
+            'bytes': len(body),
+            'gzip_bytes': len(gzip.compress(body, compresslevel=serialization.GZIP_LEVEL)),
+        }
+        if serialization.brotli is not None:
+            result['br_bytes'] = len(serialization.brotli.compress(body, quality=serialization.BROTLI_QUALITY))
+        results.append(result)
+
+    encoder = 'orjson' if serialization.orjson is not None else 'stdlib json'
+    if args.json:
+        print(json.dumps({'encoder': encoder, 'results': results}, indent=2))
+        return
+
+    print(f"Encoder: {encoder}, rows: {args.rows}")
+    print(f"{'variant':<22}{'encode ms':>12}{'bytes':>14}{'gzip':>12}{'br':>12}")
+    for r in results:
+        print(f"{r['name']:<22}{r['encode_ms']:>12}{r['bytes']:>14}{r['gzip_bytes']:>12}{r.get('br_bytes', '-'):>12}")
+
+
+if __name__ == '__main__':
+    main()
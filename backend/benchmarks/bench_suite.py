@@ -0,0 +1,325 @@
+"""
+Backend benchmark suite: REST endpoints, aggregator methods and the write path
+
+Generates a synthetic database (see synthetic_data.py) in a temporary
+directory, imports the app against it and times every REST endpoint through
+the Flask test client, the in-memory aggregator methods, and each write
+route. The AI routes are left to the LLM load driver, since their latency is
+the model's.
+
+Results are per case: iterations, errors, min/p50/p95/mean in milliseconds.
+With --baseline, cases whose p50 regressed by more than --threshold (and by
+more than --min-delta-ms) are listed and the exit status is 1.
+
+Usage:
+    python benchmarks/bench_suite.py [--records 200000] [--users 10000] [--doctors 200]
+        [--iterations 20] [--only endpoints|aggregator|writes] [--json] [--output results.json]
+        [--baseline previous.json] [--threshold 0.25]
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+import synthetic_data  # noqa: E402
+
+GROUPS = ('endpoints', 'aggregator', 'writes')
+
+
+class Suite:
+    def __init__(self, iterations):
+        self.iterations = iterations
+        self.results = []
+
+    def run(self, group, name, fn, iterations=None, setup=None):
+        """Time fn(setup()) per iteration; route cases return the HTTP status, which is checked"""
+        samples = []
+        errors = 0
+        for _ in range(iterations or self.iterations):
+            arg = setup() if setup else None
+            start = time.perf_counter()
+            status = fn(arg) if setup else fn()
+            samples.append((time.perf_counter() - start) * 1000)
+            if isinstance(status, int) and not (200 <= status < 300 or status == 304):
+                errors += 1
+        samples.sort()
+        self.results.append({
+            'group': group,
+            'name': name,
+            'iterations': len(samples),
+            'errors': errors,
+            'min_ms': round(samples[0], 3),
+            'p50_ms': round(statistics.median(samples), 3),
+            'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+            'mean_ms': round(statistics.fmean(samples), 3),
+        })
+
+
+def bench_endpoints(suite, app, heavy_user, typical_user, doctor_id, token):
+    client = app.test_client()
+
+    def get(path, **kwargs):
+        return lambda: client.get(path, **kwargs).status_code
+
+    def revalidate(path):
+        etag = client.get(path).headers.get('ETag')
+        return get(path, headers={'If-None-Match': etag})
+
+    cases = [
+        ('GET /health', '/health'),
+        ('GET /doctors', '/doctors'),
+        ('GET /users', '/users'),
+        ('GET /health_records', '/health_records'),
+        ('GET /treatment', '/treatment'),
+        ('GET /users/<id>/dashboard heavy', f'/users/{heavy_user}/dashboard'),
+        ('GET /users/<id>/dashboard typical', f'/users/{typical_user}/dashboard?recent=0'),
+        ('GET /users/<id>/health_summary', f'/users/{heavy_user}/health_summary'),
+        ('GET /analytics/system', '/analytics/system'),
+        ('GET /treatments/urgent', '/treatments/urgent'),
+        ('GET /doctors/stats', '/doctors/stats?sort=efficiency_score'),
+        ('GET /doctors/<id>/stats', f'/doctors/{doctor_id}/stats'),
+        ('GET /doctors/recommend', '/doctors/recommend?specialization=Cardiologist&k=5'),
+        ('GET /analytics/visits', '/analytics/visits'),
+        ('GET /analytics/prevalence', '/analytics/prevalence?by=age'),
+        ('GET /analytics/doctors/workload', '/analytics/doctors/workload'),
+        ('GET /analytics/follow_ups', '/analytics/follow_ups?by=gender'),
+        ('GET /changes', f'/changes?user_id={heavy_user}&since=0'),
+        ('GET /search', f'/search?q=diabetes&user_id={heavy_user}'),
+        ('GET /search all users', '/search?q=paracetamol&type=treatments'),
+        ('GET /autocomplete', '/autocomplete?field=diagnosis&q=hy'),
+        ('GET /metrics', '/metrics'),
+    ]
+    for name, path in cases:
+        # First call outside the timing: builds caches and the cohort arrays
+        client.get(path)
+        suite.run('endpoints', name, get(path))
+
+    for name, path in [('GET /health_records 304', '/health_records'),
+                       ('GET /users/<id>/dashboard 304', f'/users/{heavy_user}/dashboard')]:
+        suite.run('endpoints', name, revalidate(path))
+
+    suite.run('endpoints', 'GET /session', get('/session', headers={'Authorization': f'Bearer {token}'}))
+    # Password hashing dominates; a few iterations are enough
+    suite.run('endpoints', 'POST /login', lambda: client.post(
+        '/login', json={'email': f'user{typical_user}@example.com', 'password': f'pw{typical_user}'}
+    ).status_code, iterations=3)
+
+
+def bench_writes(suite, app, user_id, doctor_id):
+    client = app.test_client()
+    created = {'records': [], 'treatments': [], 'doctors': []}
+
+    def add_record():
+        response = client.post('/health_records', json={
+            'user_id': user_id, 'doctor_id': doctor_id, 'diagnosis': 'Seasonal Allergies',
+            'record_date': '2025-03-01'})
+        created['records'].append(response.get_json().get('record_id'))
+        return response.status_code
+
+    def add_treatment():
+        response = client.post('/treatment', json={
+            'record_id': created['records'][-1], 'medication': 'Cetirizine',
+            'procedure': '1 Tablet at night', 'follow_up_date': '2025-03-15'})
+        created['treatments'].append(response.get_json().get('treatment_id'))
+        return response.status_code
+
+    def add_doctor():
+        index = len(created['doctors'])
+        response = client.post('/doctors', json={
+            'name': f'Dr. Bench {index}', 'specialization': 'General Physician',
+            'contact_number': '9800000000', 'email': f'bench{index}.{time.time_ns()}@hospital.example.com'})
+        created['doctors'].append(response.get_json().get('doctor_id'))
+        return response.status_code
+
+    suite.run('writes', 'POST /health_records', add_record)
+    suite.run('writes', 'PUT /health_records/<id>', lambda record_id: client.put(
+        f'/health_records/{record_id}',
+        json={'doctor_id': doctor_id, 'diagnosis': 'Common Cold', 'record_date': '2025-03-02'}
+    ).status_code, setup=lambda: created['records'][-1])
+    suite.run('writes', 'POST /treatment', add_treatment)
+    suite.run('writes', 'PUT /treatment/<id>', lambda treatment_id: client.put(
+        f'/treatment/{treatment_id}',
+        json={'medication': 'Fexofenadine', 'procedure': '1 Tablet at night', 'follow_up_date': '2025-03-20'}
+    ).status_code, setup=lambda: created['treatments'][-1])
+    suite.run('writes', 'DELETE /treatment/<id>', lambda treatment_id: client.delete(
+        f'/treatment/{treatment_id}').status_code, setup=created['treatments'].pop)
+    suite.run('writes', 'DELETE /health_records/<id>', lambda record_id: client.delete(
+        f'/health_records/{record_id}').status_code, setup=created['records'].pop)
+    suite.run('writes', 'POST /doctors', add_doctor)
+    suite.run('writes', 'PUT /doctors/<id>', lambda new_doctor_id: client.put(
+        f'/doctors/{new_doctor_id}',
+        json={'name': 'Dr. Bench', 'specialization': 'Cardiologist', 'contact_number': '9800000001'}
+    ).status_code, setup=lambda: created['doctors'][-1])
+    suite.run('writes', 'DELETE /doctors/<id>', lambda new_doctor_id: client.delete(
+        f'/doctors/{new_doctor_id}').status_code, setup=created['doctors'].pop)
+    # Registration hashes the password, like login
+    suite.run('writes', 'POST /users', lambda: client.post('/users', json={
+        'name': 'Bench User', 'age': 30, 'gender': 'Other', 'contact_number': '9000000000',
+        'email': f'bench.{time.time_ns()}@example.com', 'password': f'bench-{time.time_ns()}'
+    }).status_code, iterations=3)
+
+
+def bench_aggregator(suite, database, heavy_user, typical_user):
+    import archive
+    from data_structures import HealthMetricsAggregator, DoctorAnalytics, Severity
+
+    conn = sqlite3.connect(database)
+    conn.row_factory = sqlite3.Row
+    archive.attach(conn)  # the full-history views the loaders read
+    rows = [dict(row) for row in conn.execute("SELECT * FROM health_records")]
+    aggregator = HealthMetricsAggregator()
+
+    def load():
+        for row in rows:
+            aggregator.add_health_record(row)
+    suite.run('aggregator', f'add_health_record x{len(rows)}', load, iterations=1)
+
+    def summary(user_id):
+        def _summary():
+            aggregator.cache.put(f"user_summary_{user_id}", None)
+            aggregator.get_user_health_summary(user_id)
+        return _summary
+    suite.run('aggregator', 'get_user_health_summary heavy', summary(heavy_user))
+    suite.run('aggregator', 'get_user_health_summary typical', summary(typical_user))
+    suite.run('aggregator', 'get_system_analytics', aggregator.get_system_analytics)
+
+    analytics = DoctorAnalytics(aggregator.diagnoses)
+    suite.run('aggregator', 'DoctorAnalytics.load', lambda: analytics.load(conn), iterations=3)
+    suite.run('aggregator', 'get_all_doctor_stats', lambda: analytics.get_all_doctor_stats('efficiency_score'))
+    suite.run('aggregator', 'recommend_doctors', lambda: analytics.recommend_doctors('Cardiologist', 5))
+    record = rows[0]
+
+    def add_and_remove():
+        analytics.record_added(record['doctor_id'], record['user_id'], record['diagnosis'])
+        analytics.record_removed(record['doctor_id'], record['user_id'], record['diagnosis'])
+    suite.run('aggregator', 'record_added+record_removed', add_and_remove)
+
+    queue = aggregator.treatment_queue
+    treatments = conn.execute(
+        "SELECT treatment_id, follow_up_date FROM treatment WHERE follow_up_date IS NOT NULL LIMIT 100000"
+    ).fetchall()
+
+    def fill_queue():
+        for treatment_id, follow_up in treatments:
+            queue.add_treatment(treatment_id, datetime.strptime(follow_up, '%Y-%m-%d'), Severity.MODERATE)
+    suite.run('aggregator', f'treatment_queue.add_treatment x{len(treatments)}', fill_queue, iterations=1)
+    suite.run('aggregator', 'get_next_urgent_treatments', lambda: queue.get_next_urgent_treatments(10))
+    conn.close()
+
+
+def compare(results, meta, baseline_path, threshold, min_delta_ms):
+    with open(baseline_path) as f:
+        previous = json.load(f)
+    scale = ('records', 'users', 'doctors', 'seed')
+    if any(previous['meta'].get(key) != meta[key] for key in scale):
+        print(f"warning: baseline was run at a different scale ({', '.join(scale)})", file=sys.stderr)
+    baseline = {(r['group'], r['name']): r for r in previous['results']}
+    regressions = []
+    for result in results:
+        before = baseline.get((result['group'], result['name']))
+        if not before:
+            continue
+        delta = result['p50_ms'] - before['p50_ms']
+        if delta > min_delta_ms and result['p50_ms'] > before['p50_ms'] * (1 + threshold):
+            regressions.append({'group': result['group'], 'name': result['name'],
+                                'baseline_p50_ms': before['p50_ms'], 'p50_ms': result['p50_ms']})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--records', type=int, default=200_000)
+    parser.add_argument('--users', type=int, default=10_000)
+    parser.add_argument('--doctors', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--only', choices=GROUPS, action='append', help='run only these groups')
+    parser.add_argument('--json', action='store_true', help='emit machine-readable results')
+    parser.add_argument('--output', help='also write the JSON results to this file')
+    parser.add_argument('--baseline', help='results file to compare p50 latencies against')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed relative p50 slowdown')
+    parser.add_argument('--min-delta-ms', type=float, default=0.5, help='ignore smaller absolute slowdowns')
+    args = parser.parse_args()
+    groups = args.only or GROUPS
+
+    workdir = tempfile.mkdtemp(prefix='phr_bench_')
+    database = os.path.join(workdir, 'phr_database.db')
+    start = time.perf_counter()
+    synthetic_data.populate(database, args.users, args.doctors, args.records, args.seed)
+    generate_seconds = time.perf_counter() - start
+
+    conn = sqlite3.connect(database)
+    # Frequent visitor (low user ids are heavy by construction) and a median one
+    heavy_user, = conn.execute(
+        "SELECT user_id FROM health_records GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 1").fetchone()
+    typical_user, = conn.execute(
+        "SELECT user_id FROM (SELECT user_id, COUNT(*) AS n FROM health_records GROUP BY user_id) "
+        "ORDER BY n LIMIT 1 OFFSET (SELECT COUNT(DISTINCT user_id) / 2 FROM health_records)").fetchone()
+    doctor_id, = conn.execute(
+        "SELECT doctor_id FROM health_records GROUP BY doctor_id ORDER BY COUNT(*) DESC LIMIT 1").fetchone()
+    conn.close()
+
+    suite = Suite(args.iterations)
+    cwd = os.getcwd()
+    os.chdir(workdir)  # app.py opens phr_database.db relative to the working directory
+    try:
+        start = time.perf_counter()
+        from app import app
+        startup_seconds = time.perf_counter() - start
+        app.logger.setLevel('WARNING')
+        token = app.test_client().post('/login', json={
+            'email': f'user{heavy_user}@example.com', 'password': f'pw{heavy_user}'}).get_json()['token']
+
+        if 'endpoints' in groups:
+            bench_endpoints(suite, app, heavy_user, typical_user, doctor_id, token)
+        if 'writes' in groups:
+            bench_writes(suite, app, typical_user, doctor_id)
+        if 'aggregator' in groups:
+            bench_aggregator(suite, database, heavy_user, typical_user)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'records': args.records, 'users': args.users, 'doctors': args.doctors, 'seed': args.seed,
+            'iterations': args.iterations, 'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version, 'platform': platform.platform(),
+            'generate_seconds': round(generate_seconds, 2), 'app_startup_seconds': round(startup_seconds, 2),
+        },
+        'results': suite.results,
+    }
+    if args.baseline:
+        report['regressions'] = compare(suite.results, report['meta'], args.baseline, args.threshold, args.min_delta_ms)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        meta = report['meta']
+        print(f"{meta['records']:,} records, {meta['users']:,} users, {meta['doctors']:,} doctors; "
+              f"generated in {meta['generate_seconds']}s, app startup {meta['app_startup_seconds']}s")
+        print(f"{'group':<12}{'case':<44}{'p50 ms':>10}{'p95 ms':>10}{'mean ms':>10}{'errors':>8}")
+        for r in suite.results:
+            print(f"{r['group']:<12}{r['name']:<44}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['mean_ms']:>10}{r['errors']:>8}")
+        for r in report.get('regressions', []):
+            print(f"REGRESSION {r['group']} {r['name']}: p50 {r['baseline_p50_ms']} -> {r['p50_ms']} ms")
+    sys.exit(1 if report.get('regressions') else 0)
+
+
+if __name__ == '__main__':
+    main()
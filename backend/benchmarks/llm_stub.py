@@ -0,0 +1,245 @@
+"""
+Local OpenAI-compatible LLM stub for load-testing the AI endpoints
+
+Serves POST /v1/chat/completions with canned answers shaped like the ones
+each AI route expects (health insights, voice record, voice doctor,
+chatbot), after a simulated model latency. It can also inject failures:
+- HTTP 500 errors at --error-rate
+- HTTP 429 rate limits at --rate-limit-rate
+- a 503 outage for chosen models (--outage)
+- malformed content at --malformed-rate: truncated JSON or prose instead of
+  JSON, as real models sometimes return
+
+GET /stats reports requests, outcomes and simulated latency per model.
+
+Latency specs (milliseconds):
+    fixed:800  uniform:200,1500  lognormal:800,0.6 (median, sigma)  exp:800 (mean)
+
+Point the backend at it with
+    HUGGINGFACE_API_URL=http://127.0.0.1:8099/v1/chat/completions python app.py
+
+Usage:
+    python benchmarks/llm_stub.py [--port 8099] [--latency lognormal:800,0.6]
+        [--model-latency MODEL=SPEC ...] [--error-rate 0.02] [--rate-limit-rate 0]
+        [--malformed-rate 0.05] [--outage MODEL ...] [--seed 7]
+"""
+
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_LATENCY = 'lognormal:800,0.6'
+
+INSIGHTS = {
+    'summary': 'Your records show well-managed chronic conditions with regular follow-ups.',
+    'trends': ['Blood pressure readings are stable', 'Visits are concentrated in the last year',
+               'Respiratory complaints are seasonal', 'Medication adherence looks consistent',
+               'Follow-ups are mostly on time'],
+    'recommendations': ['Keep monitoring blood pressure weekly', 'Schedule an annual check-up',
+                        'Carry your inhaler during allergy season', 'Stay hydrated',
+                        'Review medications with your doctor'],
+}
+VOICE_RECORD = {
+    'doctor_id': None, 'doctor_name': 'Smith', 'diagnosis': 'Seasonal Allergies', 'date': None,
+    'medication': 'Cetirizine', 'dosage': '1 tablet at night', 'follow_up_date': None, 'confidence': 'High',
+}
+VOICE_DOCTOR = {
+    'name': 'Dr. Sarah Johnson', 'specialization': 'Cardiologist', 'phone': '555-0123',
+    'email': None, 'address': 'City Hospital', 'notes': None, 'confidence': 0.9,
+}
+CHAT_ANSWER = ('Based on your records, your last visit was for hypertension and your current '
+               'medication is Amlodipine. Please confirm any dosage changes with your doctor.')
+
+
+def parse_latency(spec):
+    """Return a function rng -> seconds for a latency spec string"""
+    kind, _, args = spec.partition(':')
+    values = [float(v) for v in args.split(',')] if args else []
+    if kind == 'fixed' and len(values) == 1:
+        seconds = values[0] / 1000
+        return lambda rng: seconds
+    if kind == 'uniform' and len(values) == 2:
+        low, high = values[0] / 1000, values[1] / 1000
+        return lambda rng: rng.uniform(low, high)
+    if kind == 'lognormal' and len(values) == 2:
+        mu, sigma = math.log(values[0] / 1000), values[1]
+        return lambda rng: rng.lognormvariate(mu, sigma)
+    if kind == 'exp' and len(values) == 1:
+        rate = 1000 / values[0]
+        return lambda rng: rng.expovariate(rate)
+    raise ValueError(f"invalid latency spec: {spec}")
+
+
+def answer_for(prompt):
+    """Pick the answer shape the calling route parses, from its prompt"""
+    if '"trends"' in prompt:
+        return json.dumps(INSIGHTS)
+    if '"doctor_id"' in prompt:
+        return json.dumps(VOICE_RECORD)
+    if '"specialization"' in prompt:
+        return '```json\n' + json.dumps(VOICE_DOCTOR) + '\n```'
+    return CHAT_ANSWER
+
+
+def malformed(text, rng):
+    """Half the time a truncated answer, otherwise prose where JSON was asked for"""
+    if rng.random() < 0.5:
+        return text[:len(text) // 2]
+    return 'Sure! Here is what I found in the input, summarised in plain words.'
+
+
+class StubState:
+    def __init__(self, args):
+        self.rng = random.Random(args.seed)
+        self.rng_lock = threading.Lock()
+        self.default_latency = parse_latency(args.latency)
+        self.model_latency = {}
+        for item in args.model_latency or []:
+            model, _, spec = item.partition('=')
+            self.model_latency[model] = parse_latency(spec)
+        self.error_rate = args.error_rate
+        self.rate_limit_rate = args.rate_limit_rate
+        self.malformed_rate = args.malformed_rate
+        self.outages = set(args.outage or [])
+        self.stats_lock = threading.Lock()
+        self.stats = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def draw(self, model):
+        """Decide the outcome and latency for one request"""
+        with self.rng_lock:
+            roll = self.rng.random()
+            latency = self.model_latency.get(model, self.default_latency)(self.rng)
+            garble = self.rng.random() < self.malformed_rate
+        if model in self.outages:
+            return 'outage', 0.0, False
+        if roll < self.rate_limit_rate:
+            return 'rate_limited', 0.0, False
+        if roll < self.rate_limit_rate + self.error_rate:
+            return 'error', latency / 2, False
+        return 'malformed' if garble else 'ok', latency, garble
+
+    def record(self, model, outcome, seconds):
+        with self.stats_lock:
+            entry = self.stats.setdefault(model, {'requests': 0, 'outcomes': {}, 'latency_seconds': 0.0})
+            entry['requests'] += 1
+            entry['outcomes'][outcome] = entry['outcomes'].get(outcome, 0) + 1
+            entry['latency_seconds'] += seconds
+
+    def enter(self):
+        with self.stats_lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def leave(self):
+        with self.stats_lock:
+            self.in_flight -= 1
+
+    def snapshot(self):
+        with self.stats_lock:
+            return {'models': json.loads(json.dumps(self.stats)), 'in_flight': self.in_flight,
+                    'max_in_flight': self.max_in_flight}
+
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, body):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == '/stats':
+                return self._send(200, state.snapshot())
+            self._send(404, {'error': 'not found'})
+
+        def do_POST(self):
+            if not self.path.endswith('/chat/completions'):
+                return self._send(404, {'error': 'not found'})
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            model = body.get('model', 'unknown')
+            prompt = ''.join(m.get('content', '') for m in body.get('messages', []))
+
+            state.enter()
+            try:
+                outcome, latency, garble = state.draw(model)
+                time.sleep(latency)
+                state.record(model, outcome, latency)
+                if outcome == 'outage':
+                    return self._send(503, {'error': f'Model {model} is currently unavailable'})
+                if outcome == 'rate_limited':
+                    return self._send(429, {'error': 'Rate limit reached'})
+                if outcome == 'error':
+                    return self._send(500, {'error': 'Internal inference error'})
+
+                text = answer_for(prompt)
+                if garble:
+                    with state.rng_lock:
+                        text = malformed(text, state.rng)
+                self._send(200, {
+                    'id': f'stub-{time.time_ns()}',
+                    'object': 'chat.completion',
+                    'created': int(time.time()),
+                    'model': model,
+                    'choices': [{'index': 0, 'finish_reason': 'stop',
+                                 'message': {'role': 'assistant', 'content': text}}],
+                    'usage': {'prompt_tokens': len(prompt) // 4, 'completion_tokens': len(text) // 4,
+                              'total_tokens': (len(prompt) + len(text)) // 4},
+                })
+            finally:
+                state.leave()
+
+    return Handler
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency', default=DEFAULT_LATENCY, help='default latency spec')
+    parser.add_argument('--model-latency', action='append', metavar='MODEL=SPEC',
+                        help='latency spec for one model (repeatable)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction answered with HTTP 500')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='fraction answered with HTTP 429')
+    parser.add_argument('--malformed-rate', type=float, default=0.0, help='fraction with malformed content')
+    parser.add_argument('--outage', action='append', metavar='MODEL', help='model answering 503 (repeatable)')
+    parser.add_argument('--seed', type=int, default=7)
+    return parser
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The stdlib default backlog of 5 resets connections under a burst of clients
+    request_queue_size = 4096
+
+
+def make_server(args):
+    """Build the stub server; port 0 binds a free port (see server.server_address)"""
+    return StubServer((args.host, args.port), make_handler(StubState(args)))
+
+
+def main():
+    args = build_parser().parse_args()
+    server = make_server(args)
+    print(f"LLM stub listening on http://{args.host}:{server.server_address[1]}/v1/chat/completions")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
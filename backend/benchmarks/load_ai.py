@@ -0,0 +1,327 @@
+"""
+Load driver for the AI endpoints
+
+Runs closed-loop workers against /api/health-insights, /chatbot/query and
+the two voice parsers, then reports per-endpoint throughput and p50/p99
+latency. While the load runs, it samples the backend's in-flight gauge from
+/metrics to show worker saturation. It also reads the LLM stub's /stats,
+which separates model time from our own overhead. A probe thread times a
+plain CRUD read (GET /doctors) throughout, to show whether the AI load
+slows down the rest of the API.
+
+With --spawn the driver starts everything itself:
+- llm_stub.py on a free port (configured with --stub-args);
+- the backend on a copy of the database, pointed at the stub; with --asgi
+  it runs under uvicorn (asgi.py) instead of the threaded dev server.
+Otherwise it targets --base-url and, if given, --stub-url.
+
+Usage:
+    python benchmarks/load_ai.py --spawn [--asgi] [--stub-args "--latency lognormal:800,0.6 --error-rate 0.02"]
+        [--concurrency 16] [--probe-rps 5] [--duration 30] [--mix insights=1,chatbot=2,voice_record=1,voice_doctor=1]
+        [--users 1,2] [--json] [--output results.json]
+    python benchmarks/load_ai.py --base-url http://127.0.0.1:5000 --stub-url http://127.0.0.1:8099
+"""
+
+import argparse
+import json
+import os
+import random
+import shlex
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import llm_stub  # noqa: E402
+
+VOICE_RECORDS = [
+    'Saw Dr. Smith yesterday for seasonal allergies, prescribed cetirizine once at night, follow up in two weeks',
+    'Visited the cardiologist today, blood pressure is high, continue amlodipine after breakfast',
+    'Dr. Johnson checked my asthma last Monday and gave me a salbutamol inhaler',
+]
+VOICE_DOCTORS = [
+    'Dr. Sarah Johnson cardiologist phone 555-0123',
+    "Add Dr. Patel, he's a dermatologist at City Hospital",
+    'New doctor Michael Chen, neurologist, email mchen@hospital.com',
+]
+QUESTIONS = [
+    'What medications am I currently taking?',
+    'When is my next follow-up?',
+    'Summarise my last three visits',
+]
+
+ENDPOINTS = {
+    'insights': lambda rng, user_id: ('GET', f'/api/health-insights/{user_id}', None),
+    'chatbot': lambda rng, user_id: ('POST', '/chatbot/query',
+                                     {'user_id': user_id, 'question': rng.choice(QUESTIONS)}),
+    'voice_record': lambda rng, user_id: ('POST', '/api/parse-voice-record',
+                                          {'user_id': user_id, 'text': rng.choice(VOICE_RECORDS)}),
+    'voice_doctor': lambda rng, user_id: ('POST', '/api/parse-voice-doctor',
+                                          {'user_id': user_id, 'text': rng.choice(VOICE_DOCTORS)}),
+}
+AI_ROUTES = ('/api/health-insights/<int:user_id>', '/chatbot/query',
+             '/api/parse-voice-record', '/api/parse-voice-doctor')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(url, timeout=1).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def spawn(stub_args, database, asgi=False):
+    """Start the stub in-process and the backend as a subprocess; returns (base_url, stub_url, cleanup)"""
+    stub_options = llm_stub.build_parser().parse_args(shlex.split(stub_args) + ['--port', '0'])
+    stub = llm_stub.make_server(stub_options)
+    threading.Thread(target=stub.serve_forever, daemon=True).start()
+    stub_url = f"http://127.0.0.1:{stub.server_address[1]}"
+
+    workdir = tempfile.mkdtemp(prefix='phr_load_')
+    shutil.copy(database, os.path.join(workdir, 'phr_database.db'))
+    port = free_port()
+    env = dict(os.environ, PORT=str(port), LOG_LEVEL='WARNING', FLASK_DEBUG='false',
+               HUGGINGFACE_API_URL=f"{stub_url}/v1/chat/completions")
+    if asgi:
+        env['PYTHONPATH'] = BACKEND_DIR
+        command = [sys.executable, '-m', 'uvicorn', 'asgi:app', '--port', str(port), '--log-level', 'warning']
+    else:
+        command = [sys.executable, os.path.join(BACKEND_DIR, 'app.py')]
+    backend = subprocess.Popen(command, cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+
+    def cleanup():
+        backend.terminate()
+        backend.wait(timeout=10)
+        stub.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    try:
+        wait_for(f"{base_url}/health")
+    except Exception:
+        cleanup()
+        raise
+    return base_url, stub_url, cleanup
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name not in ENDPOINTS:
+            raise SystemExit(f"unknown endpoint in --mix: {name} (choose from {', '.join(ENDPOINTS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def in_flight(base_url):
+    """Sum of the backend's in-flight gauge over the AI routes"""
+    total = 0.0
+    for line in requests.get(f"{base_url}/metrics", timeout=2).text.splitlines():
+        if line.startswith('phr_http_requests_in_flight{') and any(f'route="{r}"' in line for r in AI_ROUTES):
+            total += float(line.rsplit(' ', 1)[1])
+    return total
+
+
+def run_load(base_url, mix, users, concurrency, duration, seed, probe_rps):
+    names, weights = list(mix), list(mix.values())
+    samples = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(index):
+        rng = random.Random(seed + index)
+        session = requests.Session()
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, weights)[0]
+            method, path, body = ENDPOINTS[name](rng, rng.choice(users))
+            start = time.perf_counter()
+            try:
+                ok = session.request(method, base_url + path, json=body, timeout=120).ok
+            except requests.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                samples[name].append(elapsed)
+                errors[name] += not ok
+
+    saturation = []
+    probe = []
+    stop = threading.Event()
+
+    def sampler():
+        while not stop.wait(0.5):
+            try:
+                saturation.append(in_flight(base_url))
+            except requests.RequestException:
+                pass
+
+    def prober():
+        session = requests.Session()
+        while not stop.wait(1 / probe_rps):
+            start = time.perf_counter()
+            try:
+                session.get(f"{base_url}/doctors", timeout=30)
+            except requests.RequestException:
+                continue
+            probe.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    sampler_thread = threading.Thread(target=sampler, daemon=True)
+    started = time.perf_counter()
+    sampler_thread.start()
+    if probe_rps > 0:
+        threading.Thread(target=prober, daemon=True).start()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    stop.set()
+    return samples, errors, saturation, probe, wall
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def summarize(name, values, error_count, wall):
+    values = sorted(values)
+    if not values:
+        return {'endpoint': name, 'requests': 0}
+    return {
+        'endpoint': name,
+        'requests': len(values),
+        'errors': error_count,
+        'throughput_rps': round(len(values) / wall, 2),
+        'p50_ms': round(percentile(values, 0.50) * 1000, 1),
+        'p99_ms': round(percentile(values, 0.99) * 1000, 1),
+        'mean_ms': round(statistics.fmean(values) * 1000, 1),
+    }
+
+
+def stub_delta(before, after):
+    """Model-side requests and mean simulated latency during the run"""
+    requests_total, seconds_total, outcomes = 0, 0.0, {}
+    for model, entry in after['models'].items():
+        previous = before['models'].get(model, {'requests': 0, 'latency_seconds': 0.0, 'outcomes': {}})
+        requests_total += entry['requests'] - previous['requests']
+        seconds_total += entry['latency_seconds'] - previous['latency_seconds']
+        for outcome, count in entry['outcomes'].items():
+            outcomes[outcome] = outcomes.get(outcome, 0) + count - previous['outcomes'].get(outcome, 0)
+    return {
+        'model_calls': requests_total,
+        'model_mean_ms': round(seconds_total / requests_total * 1000, 1) if requests_total else None,
+        'model_seconds': round(seconds_total, 2),
+        'outcomes': outcomes,
+        'max_in_flight': after['max_in_flight'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--spawn', action='store_true', help='start the LLM stub and a backend')
+    parser.add_argument('--asgi', action='store_true', help='with --spawn, serve the backend with uvicorn asgi:app')
+    parser.add_argument('--stub-args', default='', help='llm_stub.py options used with --spawn')
+    parser.add_argument('--db', default=os.path.join(BACKEND_DIR, 'phr_database.db'),
+                        help='database copied for the spawned backend')
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000')
+    parser.add_argument('--stub-url', help='LLM stub base URL, for model-time accounting')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds')
+    parser.add_argument('--mix', default='insights=1,chatbot=2,voice_record=1,voice_doctor=1')
+    parser.add_argument('--users', default='1,2', help='comma-separated user ids to spread requests over')
+    parser.add_argument('--probe-rps', type=float, default=5.0, help='CRUD probe requests per second (0 disables)')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--json', action='store_true', help='emit machine-readable results')
+    parser.add_argument('--output', help='also write the JSON results to this file')
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    users = [int(u) for u in args.users.split(',')]
+    cleanup = None
+    base_url, stub_url = args.base_url, args.stub_url
+    if args.spawn:
+        base_url, stub_url, cleanup = spawn(args.stub_args, args.db, args.asgi)
+    try:
+        before = requests.get(f"{stub_url}/stats", timeout=5).json() if stub_url else None
+        samples, errors, saturation, probe, wall = run_load(base_url, mix, users, args.concurrency,
+                                                            args.duration, args.seed, args.probe_rps)
+        after = requests.get(f"{stub_url}/stats", timeout=5).json() if stub_url else None
+    finally:
+        if cleanup:
+            cleanup()
+
+    all_samples = [value for values in samples.values() for value in values]
+    report = {
+        'meta': {'concurrency': args.concurrency, 'duration_seconds': round(wall, 1), 'mix': mix,
+                 'stub_args': args.stub_args if args.spawn else None,
+                 'server': ('asgi' if args.asgi else 'flask') if args.spawn else None},
+        'endpoints': [summarize(name, samples[name], errors[name], wall) for name in mix],
+        'overall': summarize('all', all_samples, sum(errors.values()), wall),
+        'crud_probe': summarize('GET /doctors', probe, 0, wall),
+        'saturation': {
+            'server_in_flight_mean': round(statistics.fmean(saturation), 2) if saturation else None,
+            'server_in_flight_max': max(saturation) if saturation else None,
+            # Near 1.0: every driver worker is waiting inside the backend
+            'utilization': round(statistics.fmean(saturation) / args.concurrency, 3) if saturation else None,
+        },
+    }
+    if before and after:
+        model = stub_delta(before, after)
+        overall = report['overall']
+        if overall.get('requests') and model['model_calls']:
+            # What the backend adds on top of the model calls it makes
+            model['calls_per_request'] = round(model['model_calls'] / overall['requests'], 2)
+            model['overhead_mean_ms'] = round(
+                overall['mean_ms'] - model['model_seconds'] * 1000 / overall['requests'], 1)
+        report['model'] = model
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"{args.concurrency} workers for {report['meta']['duration_seconds']}s against {base_url}")
+    print(f"{'endpoint':<14}{'requests':>10}{'errors':>8}{'rps':>9}{'p50 ms':>10}{'p99 ms':>10}{'mean ms':>10}")
+    for r in report['endpoints'] + [report['overall']]:
+        if r['requests']:
+            print(f"{r['endpoint']:<14}{r['requests']:>10}{r['errors']:>8}{r['throughput_rps']:>9}"
+                  f"{r['p50_ms']:>10}{r['p99_ms']:>10}{r['mean_ms']:>10}")
+    crud = report['crud_probe']
+    if crud['requests']:
+        print(f"crud probe (GET /doctors): p50 {crud['p50_ms']} ms, p99 {crud['p99_ms']} ms")
+    sat = report['saturation']
+    print(f"server in-flight: mean {sat['server_in_flight_mean']}, max {sat['server_in_flight_max']}, "
+          f"utilization {sat['utilization']}")
+    if 'model' in report:
+        m = report['model']
+        print(f"model: {m['model_calls']} calls, mean {m['model_mean_ms']} ms, outcomes {m['outcomes']}, "
+              f"calls/request {m.get('calls_per_request')}, backend overhead {m.get('overhead_mean_ms')} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,298 @@
+"""
+Aggregator stress test: concurrent readers against a writing aggregator
+
+Writer threads insert, edit and delete health records and treatments while
+reader threads hammer the read paths (user summary, system analytics, urgent
+and overdue treatments, doctor recommendations and stats). Every read is
+checked for internal consistency; any exception ("dictionary changed size
+during iteration", a torn heap) counts as a failure. When the run ends the
+aggregator is compared with the ground truth the writers kept.
+
+A short interpreter switch interval makes threads interleave far more often
+than they do under real request load.
+
+Usage:
+    python benchmarks/stress_aggregator.py [--seconds 10] [--readers 8] [--writers 2]
+        [--users 200] [--records 5000] [--doctors 50] [--switch-interval 1e-6] [--json]
+
+Exits 1 when any invariant failed.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_structures import (HealthMetricsAggregator, Doctor, Severity, SEVERITY_CODES,  # noqa: E402
+                             classify_severity)
+
+DIAGNOSES = ['Hypertension', 'Type 2 Diabetes', 'Seasonal Allergies', 'Migraine',
+             'Childhood Asthma', 'Common Cold', 'Osteoarthritis', 'Influenza', 'Heart Murmur']
+SPECIALIZATIONS = ['Cardiology', 'Neurology', 'General Practice', 'Pediatrics']
+
+
+class Failures:
+    """Invariant violations and exceptions, counted per kind with a few examples"""
+
+    def __init__(self):
+        self.counts = Counter()
+        self.examples = {}
+        self._lock = threading.Lock()
+
+    def add(self, kind, detail):
+        with self._lock:
+            self.counts[kind] += 1
+            self.examples.setdefault(kind, detail)
+
+    def check(self, condition, kind, detail=''):
+        if not condition:
+            self.add(kind, detail)
+
+
+class GroundTruth:
+    """What the aggregator should hold; updated together with it under one lock"""
+
+    def __init__(self, aggregator, rng, users, doctors):
+        self.aggregator = aggregator
+        self.rng = rng
+        self.users = users
+        self.doctors = doctors
+        self.records = {}      # record_id -> record_data
+        self.treatments = {}   # treatment_id -> (follow_up_date, severity)
+        self.next_record_id = 1
+        self.next_treatment_id = 1
+        self.lock = threading.Lock()
+
+    def new_record(self):
+        record_id = self.next_record_id
+        self.next_record_id += 1
+        return {
+            'record_id': record_id,
+            'user_id': self.rng.randint(1, self.users),
+            'doctor_id': self.rng.randint(1, self.doctors),
+            'diagnosis': self.rng.choice(DIAGNOSES),
+            'record_date': f"20{self.rng.randint(15, 26)}-{self.rng.randint(1, 12):02d}-{self.rng.randint(1, 28):02d}",
+            'file_path': None
+        }
+
+    def write_once(self):
+        """One random write, applied to the aggregator and the truth"""
+        with self.lock:
+            op = self.rng.random()
+            if op < 0.35 or not self.records:
+                record = self.new_record()
+                self.aggregator.upsert_health_record(record)
+                self.records[record['record_id']] = record
+            elif op < 0.55:
+                record = dict(self.rng.choice(list(self.records.values())),
+                              diagnosis=self.rng.choice(DIAGNOSES), doctor_id=self.rng.randint(1, self.doctors))
+                self.aggregator.upsert_health_record(record)
+                self.records[record['record_id']] = record
+            elif op < 0.7:
+                record = self.records.pop(self.rng.choice(list(self.records)))
+                self.aggregator.remove_health_record(record['user_id'], record['record_id'])
+            elif op < 0.9 or not self.treatments:
+                treatment_id = self.next_treatment_id
+                self.next_treatment_id += 1
+                follow_up = datetime.now() + timedelta(days=self.rng.randint(-60, 60))
+                severity = classify_severity(self.rng.choice(DIAGNOSES))
+                self.aggregator.treatment_queue.add_treatment(treatment_id, follow_up, severity)
+                self.treatments[treatment_id] = (follow_up, severity)
+            else:
+                treatment_id = self.rng.choice(list(self.treatments))
+                del self.treatments[treatment_id]
+                self.aggregator.treatment_queue.remove_treatment(treatment_id)
+
+
+def check_timeline(aggregator, user_id, failures):
+    timeline = aggregator.user_timelines.get(user_id)
+    if timeline is None:
+        return
+    columns = (timeline.record_ids, timeline.doctor_ids, timeline.diagnosis_ids,
+               timeline.date_ordinals, timeline.severity_codes)
+    failures.check(len({len(column) for column in columns}) == 1, 'timeline columns differ in length',
+                   f"user {user_id}: {[len(column) for column in columns]}")
+    failures.check(sum(timeline.severity_counts) == len(timeline), 'timeline severity counts off',
+                   f"user {user_id}: {timeline.severity_counts} vs {len(timeline)} records")
+    failures.check(len(set(timeline.record_ids)) == len(timeline.record_ids), 'duplicate record in timeline',
+                   f"user {user_id}")
+
+
+def read_once(aggregator, rng, users, failures):
+    """One random read, checked for internal consistency"""
+    kind = rng.randrange(5)
+    if kind == 0:
+        user_id = rng.randint(1, users)
+        check_timeline(aggregator, user_id, failures)
+        summary = aggregator.get_user_health_summary(user_id)
+        if 'error' not in summary:
+            total = summary['total_records']
+            failures.check(total > 0, 'empty timeline published', f"user {user_id}")
+            failures.check(summary['critical_conditions'] <= total, 'summary critical > total', str(summary))
+            failures.check(sum(count for _, count in summary['common_conditions']) <= total,
+                           'summary conditions > total', str(summary))
+            failures.check(sum(count for _, count in summary['most_visited_doctors']) <= total,
+                           'summary visits > total', str(summary))
+    elif kind == 1:
+        analytics = aggregator.get_system_analytics()
+        failures.check(sum(analytics['severity_distribution'].values()) == analytics['total_records'],
+                       'system severity distribution != total records', str(analytics))
+        failures.check(analytics['total_users'] <= users, 'more users than exist', str(analytics))
+    elif kind == 2:
+        count = rng.randint(1, 20)
+        urgent = aggregator.treatment_queue.get_next_urgent_treatments(count)
+        failures.check(len(urgent) <= count, 'too many urgent treatments', f"{len(urgent)} > {count}")
+        failures.check(len(set(urgent)) == len(urgent), 'duplicate urgent treatment', str(urgent))
+        aggregator.treatment_queue.get_overdue_treatments()
+    elif kind == 3:
+        recommended = aggregator.doctor_analytics.recommend_doctors(
+            rng.choice(SPECIALIZATIONS + [None]), rng.randint(1, 10))
+        keys = [(doctor['patient_count'], doctor['record_count']) for doctor in recommended]
+        failures.check(keys == sorted(keys), 'recommendations not least-busy first', str(keys))
+        failures.check(all(count >= 0 for _, count in keys), 'negative doctor workload', str(keys))
+    else:
+        stats = aggregator.doctor_analytics.get_all_doctor_stats('record_count')
+        counts = [doctor['record_count'] for doctor in stats]
+        failures.check(counts == sorted(counts, reverse=True), 'doctor stats not sorted', str(counts[:10]))
+
+
+def final_check(aggregator, truth, failures):
+    """Compare the quiesced aggregator with the writers' ground truth"""
+    per_user = {}
+    for record in truth.records.values():
+        per_user.setdefault(record['user_id'], []).append(record)
+    failures.check(set(aggregator.user_timelines) == set(per_user), 'final: users differ',
+                   f"{len(aggregator.user_timelines)} vs {len(per_user)}")
+    for user_id, records in per_user.items():
+        timeline = aggregator.user_timelines.get(user_id)
+        expected = sorted(record['record_id'] for record in records)
+        failures.check(timeline is not None and sorted(timeline.record_ids) == expected,
+                       'final: timeline records differ', f"user {user_id}")
+        check_timeline(aggregator, user_id, failures)
+
+    severity = Counter(classify_severity(record['diagnosis']).value for record in truth.records.values())
+    analytics = aggregator.get_system_analytics()
+    failures.check(analytics['total_records'] == len(truth.records), 'final: total records differ',
+                   f"{analytics['total_records']} vs {len(truth.records)}")
+    failures.check(analytics['severity_distribution'] == dict(severity), 'final: severity differs',
+                   f"{analytics['severity_distribution']} vs {dict(severity)}")
+
+    doctor_records = Counter(record['doctor_id'] for record in truth.records.values())
+    doctor_patients = {}
+    for record in truth.records.values():
+        doctor_patients.setdefault(record['doctor_id'], set()).add(record['user_id'])
+    for doctor_id in range(1, truth.doctors + 1):
+        stats = aggregator.doctor_analytics.get_doctor_stats(doctor_id)
+        failures.check(stats['record_count'] == doctor_records[doctor_id], 'final: doctor record count differs',
+                       f"doctor {doctor_id}: {stats['record_count']} vs {doctor_records[doctor_id]}")
+        failures.check(stats['patient_count'] == len(doctor_patients.get(doctor_id, ())),
+                       'final: doctor patient count differs', f"doctor {doctor_id}")
+
+    queue = aggregator.treatment_queue
+    failures.check(set(queue.entries) == set(truth.treatments), 'final: treatments differ',
+                   f"{len(queue.entries)} vs {len(truth.treatments)}")
+    expected = sorted((queue._calculate_priority(follow_up, severity), follow_up, treatment_id)
+                      for treatment_id, (follow_up, severity) in truth.treatments.items())
+    failures.check(queue.get_next_urgent_treatments(20) == [entry[2] for entry in expected[:20]],
+                   'final: urgent order differs')
+    now = datetime.now()
+    failures.check(queue.get_overdue_treatments() ==
+                   {treatment_id for treatment_id, (follow_up, _) in truth.treatments.items() if follow_up < now},
+                   'final: overdue set differs')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--records', type=int, default=5000, help='records loaded before the run')
+    parser.add_argument('--doctors', type=int, default=50)
+    parser.add_argument('--switch-interval', type=float, default=1e-6,
+                        help='sys.setswitchinterval during the run; smaller interleaves more')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--json', action='store_true', help='emit machine-readable results')
+    args = parser.parse_args()
+
+    aggregator = HealthMetricsAggregator()
+    truth = GroundTruth(aggregator, random.Random(args.seed), args.users, args.doctors)
+    for doctor_id in range(1, args.doctors + 1):
+        aggregator.doctor_analytics.add_doctor(
+            Doctor(doctor_id, f"Doctor {doctor_id}", SPECIALIZATIONS[doctor_id % len(SPECIALIZATIONS)]))
+    for _ in range(args.records):
+        record = truth.new_record()
+        aggregator.upsert_health_record(record)
+        truth.records[record['record_id']] = record
+
+    failures = Failures()
+    stop = threading.Event()
+    reads = Counter()
+    writes = Counter()
+
+    def reader(index):
+        rng = random.Random(args.seed * 1000 + index)
+        while not stop.is_set():
+            try:
+                read_once(aggregator, rng, args.users, failures)
+            except Exception as e:
+                failures.add(f"read raised {type(e).__name__}", traceback.format_exc(limit=3))
+            reads[index] += 1
+
+    def writer(index):
+        while not stop.is_set():
+            try:
+                truth.write_once()
+            except Exception as e:
+                failures.add(f"write raised {type(e).__name__}", traceback.format_exc(limit=3))
+            writes[index] += 1
+
+    threads = ([threading.Thread(target=reader, args=(i,)) for i in range(args.readers)] +
+               [threading.Thread(target=writer, args=(i,)) for i in range(args.writers)])
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(args.switch_interval)
+    start = time.perf_counter()
+    try:
+        for thread in threads:
+            thread.start()
+        time.sleep(args.seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(switch_interval)
+    elapsed = time.perf_counter() - start
+
+    final_check(aggregator, truth, failures)
+    result = {
+        'seconds': round(elapsed, 2),
+        'readers': args.readers,
+        'writers': args.writers,
+        'reads': sum(reads.values()),
+        'writes': sum(writes.values()),
+        'reads_per_second': round(sum(reads.values()) / elapsed),
+        'writes_per_second': round(sum(writes.values()) / elapsed),
+        'final_records': len(truth.records),
+        'failures': dict(failures.counts),
+    }
+    if args.json:
+        result['examples'] = failures.examples
+        print(json.dumps(result, indent=2))
+    else:
+        for key, value in result.items():
+            print(f"{key:<20}{value}")
+        for kind, example in failures.examples.items():
+            print(f"\n{kind}:\n{example}")
+    sys.exit(1 if failures.counts else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+"""
+Seeded synthetic data generator for benchmarks and load tests
+
+Builds a database from phr_database.sql and replaces the sample rows with
+generated users, doctors, health records and treatments:
+- visit counts are heavy-tailed (a few patients account for most records)
+- patients mostly return to a small set of doctors
+- diagnoses follow a Zipf-like frequency over a realistic vocabulary, with
+  matching medications and procedures
+- follow-up dates fall on both sides of --today
+
+Rows are streamed into SQLite in batches, so tens of millions of records
+need no more memory than a few thousand. Passwords are stored as legacy
+plaintext ('pw<user_id>'), which the login path still accepts and upgrades.
+
+Usage:
+    python benchmarks/synthetic_data.py --db /tmp/phr_bench.db [--users 10000]
+        [--doctors 200] [--records 200000] [--seed 7] [--today YYYY-MM-DD]
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import date, timedelta
+from itertools import islice
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCHEMA_PATH = os.path.join(BACKEND_DIR, 'phr_database.sql')
+BATCH_SIZE = 10_000
+
+FIRST_NAMES = ['Aarav', 'Aisha', 'Ananya', 'Arjun', 'Carlos', 'Chen', 'Diya', 'Elena', 'Fatima', 'Grace',
+               'Hiro', 'Ishaan', 'Jonas', 'Kavya', 'Lena', 'Liam', 'Maya', 'Mei', 'Noah', 'Olivia',
+               'Priya', 'Rahul', 'Raj', 'Rohan', 'Sami', 'Sara', 'Tariq', 'Vikram', 'Yusuf', 'Zara']
+LAST_NAMES = ['Ahmed', 'Brown', 'Chen', 'Das', 'Garcia', 'Gupta', 'Iyer', 'Johnson', 'Khan', 'Kim',
+              'Kumar', 'Lee', 'Mehta', 'Nair', 'Patel', 'Rao', 'Reddy', 'Rossi', 'Shah', 'Singh',
+              'Smith', 'Tanaka', 'Verma', 'Wang', 'Williams']
+
+# (specialization, relative share of doctors)
+SPECIALIZATIONS = [
+    ('General Physician', 30), ('Pediatrician', 10), ('Cardiologist', 8), ('Dermatologist', 7),
+    ('Orthopedic', 7), ('Gynecologist', 7), ('ENT Specialist', 6), ('Pulmonologist', 5),
+    ('Endocrinologist', 5), ('Neurologist', 4), ('Psychiatrist', 4), ('Gastroenterologist', 4),
+    ('Ophthalmologist', 3), ('Oncologist', 2), ('Nephrologist', 2), ('Urologist', 2),
+]
+
+# (diagnosis, medications, procedures) in rough order of how common they are;
+# frequencies fall off as 1/rank
+DIAGNOSES = [
+    ('Common Cold', ['Paracetamol', 'Cetirizine'], ['Rest and fluids', '1 Tablet twice daily for 5 days']),
+    ('Viral Fever', ['Paracetamol', 'Ibuprofen'], ['1 Tablet every 6 hours if fever persists']),
+    ('Hypertension', ['Amlodipine', 'Losartan', 'Telmisartan'], ['1 Tablet after Breakfast', 'Monitor blood pressure daily']),
+    ('Type 2 Diabetes', ['Metformin', 'Glimepiride', 'Sitagliptin'], ['1 Tablet with meals', 'Check fasting glucose weekly']),
+    ('Seasonal Allergies', ['Cetirizine', 'Fexofenadine', 'Fluticasone Nasal Spray'], ['1 Tablet at night', '2 sprays each nostril daily']),
+    ('Gastroenteritis', ['Oral Rehydration Salts', 'Ondansetron'], ['ORS after every loose stool']),
+    ('Migraine', ['Sumatriptan', 'Naproxen'], ['1 Tablet at onset of headache']),
+    ('Lower Back Pain', ['Diclofenac', 'Thiocolchicoside'], ['Physiotherapy twice weekly', 'Apply gel twice daily']),
+    ('Childhood Asthma', ['Salbutamol Inhaler', 'Budesonide Inhaler'], ['Use 2 puffs when experiencing breathing difficulty']),
+    ('Urinary Tract Infection', ['Nitrofurantoin', 'Ciprofloxacin'], ['1 Capsule twice daily for 7 days']),
+    ('Acid Reflux', ['Pantoprazole', 'Omeprazole'], ['1 Tablet before breakfast']),
+    ('Hypothyroidism', ['Levothyroxine'], ['1 Tablet on empty stomach', 'TSH test in 6 weeks']),
+    ('Osteoarthritis', ['Paracetamol', 'Glucosamine'], ['Knee strengthening exercises', '1 Tablet twice daily']),
+    ('Iron Deficiency Anemia', ['Ferrous Sulfate', 'Folic Acid'], ['1 Tablet after lunch']),
+    ('Eczema', ['Hydrocortisone Cream', 'Moisturizer'], ['Apply twice daily to affected area']),
+    ('Sinusitis', ['Amoxicillin', 'Steam Inhalation'], ['1 Capsule three times daily for 7 days']),
+    ('Chronic Kidney Disease', ['Furosemide', 'Calcium Acetate'], ['Renal function test monthly', 'Low-salt diet']),
+    ('Anxiety Disorder', ['Sertraline', 'Escitalopram'], ['Cognitive behavioural therapy weekly']),
+    ('Depression', ['Fluoxetine', 'Sertraline'], ['1 Tablet in the morning', 'Counselling sessions']),
+    ('Heart Arrhythmia', ['Metoprolol', 'Amiodarone'], ['ECG monitoring', '1 Tablet twice daily']),
+    ('Coronary Heart Disease', ['Atorvastatin', 'Aspirin', 'Clopidogrel'], ['Cardiac rehabilitation', 'Stress test']),
+    ('Rheumatoid Arthritis', ['Methotrexate', 'Hydroxychloroquine'], ['Joint mobility exercises']),
+    ('Conjunctivitis', ['Moxifloxacin Eye Drops'], ['1 drop four times daily']),
+    ('Fractured Wrist', ['Ibuprofen'], ['Cast for 6 weeks', 'X-ray follow-up']),
+    ('Pneumonia', ['Azithromycin', 'Amoxicillin-Clavulanate'], ['Chest X-ray follow-up', '1 Tablet daily for 5 days']),
+    ('Kidney Stones', ['Tamsulosin', 'Potassium Citrate'], ['Drink 3 litres of water daily', 'Ultrasound follow-up']),
+    ('Psoriasis', ['Calcipotriol Ointment', 'Methotrexate'], ['Apply ointment at night']),
+    ('Stroke', ['Aspirin', 'Atorvastatin'], ['Neurological rehabilitation', 'MRI follow-up']),
+    ('Breast Cancer', ['Tamoxifen', 'Letrozole'], ['Chemotherapy cycle', 'Oncology review']),
+    ('Emergency Appendectomy', ['Ceftriaxone', 'Paracetamol'], ['Wound dressing every 2 days', 'Suture removal']),
+]
+DIAGNOSIS_WEIGHTS = [1.0 / rank for rank in range(1, len(DIAGNOSES) + 1)]
+
+
+def _cumulative(weights):
+    total, cumulative = 0.0, []
+    for weight in weights:
+        total += weight
+        cumulative.append(total)
+    return cumulative
+
+
+def generate_users(count, rng):
+    """(user_id, name, age, gender, contact_number, email, password) rows"""
+    genders = ['Male', 'Female', 'Other']
+    for user_id in range(1, count + 1):
+        gender = rng.choices(genders, weights=(48, 48, 4))[0]
+        # Skewed towards adults, capped at 95
+        age = min(95, max(1, int(rng.gammavariate(4.0, 10.0))))
+        yield (user_id, f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}", age, gender,
+               f"9{rng.randrange(10**8, 10**9)}", f"user{user_id}@example.com", f"pw{user_id}")
+
+
+def generate_doctors(count, rng):
+    """(doctor_id, name, specialization, contact_number, email) rows"""
+    names = [name for name, _ in SPECIALIZATIONS]
+    cumulative = _cumulative([share for _, share in SPECIALIZATIONS])
+    for doctor_id in range(1, count + 1):
+        specialization = rng.choices(names, cum_weights=cumulative)[0]
+        yield (doctor_id, f"Dr. {rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}", specialization,
+               f"98{rng.randrange(10**7, 10**8)}", f"doctor{doctor_id}@hospital.example.com")
+
+
+def generate_records(count, users, doctors, rng, today, years=10, skew=2.0):
+    """(record_id, user_id, doctor_id, diagnosis, record_date, file_path) rows.
+
+    user ids are drawn as users * u**skew, so low ids are the frequent
+    visitors; each patient sees a "home" doctor 70% of the time.
+    """
+    diagnosis_names = [name for name, _, _ in DIAGNOSES]
+    cumulative = _cumulative(DIAGNOSIS_WEIGHTS)
+    span_days = years * 365
+    start_ordinal = today.toordinal() - span_days
+    for record_id in range(1, count + 1):
+        user_id = 1 + int(users * rng.random() ** skew) if users > 1 else 1
+        if rng.random() < 0.7:
+            doctor_id = 1 + (user_id * 2654435761) % doctors
+        else:
+            doctor_id = 1 + int(doctors * rng.random() ** 1.5)
+        # Recent years are denser: sqrt pushes the mass towards today
+        day = start_ordinal + int(span_days * rng.random() ** 0.5)
+        record_date = date.fromordinal(day).isoformat()
+        file_path = f"files/report_{record_id}.pdf" if rng.random() < 0.3 else None
+        yield (record_id, user_id, doctor_id, rng.choices(diagnosis_names, cum_weights=cumulative)[0],
+               record_date, file_path)
+
+
+def generate_treatments(records, rng):
+    """(record_id, medication, procedure, follow_up_date) rows for record rows.
+
+    0-3 treatments per record (1.2 on average); follow-ups land 3-90 days
+    after the visit, so recent visits produce upcoming follow-ups.
+    """
+    treatments = {name: (medications, procedures) for name, medications, procedures in DIAGNOSES}
+    for record_id, _, _, diagnosis, record_date, _ in records:
+        medications, procedures = treatments[diagnosis]
+        visit = date.fromisoformat(record_date)
+        for _ in range(rng.choices((0, 1, 2, 3), weights=(15, 55, 25, 5))[0]):
+            follow_up = None
+            if rng.random() < 0.8:
+                follow_up = (visit + timedelta(days=rng.randint(3, 90))).isoformat()
+            yield (record_id, rng.choice(medications),
+                   rng.choice(procedures) if rng.random() < 0.85 else None, follow_up)
+
+
+def _insert_batches(conn, sql, rows):
+    inserted = 0
+    while True:
+        batch = list(islice(rows, BATCH_SIZE))
+        if not batch:
+            return inserted
+        conn.executemany(sql, batch)
+        inserted += len(batch)
+
+
+def populate(path, users=10_000, doctors=200, records=200_000, seed=7, today=None):
+    """Create a database at path from phr_database.sql and fill it with generated rows.
+
+    Returns row counts per table. The same seed and today always produce
+    the same rows.
+    """
+    today = today or date.today()
+    rng = random.Random(seed)
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    # Bulk load: no journal, and indexes are rebuilt once at the end
+    conn.execute('PRAGMA journal_mode=OFF')
+    conn.execute('PRAGMA synchronous=OFF')
+    with open(SCHEMA_PATH) as f:
+        conn.executescript(f.read())
+    conn.executescript("""
+        DELETE FROM treatment;
+        DELETE FROM health_records;
+        DELETE FROM doctors;
+        DELETE FROM users;
+        DROP INDEX IF EXISTS idx_health_records_user;
+        DROP INDEX IF EXISTS idx_health_records_doctor;
+        DROP INDEX IF EXISTS idx_treatment_record;
+    """)
+
+    counts = {}
+    with conn:
+        counts['users'] = _insert_batches(
+            conn, "INSERT INTO users (user_id, name, age, gender, contact_number, email, password) "
+                  "VALUES (?, ?, ?, ?, ?, ?, ?)", generate_users(users, rng))
+        counts['doctors'] = _insert_batches(
+            conn, "INSERT INTO doctors (doctor_id, name, specialization, contact_number, email) "
+                  "VALUES (?, ?, ?, ?, ?)", generate_doctors(doctors, rng))
+        # Records are generated twice from the same seed (once to insert, once
+        # to derive treatments) rather than held in memory
+        record_seed = rng.random()
+        counts['health_records'] = _insert_batches(
+            conn, "INSERT INTO health_records (record_id, user_id, doctor_id, diagnosis, record_date, file_path) "
+                  "VALUES (?, ?, ?, ?, ?, ?)",
+            generate_records(records, users, doctors, random.Random(record_seed), today))
+        counts['treatment'] = _insert_batches(
+            conn, "INSERT INTO treatment (record_id, medication, procedure, follow_up_date) VALUES (?, ?, ?, ?)",
+            generate_treatments(generate_records(records, users, doctors, random.Random(record_seed), today),
+                                rng))
+    conn.executescript("""
+        CREATE INDEX idx_health_records_user ON health_records(user_id);
+        CREATE INDEX idx_health_records_doctor ON health_records(doctor_id);
+        CREATE INDEX idx_treatment_record ON treatment(record_id);
+        ANALYZE;
+    """)
+    conn.close()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--db', required=True, help='output database path (overwritten)')
+    parser.add_argument('--users', type=int, default=10_000)
+    parser.add_argument('--doctors', type=int, default=200)
+    parser.add_argument('--records', type=int, default=200_000)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--today', type=date.fromisoformat, default=None,
+                        help='reference date for visits and follow-ups (default: today)')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    counts = populate(args.db, args.users, args.doctors, args.records, args.seed, args.today)
+    elapsed = time.perf_counter() - start
+    for table, count in counts.items():
+        print(f"{table:<16}{count:>12,}")
+    print(f"{'seconds':<16}{elapsed:>12.1f}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
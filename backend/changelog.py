@@ -0,0 +1,210 @@
+"""
+Change Log for Incremental Client Sync
+Every write path appends the rows it changed to the change_log table inside
+its own transaction; clients follow the log by sequence number instead of
+re-downloading whole tables
+"""
+
+import json
+import secrets
+import threading
+import time
+from typing import Callable, List, Optional, Sequence
+
+# Superseded entries (same table and row) and entries past the retention
+# window are compacted away; clients behind the floor must resync
+CHANGE_LOG_RETENTION_SECONDS = 7 * 24 * 3600
+CHANGE_LOG_MAX_ROWS = 100_000
+# Compaction runs in the background once this many entries were appended
+CHANGE_LOG_COMPACT_EVERY = 1000
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS change_log (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        table_name TEXT NOT NULL,
+        op TEXT NOT NULL CHECK (op IN ('insert', 'update', 'delete')),
+        row_id INTEGER NOT NULL,
+        user_id INTEGER,
+        payload TEXT,
+        created_at REAL NOT NULL
+    )
+    """,
+    'CREATE INDEX IF NOT EXISTS idx_change_log_user ON change_log(user_id, seq)',
+    'CREATE INDEX IF NOT EXISTS idx_change_log_row ON change_log(table_name, row_id)',
+    """
+    CREATE TABLE IF NOT EXISTS change_log_meta (
+        key TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    )
+    """,
+]
+
+
+class ChangeLog:
+    """Append-only change log with a wake-up signal for streaming readers.
+
+    Entries with user_id NULL (doctors) are visible to every user.
+    """
+
+    def __init__(self, connect: Callable, seq_base: int = 0, seq_limit: Optional[int] = None,
+                 changed: Optional[threading.Condition] = None):
+        self.connect = connect
+        # Seqs are issued from [seq_base, seq_limit), so cursors from another
+        # database's log (another shard) are recognised and resynced
+        self.seq_base = seq_base
+        self.seq_limit = seq_limit
+        self.latest_seq = seq_base
+        self.floor_seq = seq_base  # entries at or below this may have been dropped
+        self.compacted_at_seq = 0
+        self.db_id = 0  # random per database, so seqs of a recreated database are not mistaken for these
+        # Logs sharing one condition can be waited on together (wait_for_any)
+        self._changed = changed or threading.Condition()
+
+    def init_schema(self):
+        with self.connect() as conn:
+            for statement in SCHEMA:
+                conn.execute(statement)
+            if self.seq_base:
+                conn.execute("""
+                    INSERT INTO sqlite_sequence (name, seq)
+                    SELECT 'change_log', ? WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'change_log')
+                """, (self.seq_base,))
+            self.latest_seq = self.max_seq(conn)
+            row = conn.execute("SELECT value FROM change_log_meta WHERE key = 'floor_seq'").fetchone()
+            self.floor_seq = max(row[0] if row else 0, self.seq_base)
+            conn.execute("INSERT OR IGNORE INTO change_log_meta (key, value) VALUES ('db_id', ?)",
+                         (secrets.randbits(62),))
+            self.db_id = conn.execute("SELECT value FROM change_log_meta WHERE key = 'db_id'").fetchone()[0]
+            self.compacted_at_seq = self.latest_seq
+
+    def max_seq(self, conn) -> int:
+        """Last seq committed to this log (seq_base while nothing was issued).
+
+        Read from sqlite_sequence rather than MAX(seq): a log emptied by
+        reset_db.py keeps its floor at the last seq issued, and this must
+        not fall below it.
+        """
+        return conn.execute(
+            "SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'change_log'), 0), ?)",
+            (self.seq_base,)
+        ).fetchone()[0]
+
+    def append(self, conn, table: str, op: str, row_id: int, user_id: Optional[int] = None,
+               payload: Optional[dict] = None) -> int:
+        """Log one changed row inside the caller's write transaction; returns its seq.
+
+        payload is the full row after the write (None for deletes), so a
+        later entry for the same row always supersedes earlier ones.
+        """
+        cursor = conn.execute(
+            "INSERT INTO change_log (table_name, op, row_id, user_id, payload, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (table, op, row_id, user_id, json.dumps(payload) if payload is not None else None, time.time())
+        )
+        return cursor.lastrowid
+
+    def append_deletes(self, conn, table: str, key: str, user_column: Optional[str], source: str, params=()) -> int:
+        """Log a set-based delete with INSERT ... SELECT before the DELETE runs,
+        so the affected ids never pass through Python; returns the last seq.
+
+        source is the FROM/WHERE clause selecting the rows about to be deleted.
+        """
+        conn.execute(f"""
+            INSERT INTO change_log (table_name, op, row_id, user_id, payload, created_at)
+            SELECT '{table}', 'delete', {key}, {user_column or 'NULL'}, NULL, ? FROM {source}
+        """, (time.time(), *params))
+        return conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+
+    def notify(self, seq: int):
+        """Wake streaming readers; call after the write transaction commits"""
+        with self._changed:
+            self.latest_seq = max(self.latest_seq, seq)
+            self._changed.notify_all()
+
+    def claim_compaction(self) -> bool:
+        """True once per CHANGE_LOG_COMPACT_EVERY appended entries"""
+        with self._changed:
+            if self.latest_seq - self.compacted_at_seq < CHANGE_LOG_COMPACT_EVERY:
+                return False
+            self.compacted_at_seq = self.latest_seq
+            return True
+
+    def wait_for_change(self, after_seq: int, timeout: float) -> bool:
+        """Block until an entry newer than after_seq is committed, or timeout"""
+        with self._changed:
+            return self._changed.wait_for(lambda: self.latest_seq > after_seq, timeout)
+
+    def changes_since(self, conn, after_seq: int, user_id: Optional[int] = None, limit: int = 500,
+                      shared: bool = True) -> List[dict]:
+        """Entries after after_seq, oldest first, for one user (plus shared entries) or for everyone;
+        shared=False leaves out the shared entries, for a reader that takes them from another log"""
+        if user_id is None:
+            rows = conn.execute(
+                f"SELECT * FROM change_log WHERE seq > ? {'' if shared else 'AND user_id IS NOT NULL'} "
+                f"ORDER BY seq LIMIT ?", (after_seq, limit)
+            ).fetchall()
+        else:
+            rows = conn.execute("""
+                SELECT * FROM change_log WHERE seq > ? AND (user_id = ? OR user_id IS NULL)
+                ORDER BY seq LIMIT ?
+            """, (after_seq, user_id, limit)).fetchall()
+        return [{
+            'seq': row['seq'],
+            'table': row['table_name'],
+            'op': row['op'],
+            'id': row['row_id'],
+            'user_id': row['user_id'],
+            'data': json.loads(row['payload']) if row['payload'] else None,
+            'at': row['created_at']
+        } for row in rows]
+
+    def refresh_floor(self, conn) -> int:
+        """Pick up a floor raised by another process's compaction"""
+        row = conn.execute("SELECT value FROM change_log_meta WHERE key = 'floor_seq'").fetchone()
+        if row and row[0] > self.floor_seq:
+            self.floor_seq = row[0]
+        return self.floor_seq
+
+    def needs_resync(self, after_seq: int) -> bool:
+        """True when entries after after_seq may already have been compacted
+        away, or after_seq is not a seq of this log"""
+        return after_seq < self.floor_seq or (self.seq_limit is not None and after_seq >= self.seq_limit)
+
+    def compact(self, conn, retention_seconds: float = CHANGE_LOG_RETENTION_SECONDS,
+                max_rows: int = CHANGE_LOG_MAX_ROWS) -> int:
+        """Drop superseded entries, then entries past retention or beyond max_rows.
+
+        Returns the number of entries removed. The floor only moves for the
+        second kind: dropping a superseded entry loses nothing, because the
+        newer entry for the same row carries the full state.
+        """
+        removed = conn.execute("""
+            DELETE FROM change_log WHERE seq < (
+                SELECT MAX(newer.seq) FROM change_log newer
+                WHERE newer.table_name = change_log.table_name AND newer.row_id = change_log.row_id
+            )
+        """).rowcount
+
+        cutoff_seq = conn.execute(
+            "SELECT COALESCE(MAX(seq), 0) FROM change_log WHERE created_at < ?",
+            (time.time() - retention_seconds,)
+        ).fetchone()[0]
+        overflow_seq = conn.execute(
+            "SELECT seq FROM change_log ORDER BY seq DESC LIMIT 1 OFFSET ?", (max_rows,)
+        ).fetchone()
+        floor = max(cutoff_seq, overflow_seq[0] if overflow_seq else 0)
+        if floor > self.floor_seq:
+            removed += conn.execute("DELETE FROM change_log WHERE seq <= ?", (floor,)).rowcount
+            conn.execute(
+                "INSERT OR REPLACE INTO change_log_meta (key, value) VALUES ('floor_seq', ?)", (floor,)
+            )
+            self.floor_seq = floor
+        return removed
+
+
+def wait_for_any(logs: Sequence[ChangeLog], after_seqs: Sequence[int], timeout: float) -> bool:
+    """Block until any of logs, which must share one condition, has an entry
+    newer than its after_seq, or timeout"""
+    changed = logs[0]._changed
+    with changed:
+        return changed.wait_for(lambda: any(log.latest_seq > seq for log, seq in zip(logs, after_seqs)), timeout)
@@ -0,0 +1,404 @@
+"""
+Columnar Cohort Analytics
+Loads users, health_records and treatment into NumPy column arrays and answers
+group-by, histogram and percentile queries with vectorized operations.
+Inserts are appended past a per-table (and per-shard) high-water mark; edits
+and deletes re-read only the rows the write paths mark as touched
+"""
+
+import threading
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Sequence
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency, the cohort endpoints report 503 without it
+    np = None
+
+GENDERS = ('Male', 'Female', 'Other')
+DEFAULT_AGE_BANDS = (0, 18, 30, 45, 60, 75)
+DEFAULT_PERCENTILES = (50, 75, 90, 99)
+FOLLOW_UP_GRACE_DAYS = 14
+# Keeps "WHERE id IN (...)" under SQLite's bound-variable limit
+FETCH_CHUNK_SIZE = 500
+
+# table -> loaded columns, primary key first
+TABLES = {
+    'users': ('user_id', 'age', 'gender'),
+    'health_records': ('record_id', 'user_id', 'doctor_id', 'diagnosis', 'record_date'),
+    'treatment': ('treatment_id', 'record_id', 'follow_up_date'),
+}
+# Relations read per table: full history, archived rows included (see archive.py)
+SOURCES = {'health_records': 'health_records_all', 'treatment': 'treatment_all'}
+
+_FULL_RELOAD = object()
+
+
+def _to_days(values: Sequence[Optional[str]]):
+    """Parse 'YYYY-MM-DD[...]' strings to datetime64[D]; missing or bad dates become NaT"""
+    texts = [value[:10] if value else 'NaT' for value in values]
+    try:
+        return np.array(texts, dtype='datetime64[D]')
+    except ValueError:
+        days = np.empty(len(texts), dtype='datetime64[D]')
+        for i, text in enumerate(texts):
+            try:
+                days[i] = np.datetime64(text, 'D')
+            except ValueError:
+                days[i] = np.datetime64('NaT')
+        return days
+
+
+def _distinct(values):
+    """Sorted distinct values; a sort and a neighbour compare beat np.unique's hashing on int keys"""
+    values = np.sort(values)
+    if len(values):
+        keep = np.empty(len(values), dtype=bool)
+        keep[0] = True
+        np.not_equal(values[1:], values[:-1], out=keep[1:])
+        values = values[keep]
+    return values
+
+
+def _searchsorted(keys, needles, side: str = 'left'):
+    """np.searchsorted for unordered needles: searching them in order keeps
+    the binary searches cache-friendly, which is several times faster"""
+    order = np.argsort(needles, kind='stable')
+    positions = np.empty(len(needles), dtype=np.int64)
+    positions[order] = np.searchsorted(keys, needles[order], side=side)
+    return positions
+
+
+def _age_band_labels(bands: Sequence[int]) -> List[str]:
+    labels = [f"{low}-{high - 1}" for low, high in zip(bands, bands[1:])]
+    labels.append(f"{bands[-1]}+")
+    return labels
+
+
+def _distribution(values, bins: int, percentiles: Sequence[int]) -> dict:
+    """Summary statistics, percentiles and a histogram of a 1-D array"""
+    if len(values) == 0:
+        return {'count': 0, 'mean': 0.0, 'min': 0, 'max': 0,
+                'percentiles': {}, 'histogram': {'edges': [], 'counts': []}}
+    counts, edges = np.histogram(values, bins=bins)
+    return {
+        'count': int(len(values)),
+        'mean': round(float(values.mean()), 3),
+        'min': int(values.min()),
+        'max': int(values.max()),
+        'percentiles': {f"p{p}": round(float(v), 3)
+                        for p, v in zip(percentiles, np.percentile(values, percentiles))},
+        'histogram': {'edges': [round(float(e), 3) for e in edges], 'counts': counts.tolist()}
+    }
+
+
+class CohortAnalytics:
+    """NumPy column store over users, health_records and treatment.
+
+    Readers take a reference to the current tables under a short lock and
+    compute outside it; refresh() builds new arrays and swaps them in.
+    """
+
+    def __init__(self):
+        self.tables: Dict[str, Dict[str, 'np.ndarray']] = {}
+        self.version: Optional[str] = None
+        self.high_water: Dict[str, List[int]] = {}  # table -> highest key read from each shard
+        self.diagnoses: List[str] = []         # diagnosis id -> text
+        self.diagnosis_ids: Dict[str, int] = {}
+        self._pending: Dict[str, object] = {}  # table -> set of touched ids, or _FULL_RELOAD
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    @property
+    def available(self) -> bool:
+        return np is not None
+
+    def invalidate(self, table: str, ids: Optional[Iterable[int]] = None):
+        """Mark rows of table as changed or deleted (all rows when ids is None).
+
+        Call after the write commits and before its table version is bumped,
+        so the refresh triggered by the new version sees the mark.
+        """
+        with self._lock:
+            if ids is None or self._pending.get(table) is _FULL_RELOAD:
+                self._pending[table] = _FULL_RELOAD
+            else:
+                self._pending.setdefault(table, set()).update(int(i) for i in ids)
+
+    def refresh(self, *conns, version: Optional[str] = None):
+        """Bring the arrays up to date with SQLite (one connection per shard);
+        a no-op while version is unchanged"""
+        if version is not None and version == self.version:
+            return
+        with self._refresh_lock:
+            if version is not None and version == self.version:
+                return
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                tables = dict(self.tables)
+            high_water = dict(self.high_water)
+
+            for table, columns in TABLES.items():
+                key = columns[0]
+                sql = f"SELECT {', '.join(columns)} FROM {SOURCES.get(table, table)}"
+                touched = pending.get(table)
+                current = tables.get(table)
+                marks = high_water.get(table)
+                if current is None or touched is _FULL_RELOAD or marks is None or len(marks) != len(conns):
+                    parts = [conn.execute(f"{sql} ORDER BY {key}").fetchall() for conn in conns]
+                    high_water[table] = [part[-1][0] if part else 0 for part in parts]
+                    tables[table] = self._convert(table, [row for part in parts for row in part])
+                    if len(conns) > 1:
+                        tables[table] = self._sort(tables[table], key)
+                    continue
+
+                # Ids grow within a shard, so each shard's inserts lie past its own mark
+                rows, marks = [], list(marks)
+                for i, conn in enumerate(conns):
+                    part = conn.execute(f"{sql} WHERE {key} > ? ORDER BY {key}", (marks[i],)).fetchall()
+                    if part:
+                        marks[i] = part[-1][0]
+                    rows += part
+                high_water[table] = marks
+                # Rows past the high-water marks were just read as new
+                fresh = {row[0] for row in rows}
+                touched = sorted(i for i in (touched or ()) if i not in fresh)
+                for start in range(0, len(touched), FETCH_CHUNK_SIZE):
+                    chunk = touched[start:start + FETCH_CHUNK_SIZE]
+                    placeholders = ','.join('?' * len(chunk))
+                    for conn in conns:
+                        rows += conn.execute(f"{sql} WHERE {key} IN ({placeholders})", chunk).fetchall()
+                if rows or touched:
+                    # With several shards, new rows do not all sort after the current ones
+                    tables[table] = self._merge(current, self._convert(table, rows), key, touched,
+                                                resort=len(conns) > 1)
+
+            with self._lock:
+                self.tables = tables
+                self.version = version
+            self.high_water = high_water
+
+    def _encode_diagnoses(self, texts: Sequence[str]):
+        codes = np.empty(len(texts), dtype=np.int32)
+        for i, text in enumerate(texts):
+            code = self.diagnosis_ids.get(text)
+            if code is None:
+                code = self.diagnosis_ids[text] = len(self.diagnoses)
+                self.diagnoses.append(text)
+            codes[i] = code
+        return codes
+
+    def _convert(self, table: str, rows) -> Dict[str, 'np.ndarray']:
+        columns = list(zip(*rows)) if rows else [()] * len(TABLES[table])
+        if table == 'users':
+            user_ids, ages, genders = columns
+            gender_codes = {gender: code for code, gender in enumerate(GENDERS)}
+            return {
+                'user_id': np.array(user_ids, dtype=np.int64),
+                'age': np.array([-1 if age is None else age for age in ages], dtype=np.int16),
+                'gender': np.array([gender_codes.get(g, -1) for g in genders], dtype=np.int8)
+            }
+        if table == 'health_records':
+            record_ids, user_ids, doctor_ids, diagnoses, record_dates = columns
+            return {
+                'record_id': np.array(record_ids, dtype=np.int64),
+                'user_id': np.array(user_ids, dtype=np.int64),
+                'doctor_id': np.array(doctor_ids, dtype=np.int64),
+                'diagnosis': self._encode_diagnoses(diagnoses),
+                'record_date': _to_days(record_dates)
+            }
+        treatment_ids, record_ids, follow_up_dates = columns
+        return {
+            'treatment_id': np.array(treatment_ids, dtype=np.int64),
+            'record_id': np.array(record_ids, dtype=np.int64),
+            'follow_up_date': _to_days(follow_up_dates)
+        }
+
+    @staticmethod
+    def _sort(columns, key: str):
+        order = np.argsort(columns[key], kind='stable')
+        return {name: column[order] for name, column in columns.items()}
+
+    @classmethod
+    def _merge(cls, current, new, key: str, touched: List[int], resort: bool = False):
+        """Drop touched rows from current, append new rows and keep key order"""
+        keep = ~np.isin(current[key], touched) if touched else slice(None)
+        merged = {name: np.concatenate([column[keep], new[name]]) for name, column in current.items()}
+        if touched or resort:
+            merged = cls._sort(merged, key)
+        return merged
+
+    def _snapshot(self):
+        with self._lock:
+            return self.tables
+
+    @staticmethod
+    def _join(left_keys, right_keys):
+        """Positions of left_keys in sorted right_keys, plus a mask of the keys found"""
+        if len(right_keys) == 0:
+            return np.zeros(len(left_keys), dtype=np.int64), np.zeros(len(left_keys), dtype=bool)
+        positions = _searchsorted(right_keys, left_keys)
+        positions[positions >= len(right_keys)] = 0
+        return positions, right_keys[positions] == left_keys
+
+    def _user_groups(self, users, by: str, age_bands: Sequence[int]):
+        """Group code per user (-1 when unknown) and the group labels"""
+        if by == 'gender':
+            return users['gender'].astype(np.int64), list(GENDERS)
+        groups = np.digitize(users['age'], age_bands) - 1
+        groups[users['age'] < 0] = -1
+        return groups, _age_band_labels(age_bands)
+
+    # ------------------------------------------------------------ queries
+
+    def visits_per_month(self, start: Optional[date] = None, end: Optional[date] = None) -> List[dict]:
+        """Visits and distinct patients per calendar month"""
+        records = self._snapshot()['health_records']
+        days = records['record_date']
+        mask = ~np.isnat(days)
+        if start is not None:
+            mask &= days >= np.datetime64(start, 'D')
+        if end is not None:
+            mask &= days <= np.datetime64(end, 'D')
+        months = days[mask].astype('datetime64[M]')
+        users = records['user_id'][mask]
+        if len(months) == 0:
+            return []
+
+        month_values, visits = np.unique(months, return_counts=True)
+        # Distinct (month, user) pairs, counted per month
+        span = int(users.max()) + 1
+        pairs = _distinct(months.astype(np.int64) * span + users)
+        patient_months, patients = np.unique(pairs // span, return_counts=True)
+        patients_by_month = dict(zip(patient_months.tolist(), patients.tolist()))
+        return [
+            {'month': str(month), 'visits': int(count),
+             'patients': patients_by_month[int(month.astype(np.int64))]}
+            for month, count in zip(month_values, visits)
+        ]
+
+    def diagnosis_prevalence(self, by: str = 'age', top: int = 10,
+                             age_bands: Sequence[int] = DEFAULT_AGE_BANDS) -> List[dict]:
+        """Share of each cohort's patients diagnosed with each condition, top conditions first"""
+        tables = self._snapshot()
+        users, records = tables['users'], tables['health_records']
+        groups, labels = self._user_groups(users, by, age_bands)
+        population = np.bincount(groups[groups >= 0], minlength=len(labels))
+
+        user_index, found = self._join(records['user_id'], users['user_id'])
+        user_index, diagnoses = user_index[found], records['diagnosis'][found]
+        n_diagnoses = int(diagnoses.max()) + 1 if len(diagnoses) else 0
+        counts = np.zeros((len(labels), n_diagnoses), dtype=np.int64)
+        if n_diagnoses:
+            # Each patient counts once per diagnosis, however many visits
+            pairs = _distinct(user_index * n_diagnoses + diagnoses)
+            pair_groups = groups[pairs // n_diagnoses]
+            known = pair_groups >= 0
+            counts = np.bincount(pair_groups[known] * n_diagnoses + (pairs % n_diagnoses)[known],
+                                 minlength=len(labels) * n_diagnoses).reshape(len(labels), n_diagnoses)
+
+        cohorts = []
+        for group, label in enumerate(labels):
+            row = counts[group]
+            ranked = np.argsort(-row, kind='stable')[:top]
+            cohorts.append({
+                'cohort': label,
+                'patients': int(population[group]),
+                'diagnoses': [
+                    {'diagnosis': self.diagnoses[d], 'patients': int(row[d]),
+                     'prevalence': round(float(row[d]) / float(population[group]), 4)}
+                    for d in ranked if row[d] > 0
+                ]
+            })
+        return cohorts
+
+    def doctor_workload(self, bins: int = 10, percentiles: Sequence[int] = DEFAULT_PERCENTILES,
+                        top: int = 5) -> dict:
+        """Distribution of records and distinct patients per doctor (doctors with records)"""
+        records = self._snapshot()['health_records']
+        doctor_ids, doctor_index = np.unique(records['doctor_id'], return_inverse=True)
+        record_counts = np.bincount(doctor_index, minlength=len(doctor_ids))
+        patient_counts = np.zeros(len(doctor_ids), dtype=np.int64)
+        if len(doctor_ids):
+            span = int(records['user_id'].max()) + 1
+            pairs = _distinct(doctor_index.astype(np.int64) * span + records['user_id'])
+            patient_counts = np.bincount(pairs // span, minlength=len(doctor_ids))
+
+        busiest = np.argsort(-record_counts, kind='stable')[:top]
+        return {
+            'doctors': int(len(doctor_ids)),
+            'records_per_doctor': _distribution(record_counts, bins, percentiles),
+            'patients_per_doctor': _distribution(patient_counts, bins, percentiles),
+            'busiest': [{'doctor_id': int(doctor_ids[i]), 'records': int(record_counts[i]),
+                         'patients': int(patient_counts[i])} for i in busiest]
+        }
+
+    def follow_up_adherence(self, grace_days: int = FOLLOW_UP_GRACE_DAYS, by: Optional[str] = None,
+                            today: Optional[date] = None,
+                            age_bands: Sequence[int] = DEFAULT_AGE_BANDS) -> dict:
+        """Share of follow-ups met by a later visit within grace_days of the due date.
+
+        Only follow-ups whose window has closed count towards the rate; the
+        rest are reported as open (due, window still running) or upcoming.
+        """
+        tables = self._snapshot()
+        users, records, treatments = tables['users'], tables['health_records'], tables['treatment']
+        today = np.datetime64(today or date.today(), 'D')
+        grace = np.timedelta64(grace_days, 'D')
+
+        follow_ups = treatments['follow_up_date']
+        record_index, found = self._join(treatments['record_id'], records['record_id'])
+        found &= ~np.isnat(follow_ups)
+        follow_ups, record_index = follow_ups[found], record_index[found]
+        patients = records['user_id'][record_index]
+        visit_dates = records['record_date'][record_index]
+
+        closed = follow_ups + grace < today
+        upcoming = int((follow_ups > today).sum())
+        open_count = int(len(follow_ups) - closed.sum() - upcoming)
+        follow_ups, patients, visit_dates = follow_ups[closed], patients[closed], visit_dates[closed]
+
+        # Visits sorted by (user, day); one searchsorted pair per follow-up
+        dated = ~np.isnat(records['record_date'])
+        visit_users = records['user_id'][dated]
+        visit_days = records['record_date'][dated].astype(np.int64)
+        adherent = np.zeros(len(follow_ups), dtype=bool)
+        if len(visit_days) and len(follow_ups):
+            first_day = int(visit_days.min())
+            span = int(visit_days.max()) - first_day + 1
+            keys = np.sort(visit_users * span + (visit_days - first_day))
+            # The visit must come after the one that scheduled the follow-up
+            low = np.maximum((follow_ups - grace).astype(np.int64), visit_dates.astype(np.int64) + 1)
+            high = (follow_ups + grace).astype(np.int64)
+            low, high = low - first_day, high - first_day
+            in_range = (low <= high) & (high >= 0) & (low < span)
+            low, high = np.clip(low, 0, span - 1), np.clip(high, 0, span - 1)
+            hits = (_searchsorted(keys, patients * span + high, side='right')
+                    - _searchsorted(keys, patients * span + low, side='left'))
+            adherent = in_range & (hits > 0)
+
+        result = {
+            'grace_days': grace_days,
+            'due': int(len(follow_ups)),
+            'adherent': int(adherent.sum()),
+            'adherence_rate': round(float(adherent.mean()), 4) if len(follow_ups) else None,
+            'open': open_count,
+            'upcoming': upcoming
+        }
+        if by is not None:
+            groups, labels = self._user_groups(users, by, age_bands)
+            user_index, known = self._join(patients, users['user_id'])
+            cohort = np.where(known, groups[user_index], -1)
+            valid = cohort >= 0
+            due = np.bincount(cohort[valid], minlength=len(labels))
+            met = np.bincount(cohort[valid], weights=adherent[valid], minlength=len(labels))
+            result['cohorts'] = [
+                {'cohort': label, 'due': int(due[g]), 'adherent': int(met[g]),
+                 'adherence_rate': round(float(met[g]) / float(due[g]), 4) if due[g] else None}
+                for g, label in enumerate(labels)
+            ]
+        return result
+
+
+# Global instance for the application
+cohort_engine = CohortAnalytics()
@@ -3,11 +3,16 @@ Advanced Data Structures for Healthcare PHR System
 Implements efficient data structures for better performance and functionality
 """
 
+from array import array
 from collections import defaultdict, deque, Counter
-from dataclasses import dataclass, field
+from contextlib import contextmanager
+from dataclasses import dataclass
 from typing import Dict, List, Set, Optional, Tuple
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+import bisect
 import heapq
+import sys
+import threading
 from enum import Enum
 
 class Severity(Enum):
@@ -15,32 +20,56 @@ class Severity(Enum):
     MODERATE = "moderate"
     CRITICAL = "critical"
 
-@dataclass
+CRITICAL_KEYWORDS = ('hypertension', 'diabetes', 'heart', 'cancer', 'stroke', 'emergency')
+MODERATE_KEYWORDS = ('asthma', 'allergies', 'migraine', 'arthritis', 'chronic')
+
+# Severity <-> one-byte code used in the columnar timelines
+SEVERITY_BY_CODE = (Severity.MILD, Severity.MODERATE, Severity.CRITICAL)
+SEVERITY_CODES = {severity: code for code, severity in enumerate(SEVERITY_BY_CODE)}
+
+def classify_severity(diagnosis: str) -> Severity:
+    """Auto-classify severity based on diagnosis keywords"""
+    diagnosis_lower = diagnosis.lower()
+    
+    if any(keyword in diagnosis_lower for keyword in CRITICAL_KEYWORDS):
+        return Severity.CRITICAL
+    elif any(keyword in diagnosis_lower for keyword in MODERATE_KEYWORDS):
+        return Severity.MODERATE
+    return Severity.MILD
+
+def _date_ordinal(record_date) -> int:
+    """Ordinal of a record date; undated or malformed records sort as date.min"""
+    if isinstance(record_date, str):
+        # Timestamps keep only their date part, which is all the timeline stores
+        try:
+            record_date = date.fromisoformat(record_date[:10])
+        except ValueError:
+            record_date = None
+    return record_date.toordinal() if record_date else date.min.toordinal()
+
 class HealthRecord:
-    """Enhanced health record with computed properties"""
-    record_id: int
-    user_id: int
-    doctor_id: int
-    diagnosis: str
-    record_date: datetime
-    severity: Severity = field(default=Severity.MILD)
-    file_path: Optional[str] = None
-    
-    def __post_init__(self):
-        self.severity = self._calculate_severity()
-    
-    def _calculate_severity(self) -> Severity:
-        """Auto-classify severity based on diagnosis keywords"""
-        critical_keywords = ['hypertension', 'diabetes', 'heart', 'cancer', 'stroke', 'emergency']
-        moderate_keywords = ['asthma', 'allergies', 'migraine', 'arthritis', 'chronic']
-        
-        diagnosis_lower = self.diagnosis.lower()
-        
-        if any(keyword in diagnosis_lower for keyword in critical_keywords):
-            return Severity.CRITICAL
-        elif any(keyword in diagnosis_lower for keyword in moderate_keywords):
-            return Severity.MODERATE
-        return Severity.MILD
+    """Enhanced health record with computed properties.
+    
+    Timelines store records column-wise; HealthRecord objects are only
+    materialized for query results, so they carry no per-instance __dict__.
+    """
+    __slots__ = ('record_id', 'user_id', 'doctor_id', 'diagnosis', 'record_date', 'severity', 'file_path')
+    
+    def __init__(self, record_id: int, user_id: int, doctor_id: int, diagnosis: str,
+                 record_date: datetime, file_path: Optional[str] = None,
+                 severity: Optional[Severity] = None):
+        self.record_id = record_id
+        self.user_id = user_id
+        self.doctor_id = doctor_id
+        self.diagnosis = diagnosis
+        self.record_date = record_date
+        self.file_path = file_path
+        self.severity = severity or classify_severity(diagnosis)
+    
+    def __repr__(self):
+        return (f"HealthRecord(record_id={self.record_id}, user_id={self.user_id}, "
+                f"doctor_id={self.doctor_id}, diagnosis={self.diagnosis!r}, "
+                f"record_date={self.record_date!r}, severity={self.severity})")
 
 @dataclass
 class Doctor:
@@ -48,8 +77,8 @@ class Doctor:
     doctor_id: int
     name: str
     specialization: str
-    contact_number: str = ""
-    email: str = ""
+    contact_number: Optional[str] = None
+    email: Optional[str] = None
     patient_count: int = 0
     avg_severity_score: float = 0.0
 
@@ -60,51 +89,229 @@ class HealthDataCache:
         self.cache: Dict[str, any] = {}
         self.access_order = deque()
         self.max_size = max_size
+        # Shared across request threads; guards cache/access_order consistency
+        self._lock = threading.Lock()
     
     def get(self, key: str):
-        if key in self.cache:
-            # Move to end (most recently used)
-            self.access_order.remove(key)
-            self.access_order.append(key)
-            return self.cache[key]
-        return None
+        with self._lock:
+            if key in self.cache:
+                # Move to end (most recently used)
+                self.access_order.remove(key)
+                self.access_order.append(key)
+                return self.cache[key]
+            return None
     
     def put(self, key: str, value: any):
-        if key in self.cache:
-            self.access_order.remove(key)
-        elif len(self.cache) >= self.max_size:
-            # Remove least recently used
-            oldest = self.access_order.popleft()
-            del self.cache[oldest]
-        
-        self.cache[key] = value
-        self.access_order.append(key)
+        with self._lock:
+            if key in self.cache:
+                self.access_order.remove(key)
+            elif len(self.cache) >= self.max_size:
+                # Remove least recently used
+                oldest = self.access_order.popleft()
+                del self.cache[oldest]
+            
+            self.cache[key] = value
+            self.access_order.append(key)
 
-class PatientTimeline:
-    """Advanced timeline data structure for patient health records"""
+class ReadWriteLock:
+    """Many readers or one writer. A waiting writer holds off new readers,
+    so a steady stream of reads cannot starve the write path."""
     
     def __init__(self):
-        self.records_by_year: defaultdict = defaultdict(list)
-        self.severity_index: defaultdict = defaultdict(list)
-        self.doctor_visits: defaultdict = defaultdict(int)
-        self.condition_frequency: Counter = Counter()
+        self._changed = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._writers_waiting = 0
+    
+    @contextmanager
+    def read(self):
+        with self._changed:
+            while self._writing or self._writers_waiting:
+                self._changed.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._changed:
+                self._readers -= 1
+                if not self._readers:
+                    self._changed.notify_all()
+    
+    @contextmanager
+    def write(self):
+        with self._changed:
+            self._writers_waiting += 1
+            while self._writing or self._readers:
+                self._changed.wait()
+            self._writers_waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._changed:
+                self._writing = False
+                self._changed.notify_all()
+
+class DiagnosisDictionary:
+    """Dictionary encoding for diagnosis strings shared by all timelines.
+    
+    Each distinct diagnosis is stored once and classified once; records
+    refer to it by a small integer id.
+    """
+    
+    def __init__(self):
+        self.ids: Dict[str, int] = {}
+        self.texts: List[str] = []
+        self.severity_codes = array('B')
+        self._lock = threading.Lock()
+    
+    def encode(self, diagnosis: str) -> int:
+        diagnosis_id = self.ids.get(diagnosis)
+        if diagnosis_id is not None:
+            return diagnosis_id
+        with self._lock:
+            diagnosis_id = self.ids.get(diagnosis)
+            if diagnosis_id is None:
+                diagnosis = sys.intern(diagnosis)
+                diagnosis_id = len(self.texts)
+                self.texts.append(diagnosis)
+                self.severity_codes.append(SEVERITY_CODES[classify_severity(diagnosis)])
+                self.ids[diagnosis] = diagnosis_id
+            return diagnosis_id
+    
+    def decode(self, diagnosis_id: int) -> str:
+        return self.texts[diagnosis_id]
+    
+    def severity(self, diagnosis_id: int) -> Severity:
+        return SEVERITY_BY_CODE[self.severity_codes[diagnosis_id]]
+    
+    def __len__(self):
+        return len(self.texts)
+
+class PatientTimeline:
+    """Advanced timeline data structure for patient health records.
+    
+    Records are kept as parallel typed arrays (one slot per record) instead
+    of one object per record; dates are proleptic Gregorian ordinals.
+    """
+    
+    def __init__(self, dictionary: DiagnosisDictionary):
+        self.dictionary = dictionary
+        self.record_ids = array('q')
+        self.doctor_ids = array('q')
+        self.diagnosis_ids = array('I')
+        self.date_ordinals = array('I')
+        self.severity_codes = array('B')
+        self.file_paths: Dict[int, str] = {}  # record_id -> path, only for records with a file
+        self.severity_counts = [0] * len(SEVERITY_BY_CODE)
+    
+    def __len__(self):
+        return len(self.record_ids)
+    
+    def append(self, record_id: int, doctor_id: int, diagnosis: str, date_ordinal: int,
+               file_path: Optional[str] = None):
+        """Add one record to the columns and update all indices"""
+        diagnosis_id = self.dictionary.encode(diagnosis)
+        severity_code = self.dictionary.severity_codes[diagnosis_id]
+        self.record_ids.append(record_id)
+        self.doctor_ids.append(doctor_id)
+        self.diagnosis_ids.append(diagnosis_id)
+        self.date_ordinals.append(date_ordinal)
+        self.severity_codes.append(severity_code)
+        if file_path:
+            self.file_paths[record_id] = file_path
+        self.severity_counts[severity_code] += 1
     
     def add_record(self, record: HealthRecord):
         """Add record and update all indices"""
-        year = record.record_date.year
-        self.records_by_year[year].append(record)
-        self.severity_index[record.severity].append(record)
-        self.doctor_visits[record.doctor_id] += 1
-        self.condition_frequency[record.diagnosis] += 1
-        
-        # Sort records by date within each year
-        self.records_by_year[year].sort(key=lambda r: r.record_date, reverse=True)
+        self.append(record.record_id, record.doctor_id, record.diagnosis,
+                    record.record_date.toordinal(), record.file_path)
     
-    def get_records_by_year(self, year: int) -> List[HealthRecord]:
-        return self.records_by_year[year]
+    def copy(self) -> 'PatientTimeline':
+        """Independent copy of the columns (one memcpy each), sharing the dictionary"""
+        timeline = PatientTimeline(self.dictionary)
+        timeline.record_ids = self.record_ids[:]
+        timeline.doctor_ids = self.doctor_ids[:]
+        timeline.diagnosis_ids = self.diagnosis_ids[:]
+        timeline.date_ordinals = self.date_ordinals[:]
+        timeline.severity_codes = self.severity_codes[:]
+        timeline.file_paths = dict(self.file_paths)
+        timeline.severity_counts = list(self.severity_counts)
+        return timeline
     
-    def get_critical_records(self) -> List[HealthRecord]:
-        return self.severity_index[Severity.CRITICAL]
+    def find(self, record_id: int) -> int:
+        """Slot of record_id, or -1"""
+        try:
+            return self.record_ids.index(record_id)
+        except ValueError:
+            return -1
+    
+    def remove(self, record_id: int) -> Optional[Tuple[int, str]]:
+        """Drop one record from the columns; returns its (doctor_id, diagnosis), or None"""
+        i = self.find(record_id)
+        if i < 0:
+            return None
+        removed = (self.doctor_ids[i], self.dictionary.decode(self.diagnosis_ids[i]))
+        self.severity_counts[self.severity_codes[i]] -= 1
+        for column in (self.record_ids, self.doctor_ids, self.diagnosis_ids,
+                       self.date_ordinals, self.severity_codes):
+            del column[i]
+        self.file_paths.pop(record_id, None)
+        return removed
+    
+    def severity_of(self, record_id: int) -> Optional[Severity]:
+        i = self.find(record_id)
+        return SEVERITY_BY_CODE[self.severity_codes[i]] if i >= 0 else None
+    
+    def diagnosis_of(self, record_id: int) -> Optional[str]:
+        i = self.find(record_id)
+        return self.dictionary.decode(self.diagnosis_ids[i]) if i >= 0 else None
+    
+    def _materialize(self, user_id: int, indices) -> List[HealthRecord]:
+        records = [
+            HealthRecord(
+                record_id=self.record_ids[i],
+                user_id=user_id,
+                doctor_id=self.doctor_ids[i],
+                diagnosis=self.dictionary.decode(self.diagnosis_ids[i]),
+                record_date=datetime.fromordinal(self.date_ordinals[i]),
+                file_path=self.file_paths.get(self.record_ids[i]),
+                severity=SEVERITY_BY_CODE[self.severity_codes[i]]
+            )
+            for i in indices
+        ]
+        records.sort(key=lambda r: r.record_date, reverse=True)
+        return records
+    
+    def get_records_by_year(self, year: int, user_id: int = 0) -> List[HealthRecord]:
+        """Records dated in year, newest first"""
+        first = date(year, 1, 1).toordinal()
+        last = date(year, 12, 31).toordinal()
+        return self._materialize(user_id, [i for i, ordinal in enumerate(self.date_ordinals)
+                                           if first <= ordinal <= last])
+    
+    def get_critical_records(self, user_id: int = 0) -> List[HealthRecord]:
+        critical = SEVERITY_CODES[Severity.CRITICAL]
+        return self._materialize(user_id, [i for i, code in enumerate(self.severity_codes)
+                                           if code == critical])
+    
+    def count_by_severity(self, severity: Severity) -> int:
+        return self.severity_counts[SEVERITY_CODES[severity]]
+    
+    def count_since(self, date_ordinal: int) -> int:
+        """Number of records dated on or after date_ordinal"""
+        return sum(1 for ordinal in self.date_ordinals if ordinal >= date_ordinal)
+    
+    @property
+    def doctor_visits(self) -> Counter:
+        # Counted from the column on demand: a per-user Counter of boxed ints
+        # costs more than the records themselves
+        return Counter(self.doctor_ids)
+    
+    @property
+    def condition_frequency(self) -> Counter:
+        """diagnosis id -> count"""
+        return Counter(self.diagnosis_ids)
     
     def get_most_visited_doctors(self, limit: int = 5) -> List[Tuple[int, int]]:
         """Returns list of (doctor_id, visit_count) tuples"""
@@ -112,35 +319,328 @@ class PatientTimeline:
     
     def get_common_conditions(self, limit: int = 10) -> List[Tuple[str, int]]:
         """Returns most common diagnoses"""
-        return self.condition_frequency.most_common(limit)
+        return [(self.dictionary.decode(diagnosis_id), count)
+                for diagnosis_id, count in self.condition_frequency.most_common(limit)]
 
-class DoctorAnalytics:
-    """Advanced analytics for doctor performance and specialization"""
+class IndexedMinHeap:
+    """Binary min-heap with a position index: O(log n) update/remove of any
+    item by id and non-destructive O(k log k) top-k"""
     
     def __init__(self):
+        self.heap: List[Tuple[tuple, int]] = []  # (priority, item_id)
+        self.positions: Dict[int, int] = {}      # item_id -> index in heap
+    
+    def __len__(self):
+        return len(self.heap)
+    
+    def __contains__(self, item_id: int):
+        return item_id in self.positions
+    
+    def set(self, item_id: int, priority: tuple):
+        """Insert item_id or move it to its new priority"""
+        position = self.positions.get(item_id)
+        if position is None:
+            self.heap.append((priority, item_id))
+            self.positions[item_id] = len(self.heap) - 1
+            self._sift_up(len(self.heap) - 1)
+            return
+        old_priority = self.heap[position][0]
+        self.heap[position] = (priority, item_id)
+        if priority < old_priority:
+            self._sift_up(position)
+        else:
+            self._sift_down(position)
+    
+    def remove(self, item_id: int):
+        position = self.positions.pop(item_id, None)
+        if position is None:
+            return
+        last = self.heap.pop()
+        if position < len(self.heap):
+            self.heap[position] = last
+            self.positions[last[1]] = position
+            self._sift_up(position)
+            self._sift_down(self.positions[last[1]])
+    
+    def smallest(self, k: int) -> List[Tuple[tuple, int]]:
+        """k lowest (priority, item_id) pairs in order, without touching the heap.
+        
+        Best-first walk of the heap tree: a node's children can only enter
+        the answer after the node itself, so the frontier stays O(k).
+        """
+        result = []
+        frontier = [(self.heap[0], 0)] if self.heap else []
+        while frontier and len(result) < k:
+            entry, position = heapq.heappop(frontier)
+            result.append(entry)
+            for child in (2 * position + 1, 2 * position + 2):
+                if child < len(self.heap):
+                    heapq.heappush(frontier, (self.heap[child], child))
+        return result
+    
+    def _swap(self, i: int, j: int):
+        self.heap[i], self.heap[j] = self.heap[j], self.heap[i]
+        self.positions[self.heap[i][1]] = i
+        self.positions[self.heap[j][1]] = j
+    
+    def _sift_up(self, position: int):
+        while position > 0:
+            parent = (position - 1) // 2
+            if self.heap[position] >= self.heap[parent]:
+                break
+            self._swap(position, parent)
+            position = parent
+    
+    def _sift_down(self, position: int):
+        size = len(self.heap)
+        while True:
+            smallest = position
+            for child in (2 * position + 1, 2 * position + 2):
+                if child < size and self.heap[child] < self.heap[smallest]:
+                    smallest = child
+            if smallest == position:
+                return
+            self._swap(position, smallest)
+            position = smallest
+
+# Case-complexity weight of a record, averaged into Doctor.avg_severity_score
+SEVERITY_WEIGHTS = {Severity.MILD: 1.0, Severity.MODERATE: 1.5, Severity.CRITICAL: 2.0}
+
+class DoctorAnalytics:
+    """Advanced analytics for doctor performance and specialization.
+    
+    Per-doctor workload (distinct patients, records, mean severity) is
+    loaded once with a grouped query and then kept current by O(1) deltas
+    from the write paths. Indexed heaps, one per specialization plus one
+    over all doctors, are keyed on the live workload so the least-busy
+    doctors can be read without a scan. Reads share a reader-writer lock.
+    """
+    
+    def __init__(self, diagnoses: Optional[DiagnosisDictionary] = None):
+        self.diagnoses = diagnoses or DiagnosisDictionary()
+        self.doctors: Dict[int, Doctor] = {}
         self.specialization_map: defaultdict = defaultdict(list)
-        self.workload_heap: List[Tuple[int, int]] = []  # (patient_count, doctor_id)
+        # normalized specialization -> heap of doctor ids by workload_key()
+        self.workload_heaps: Dict[str, IndexedMinHeap] = defaultdict(IndexedMinHeap)
+        self.workload_heap = IndexedMinHeap()  # every doctor
         self.efficiency_scores: Dict[int, float] = {}
+        self.patient_records: Dict[int, Counter] = defaultdict(Counter)  # doctor -> patient -> records
+        self.record_counts: Counter = Counter()
+        self.severity_totals: Dict[int, float] = defaultdict(float)
+        self._lock = ReadWriteLock()
+    
+    def load(self, *conns):
+        """Rebuild all doctors and workload figures from one grouped query per shard"""
+        rows = []
+        for conn in conns:
+            rows += conn.execute("""
+                SELECT d.doctor_id, d.name, d.specialization, d.contact_number, d.email,
+                       hr.user_id, hr.diagnosis, COUNT(hr.record_id)
+                FROM doctors d
+                LEFT JOIN health_records_all hr ON hr.doctor_id = d.doctor_id
+                GROUP BY d.doctor_id, hr.user_id, hr.diagnosis
+            """).fetchall()
+        with self._lock.write():
+            self._clear()
+            for doctor_id, name, specialization, contact_number, email, user_id, diagnosis, count in rows:
+                if doctor_id not in self.doctors:
+                    self._register(Doctor(doctor_id, name, specialization or '', contact_number, email))
+                if user_id is not None:
+                    self.patient_records[doctor_id][user_id] += count
+                    self.record_counts[doctor_id] += count
+                    self.severity_totals[doctor_id] += count * self._severity_weight(diagnosis)
+            for doctor_id in self.doctors:
+                self._refresh_doctor(doctor_id)
+    
+    def _clear(self):
+        self.doctors.clear()
+        self.specialization_map.clear()
+        self.patient_records.clear()
+        self.record_counts.clear()
+        self.severity_totals.clear()
+        self.efficiency_scores.clear()
+        self.workload_heaps.clear()
+        self.workload_heap = IndexedMinHeap()
+    
+    def capture(self) -> dict:
+        """Doctors and running totals as plain rows, for a snapshot"""
+        with self._lock.read():
+            return {
+                'doctors': [(doctor.doctor_id, doctor.name, doctor.specialization, doctor.contact_number,
+                             doctor.email) for doctor in self.doctors.values()],
+                'patients': [(doctor_id, user_id, count) for doctor_id, patients in self.patient_records.items()
+                             for user_id, count in patients.items()],
+                'totals': [(doctor_id, count, self.severity_totals.get(doctor_id, 0.0))
+                           for doctor_id, count in self.record_counts.items()],
+            }
+    
+    def restore(self, state: dict):
+        """Inverse of capture(); heaps and efficiency scores are recomputed"""
+        with self._lock.write():
+            self._clear()
+            for doctor_id, user_id, count in state['patients']:
+                self.patient_records[doctor_id][user_id] = count
+            for doctor_id, count, severity_total in state['totals']:
+                self.record_counts[doctor_id] = count
+                self.severity_totals[doctor_id] = severity_total
+            for row in state['doctors']:
+                self._register(Doctor(*row))
+            for doctor_id in self.doctors:
+                self._refresh_doctor(doctor_id)
+    
+    @staticmethod
+    def normalize_specialization(specialization: Optional[str]) -> str:
+        return ' '.join((specialization or '').lower().split())
+    
+    def workload_key(self, doctor: Doctor) -> tuple:
+        """Heap priority: fewest patients first, then fewest records"""
+        return (doctor.patient_count, self.record_counts[doctor.doctor_id])
+    
+    def _register(self, doctor: Doctor):
+        self.doctors[doctor.doctor_id] = doctor
+        self.specialization_map[doctor.specialization].append(doctor)
+        self._update_workload(doctor.doctor_id)
+    
+    def _unregister(self, doctor: Doctor):
+        self.specialization_map[doctor.specialization].remove(doctor)
+        specialization = self.normalize_specialization(doctor.specialization)
+        self.workload_heaps[specialization].remove(doctor.doctor_id)
+        if not self.workload_heaps[specialization]:
+            del self.workload_heaps[specialization]
+    
+    def _severity_weight(self, diagnosis: str) -> float:
+        return SEVERITY_WEIGHTS[self.diagnoses.severity(self.diagnoses.encode(diagnosis or ''))]
+    
+    def _refresh_doctor(self, doctor_id: int):
+        """Recompute one doctor's derived figures from its running totals"""
+        doctor = self.doctors.get(doctor_id)
+        if doctor is None:
+            return
+        records = self.record_counts[doctor_id]
+        doctor.patient_count = len(self.patient_records[doctor_id])
+        doctor.avg_severity_score = self.severity_totals[doctor_id] / records if records else 0.0
+        self.calculate_efficiency_score(doctor_id, doctor.avg_severity_score, doctor.patient_count)
+        self._update_workload(doctor_id)
     
     def add_doctor(self, doctor: Doctor):
         """Add doctor to analytics structures"""
-        self.specialization_map[doctor.specialization].append(doctor)
-        heapq.heappush(self.workload_heap, (doctor.patient_count, doctor.doctor_id))
+        with self._lock.write():
+            self._register(doctor)
+    
+    def update_doctor(self, doctor_id: int, name: str, specialization: Optional[str],
+                      contact_number: Optional[str], email: Optional[str]):
+        with self._lock.write():
+            doctor = self.doctors.get(doctor_id)
+            if doctor is None:
+                return
+            if doctor.specialization != (specialization or ''):
+                self._unregister(doctor)
+                doctor.specialization = specialization or ''
+                self._register(doctor)
+            doctor.name = name
+            doctor.contact_number = contact_number
+            doctor.email = email
+    
+    def remove_doctor(self, doctor_id: int):
+        """Forget a deleted doctor (its records are deleted with it)"""
+        with self._lock.write():
+            doctor = self.doctors.pop(doctor_id, None)
+            if doctor is not None:
+                self._unregister(doctor)
+                self.workload_heap.remove(doctor_id)
+            self.patient_records.pop(doctor_id, None)
+            self.record_counts.pop(doctor_id, None)
+            self.severity_totals.pop(doctor_id, None)
+            self.efficiency_scores.pop(doctor_id, None)
+    
+    def record_added(self, doctor_id: int, user_id: int, diagnosis: str):
+        """Count a new health record towards its doctor's workload"""
+        with self._lock.write():
+            self.patient_records[doctor_id][user_id] += 1
+            self.record_counts[doctor_id] += 1
+            self.severity_totals[doctor_id] += self._severity_weight(diagnosis)
+            self._refresh_doctor(doctor_id)
+    
+    def record_removed(self, doctor_id: int, user_id: int, diagnosis: str):
+        """Undo record_added for a deleted (or edited) health record"""
+        with self._lock.write():
+            patients = self.patient_records.get(doctor_id)
+            if patients is None or patients[user_id] <= 0:
+                return
+            patients[user_id] -= 1
+            if patients[user_id] == 0:
+                del patients[user_id]
+            self.record_counts[doctor_id] -= 1
+            self.severity_totals[doctor_id] -= self._severity_weight(diagnosis)
+            self._refresh_doctor(doctor_id)
+    
+    def record_changed(self, old: Tuple[int, int, str], new: Tuple[int, int, str]):
+        """Move an edited record's contribution; old/new are (doctor_id, user_id, diagnosis)"""
+        if old != new:
+            self.record_removed(*old)
+            self.record_added(*new)
+    
+    def _update_workload(self, doctor_id: int):
+        doctor = self.doctors.get(doctor_id)
+        if doctor is None:
+            return
+        key = self.workload_key(doctor)
+        self.workload_heaps[self.normalize_specialization(doctor.specialization)].set(doctor_id, key)
+        self.workload_heap.set(doctor_id, key)
     
     def get_doctors_by_specialization(self, specialization: str) -> List[Doctor]:
-        return self.specialization_map[specialization]
+        with self._lock.read():
+            return list(self.specialization_map.get(specialization, ()))
+    
+    def _workload_heap_for(self, specialization: Optional[str]) -> Optional[IndexedMinHeap]:
+        if specialization is None:
+            return self.workload_heap
+        return self.workload_heaps.get(self.normalize_specialization(specialization))
+    
+    def get_least_busy_doctors(self, count: int = 3, specialization: Optional[str] = None) -> List[int]:
+        """Get doctor IDs with lowest patient load, optionally within one specialization"""
+        with self._lock.read():
+            heap = self._workload_heap_for(specialization)
+            return [doctor_id for _, doctor_id in heap.smallest(count)] if heap else []
     
-    def get_least_busy_doctors(self, count: int = 3) -> List[int]:
-        """Get doctor IDs with lowest patient load"""
-        return [heapq.heappop(self.workload_heap)[1] for _ in range(min(count, len(self.workload_heap)))]
+    def recommend_doctors(self, specialization: Optional[str] = None, count: int = 3) -> List[dict]:
+        """Stats of the least-busy doctors, least busy first; shared state is only read"""
+        with self._lock.read():
+            heap = self._workload_heap_for(specialization)
+            if not heap:
+                return []
+            return [self._stats(self.doctors[doctor_id]) for _, doctor_id in heap.smallest(count)]
+    
+    def get_doctor_stats(self, doctor_id: int) -> Optional[dict]:
+        """Workload figures for one doctor, or None if unknown"""
+        with self._lock.read():
+            doctor = self.doctors.get(doctor_id)
+            return self._stats(doctor) if doctor else None
+    
+    def get_all_doctor_stats(self, sort_by: str = 'patient_count', descending: bool = True) -> List[dict]:
+        with self._lock.read():
+            stats = [self._stats(doctor) for doctor in self.doctors.values()]
+        stats.sort(key=lambda s: (s[sort_by], s['doctor_id']), reverse=descending)
+        return stats
+    
+    def _stats(self, doctor: Doctor) -> dict:
+        return {
+            'doctor_id': doctor.doctor_id,
+            'name': doctor.name,
+            'specialization': doctor.specialization,
+            'patient_count': doctor.patient_count,
+            'record_count': self.record_counts[doctor.doctor_id],
+            'avg_severity_score': round(doctor.avg_severity_score, 3),
+            'efficiency_score': round(self.efficiency_scores.get(doctor.doctor_id, 0.0), 3)
+        }
     
     def calculate_efficiency_score(self, doctor_id: int, avg_severity: float, patient_count: int) -> float:
         """Calculate doctor efficiency based on patient load and case complexity"""
         if patient_count == 0:
+            self.efficiency_scores[doctor_id] = 0.0
             return 0.0
         
         # Higher severity cases = more complex = higher efficiency if handled well
-        severity_weight = {'mild': 1.0, 'moderate': 1.5, 'critical': 2.0}
         base_score = avg_severity * 10
         load_factor = min(patient_count / 50, 2.0)  # Normalize patient load
         
@@ -149,124 +649,390 @@ class DoctorAnalytics:
         return efficiency
 
 class TreatmentPriorityQueue:
-    """Priority queue for managing treatment follow-ups and urgent care"""
+    """Priority queue for managing treatment follow-ups and urgent care.
+    
+    Priorities are absolute (due date ordinal plus a severity modifier), so
+    every process that loads the same rows orders them the same way, and
+    overdue follow-ups are found when asked rather than when added. Replaced
+    and removed entries are dropped lazily from the heap. Reads walk the heap
+    without changing it and share a reader-writer lock.
+    """
     
     def __init__(self):
         self.urgent_treatments: List[Tuple[int, datetime, int]] = []  # (priority, follow_up_date, treatment_id)
-        self.overdue_treatments: Set[int] = set()
+        self.entries: Dict[int, Tuple[int, datetime, int]] = {}  # treatment_id -> its live heap entry
+        self._lock = ReadWriteLock()
+    
+    def __len__(self):
+        return len(self.entries)
+    
+    def clear(self):
+        with self._lock.write():
+            self.urgent_treatments = []
+            self.entries = {}
     
     def add_treatment(self, treatment_id: int, follow_up_date: datetime, severity: Severity):
-        """Add treatment with priority based on severity and urgency"""
-        priority = self._calculate_priority(follow_up_date, severity)
-        heapq.heappush(self.urgent_treatments, (priority, follow_up_date, treatment_id))
-        
-        # Check if overdue
-        if follow_up_date < datetime.now():
-            self.overdue_treatments.add(treatment_id)
+        """Add treatment with priority based on severity and urgency (replaces an earlier entry)"""
+        entry = (self._calculate_priority(follow_up_date, severity), follow_up_date, treatment_id)
+        with self._lock.write():
+            self.entries[treatment_id] = entry
+            heapq.heappush(self.urgent_treatments, entry)
+            if len(self.urgent_treatments) > 2 * len(self.entries) + 64:
+                self.urgent_treatments = list(self.entries.values())
+                heapq.heapify(self.urgent_treatments)
+    
+    def remove_treatment(self, treatment_id: int):
+        with self._lock.write():
+            self.entries.pop(treatment_id, None)
+    
+    def capture(self) -> List[Tuple[int, datetime, int]]:
+        """Live (priority, follow_up_date, treatment_id) entries, for a snapshot"""
+        with self._lock.read():
+            return list(self.entries.values())
+    
+    def restore(self, entries: List[Tuple[int, datetime, int]]):
+        with self._lock.write():
+            self.entries = {entry[2]: entry for entry in entries}
+            self.urgent_treatments = list(self.entries.values())
+            heapq.heapify(self.urgent_treatments)
     
     def _calculate_priority(self, follow_up_date: datetime, severity: Severity) -> int:
         """Lower number = higher priority"""
-        days_until_due = (follow_up_date - datetime.now()).days
         severity_modifier = {
             Severity.CRITICAL: 0,
             Severity.MODERATE: 10,
             Severity.MILD: 20
         }
         
-        return days_until_due + severity_modifier[severity]
+        return follow_up_date.toordinal() + severity_modifier[severity]
     
     def get_next_urgent_treatments(self, count: int = 5) -> List[int]:
         """Get most urgent treatment IDs"""
         urgent = []
-        temp_heap = []
-        
-        for _ in range(min(count, len(self.urgent_treatments))):
-            if self.urgent_treatments:
-                priority, date, treatment_id = heapq.heappop(self.urgent_treatments)
-                urgent.append(treatment_id)
-                temp_heap.append((priority, date, treatment_id))
-        
-        # Restore heap
-        for item in temp_heap:
-            heapq.heappush(self.urgent_treatments, item)
-        
+        with self._lock.read():
+            heap = self.urgent_treatments
+            # Best-first walk of the heap tree, as in IndexedMinHeap.smallest;
+            # stale entries are skipped but their children still expanded
+            frontier = [(heap[0], 0)] if heap else []
+            while frontier and len(urgent) < count:
+                item, position = heapq.heappop(frontier)
+                if self.entries.get(item[2]) is item:
+                    urgent.append(item[2])
+                for child in (2 * position + 1, 2 * position + 2):
+                    if child < len(heap):
+                        heapq.heappush(frontier, (heap[child], child))
         return urgent
     
     def get_overdue_treatments(self) -> Set[int]:
-        return self.overdue_treatments.copy()
+        now = datetime.now()
+        with self._lock.read():
+            return {treatment_id for treatment_id, (_, follow_up_date, _) in self.entries.items()
+                    if follow_up_date < now}
+
+class PrefixIndex:
+    """Frequency-weighted prefix index over distinct strings (sorted array + bisect).
+
+    Every string is indexed at each word start, so "asth" finds
+    "Childhood Asthma" as well as "Asthma".
+    """
+    
+    def __init__(self):
+        self.keys: List[Tuple[str, str]] = []  # sorted (search_key, canonical)
+        self.counts: Counter = Counter()       # canonical -> frequency
+        self.display: Dict[str, str] = {}      # canonical -> first-seen spelling
+        # One- and two-character prefixes match large ranges; memoize them
+        # until the next write
+        self.short_prefix_cache: Dict[Tuple[str, int], List[Tuple[str, int]]] = {}
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def normalize(text: str) -> str:
+        return ' '.join(text.lower().split())
+    
+    @staticmethod
+    def _search_keys(canonical: str) -> List[str]:
+        words = canonical.split(' ')
+        return [' '.join(words[i:]) for i in range(len(words))]
+    
+    def add(self, text: Optional[str], count: int = 1):
+        if not text or not text.strip():
+            return
+        canonical = self.normalize(text)
+        with self._lock:
+            self.short_prefix_cache.clear()
+            if canonical not in self.counts:
+                self.display[canonical] = ' '.join(text.split())
+                for key in self._search_keys(canonical):
+                    bisect.insort(self.keys, (key, canonical))
+            self.counts[canonical] += count
+    
+    def remove(self, text: Optional[str], count: int = 1):
+        if not text or not text.strip():
+            return
+        canonical = self.normalize(text)
+        with self._lock:
+            if canonical not in self.counts:
+                return
+            self.short_prefix_cache.clear()
+            self.counts[canonical] -= count
+            if self.counts[canonical] > 0:
+                return
+            del self.counts[canonical]
+            del self.display[canonical]
+            for key in self._search_keys(canonical):
+                position = bisect.bisect_left(self.keys, (key, canonical))
+                if position < len(self.keys) and self.keys[position] == (key, canonical):
+                    del self.keys[position]
+    
+    def suggest(self, prefix: str, limit: int = 10) -> List[Tuple[str, int]]:
+        """Return up to limit (text, frequency) pairs matching prefix, most frequent first"""
+        prefix = self.normalize(prefix or '')
+        if not prefix:
+            return []
+        with self._lock:
+            cached = self.short_prefix_cache.get((prefix, limit))
+            if cached is not None:
+                return cached
+            start = bisect.bisect_left(self.keys, (prefix, ''))
+            end = bisect.bisect_left(self.keys, (prefix + '\uffff', ''), start)
+            matches = {canonical for _, canonical in self.keys[start:end]}
+            best = heapq.nsmallest(limit, matches, key=lambda c: (-self.counts[c], c))
+            suggestions = [(self.display[c], self.counts[c]) for c in best]
+            if len(prefix) <= 2:
+                self.short_prefix_cache[(prefix, limit)] = suggestions
+            return suggestions
+
+class AutocompleteIndex:
+    """Prefix indexes for the free-text fields users type repeatedly"""
+    
+    FIELDS = ('diagnosis', 'medication', 'specialization')
+    
+    def __init__(self):
+        self.indexes: Dict[str, PrefixIndex] = {field: PrefixIndex() for field in self.FIELDS}
+    
+    def load(self, *conns):
+        """Build all indexes from grouped counts in SQLite (summed over shards)"""
+        sources = {
+            'diagnosis': ("SELECT diagnosis, COUNT(*) FROM health_records_all GROUP BY diagnosis", conns),
+            'medication': ("SELECT medication, COUNT(*) FROM treatment_all GROUP BY medication", conns),
+            # Every shard holds the same doctors
+            'specialization': ("SELECT specialization, COUNT(*) FROM doctors GROUP BY specialization", conns[:1])
+        }
+        for field, (sql, sources_conns) in sources.items():
+            index = PrefixIndex()
+            for conn in sources_conns:
+                for text, count in conn.execute(sql):
+                    index.add(text, count)
+            self.indexes[field] = index
+    
+    def add(self, field: str, text: Optional[str], count: int = 1):
+        self.indexes[field].add(text, count)
+    
+    def remove(self, field: str, text: Optional[str], count: int = 1):
+        self.indexes[field].remove(text, count)
+    
+    def replace(self, field: str, old_text: Optional[str], new_text: Optional[str]):
+        if old_text != new_text:
+            self.remove(field, old_text)
+            self.add(field, new_text)
+    
+    def suggest(self, field: str, prefix: str, limit: int = 10) -> List[Tuple[str, int]]:
+        return self.indexes[field].suggest(prefix, limit)
 
 class HealthMetricsAggregator:
-    """Aggregates and computes health metrics using advanced data structures"""
+    """Aggregates and computes health metrics using advanced data structures.
+    
+    Concurrency: one writer at a time (_write_lock), readers never block.
+    A user's timeline is copy-on-write: the writer edits a private copy and
+    publishes it with one dict assignment, so a reader holding a timeline
+    sees a fixed set of records. System-wide totals are kept as a tuple
+    replaced on each write. Doctor analytics and the treatment queue are
+    guarded by reader-writer locks of their own.
+    """
     
     def __init__(self):
         self.user_timelines: Dict[int, PatientTimeline] = {}
-        self.doctor_analytics = DoctorAnalytics()
+        self.diagnoses = DiagnosisDictionary()
+        self.doctor_analytics = DoctorAnalytics(self.diagnoses)
         self.treatment_queue = TreatmentPriorityQueue()
         self.cache = HealthDataCache()
+        # (users, records, records per severity code), replaced as a whole
+        self.totals: Tuple[int, int, Tuple[int, ...]] = (0, 0, (0,) * len(SEVERITY_BY_CODE))
+        self._write_lock = threading.RLock()
+    
+    def load(self, *conns):
+        """Rebuild every structure from the tables of each shard (each inside
+        one read transaction); a user's rows are all on one shard"""
+        timelines: Dict[int, PatientTimeline] = {}
+        queue = TreatmentPriorityQueue()
+        entries = []
+        for conn in conns:
+            rows = conn.execute("""
+                SELECT user_id, record_id, doctor_id, diagnosis, record_date, file_path
+                FROM health_records_all ORDER BY user_id, record_id
+            """)
+            for user_id, record_id, doctor_id, diagnosis, record_date, file_path in rows:
+                timeline = timelines.get(user_id)
+                if timeline is None:
+                    timeline = timelines[user_id] = PatientTimeline(self.diagnoses)
+                timeline.append(record_id, doctor_id or 0, diagnosis or '', _date_ordinal(record_date), file_path)
+            
+            rows = conn.execute("""
+                SELECT t.treatment_id, t.follow_up_date, hr.diagnosis
+                FROM treatment_all t
+                JOIN health_records_all hr ON hr.record_id = t.record_id
+                WHERE t.follow_up_date IS NOT NULL AND t.follow_up_date != ''
+            """)
+            for treatment_id, follow_up_date, diagnosis in rows:
+                try:
+                    follow_up_date = datetime.fromisoformat(follow_up_date)
+                except ValueError:
+                    continue  # malformed date: not schedulable
+                # Severity through the dictionary: classified once per distinct diagnosis
+                severity = self.diagnoses.severity(self.diagnoses.encode(diagnosis or ''))
+                entries.append((queue._calculate_priority(follow_up_date, severity), follow_up_date, treatment_id))
+        queue.restore(entries)
+        
+        severity = [0] * len(SEVERITY_BY_CODE)
+        for timeline in timelines.values():
+            for code, count in enumerate(timeline.severity_counts):
+                severity[code] += count
+        with self._write_lock:
+            self.doctor_analytics.load(*conns)
+            self.user_timelines = timelines
+            self.treatment_queue = queue
+            self.totals = (len(timelines), sum(severity), tuple(severity))
+            self.cache = HealthDataCache()
+    
+    def capture(self) -> dict:
+        """A consistent copy of every structure, for a snapshot. Published
+        timelines are never modified, so they are shared rather than copied."""
+        with self._write_lock:
+            return {
+                'diagnoses': list(self.diagnoses.texts),
+                'timelines': dict(self.user_timelines),
+                'doctors': self.doctor_analytics.capture(),
+                'treatments': self.treatment_queue.capture(),
+            }
+    
+    def restore(self, diagnoses: DiagnosisDictionary, timelines: Dict[int, PatientTimeline],
+                doctors: dict, treatments: List[Tuple[int, datetime, int]]):
+        """Install state read back from a snapshot; timelines must use diagnoses"""
+        severity = [0] * len(SEVERITY_BY_CODE)
+        for timeline in timelines.values():
+            for code, count in enumerate(timeline.severity_counts):
+                severity[code] += count
+        queue = TreatmentPriorityQueue()
+        queue.restore(treatments)
+        with self._write_lock:
+            self.diagnoses = diagnoses
+            self.doctor_analytics.diagnoses = diagnoses
+            self.doctor_analytics.restore(doctors)
+            self.user_timelines = timelines
+            self.treatment_queue = queue
+            self.totals = (len(timelines), sum(severity), tuple(severity))
+            self.cache = HealthDataCache()
+    
+    def _publish(self, user_id: int, old: Optional[PatientTimeline], new: PatientTimeline):
+        """Swap in a user's edited timeline copy (dropped when empty) and move the totals"""
+        users, records, severity = self.totals
+        severity = list(severity)
+        if old is not None:
+            users -= 1
+            records -= len(old)
+            for code, count in enumerate(old.severity_counts):
+                severity[code] -= count
+        if len(new):
+            users += 1
+            records += len(new)
+            for code, count in enumerate(new.severity_counts):
+                severity[code] += count
+            self.user_timelines[user_id] = new
+        else:
+            self.user_timelines.pop(user_id, None)
+        self.totals = (users, records, tuple(severity))
+    
+    def upsert_health_record(self, record_data: dict):
+        """Add a record, or replace the copy already held; doctor workload follows"""
+        with self._write_lock:
+            self.remove_health_record(record_data['user_id'], record_data['record_id'])
+            self.add_health_record(record_data)
+            self.doctor_analytics.record_added(record_data['doctor_id'] or 0, record_data['user_id'],
+                                               record_data['diagnosis'] or '')
+    
+    def remove_health_record(self, user_id: int, record_id: int) -> bool:
+        """Forget a record if it is held; doctor workload follows"""
+        with self._write_lock:
+            old = self.user_timelines.get(user_id)
+            if old is None or old.find(record_id) < 0:
+                return False
+            timeline = old.copy()
+            doctor_id, diagnosis = timeline.remove(record_id)
+            self._publish(user_id, old, timeline)
+            self.doctor_analytics.record_removed(doctor_id, user_id, diagnosis)
+            return True
+    
+    def record_severity(self, user_id: int, record_id: int) -> Optional[Severity]:
+        timeline = self.user_timelines.get(user_id)
+        return timeline.severity_of(record_id) if timeline is not None else None
+    
+    def record_diagnosis(self, user_id: int, record_id: int) -> Optional[str]:
+        timeline = self.user_timelines.get(user_id)
+        return timeline.diagnosis_of(record_id) if timeline is not None else None
     
     def add_health_record(self, record_data: dict):
         """Process and add health record to all relevant structures"""
-        record = HealthRecord(
-            record_id=record_data['record_id'],
-            user_id=record_data['user_id'],
-            doctor_id=record_data['doctor_id'],
-            diagnosis=record_data['diagnosis'],
-            record_date=datetime.fromisoformat(record_data['record_date']),
-            file_path=record_data.get('file_path')
-        )
+        user_id = record_data['user_id']
         
-        # Add to user timeline
-        if record.user_id not in self.user_timelines:
-            self.user_timelines[record.user_id] = PatientTimeline()
-        
-        self.user_timelines[record.user_id].add_record(record)
-        
-        # Invalidate relevant cache entries
-        self.cache.put(f"user_timeline_{record.user_id}", None)
+        with self._write_lock:
+            # Add to a copy of the user's timeline
+            old = self.user_timelines.get(user_id)
+            timeline = old.copy() if old is not None else PatientTimeline(self.diagnoses)
+            timeline.append(
+                record_id=record_data['record_id'],
+                doctor_id=record_data['doctor_id'] or 0,
+                diagnosis=record_data['diagnosis'] or '',
+                date_ordinal=_date_ordinal(record_data['record_date']),
+                file_path=record_data.get('file_path')
+            )
+            self._publish(user_id, old, timeline)
     
     def get_user_health_summary(self, user_id: int) -> dict:
         """Get comprehensive health summary for user"""
-        cache_key = f"user_summary_{user_id}"
-        cached = self.cache.get(cache_key)
-        if cached:
-            return cached
-        
-        if user_id not in self.user_timelines:
+        timeline = self.user_timelines.get(user_id)
+        if timeline is None:
             return {"error": "No health records found"}
         
-        timeline = self.user_timelines[user_id]
+        # Cached per timeline version: a summary computed from a timeline that
+        # has since been replaced is never served
+        cache_key = f"user_summary_{user_id}"
+        cached = self.cache.get(cache_key)
+        if cached and cached[0] is timeline:
+            return cached[1]
         
         summary = {
-            "total_records": sum(len(records) for records in timeline.records_by_year.values()),
-            "critical_conditions": len(timeline.get_critical_records()),
+            "total_records": len(timeline),
+            "critical_conditions": timeline.count_by_severity(Severity.CRITICAL),
             "most_visited_doctors": timeline.get_most_visited_doctors(3),
             "common_conditions": timeline.get_common_conditions(5),
-            "recent_activity": len([r for year_records in timeline.records_by_year.values() 
-                                  for r in year_records 
-                                  if (datetime.now() - r.record_date).days <= 30])
+            "recent_activity": timeline.count_since(date.today().toordinal() - 30)
         }
         
-        self.cache.put(cache_key, summary)
+        self.cache.put(cache_key, (timeline, summary))
         return summary
     
     def get_system_analytics(self) -> dict:
         """Get system-wide analytics"""
-        total_users = len(self.user_timelines)
-        total_records = sum(sum(len(records) for records in timeline.records_by_year.values()) 
-                           for timeline in self.user_timelines.values())
-        
-        # Severity distribution
-        severity_dist = defaultdict(int)
-        for timeline in self.user_timelines.values():
-            for severity, records in timeline.severity_index.items():
-                severity_dist[severity.value] += len(records)
+        total_users, total_records, severity = self.totals
         
         return {
             "total_users": total_users,
             "total_records": total_records,
-            "severity_distribution": dict(severity_dist),
+            "severity_distribution": {SEVERITY_BY_CODE[code].value: count
+                                      for code, count in enumerate(severity) if count},
             "avg_records_per_user": total_records / total_users if total_users > 0 else 0
         }
 
-# Global instance for the application
+# Global instances for the application
 health_aggregator = HealthMetricsAggregator()
+autocomplete_index = AutocompleteIndex()
@@ -0,0 +1,253 @@
+"""
+Natural-language date resolution for voice input
+Resolves absolute ("on March 5th") and relative ("last Tuesday", "in two weeks")
+date expressions locally, without any external dependency
+"""
+
+import calendar
+import re
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from typing import Optional, Tuple
+
+MONTHS = {
+    'january': 1, 'jan': 1, 'february': 2, 'feb': 2, 'march': 3, 'mar': 3,
+    'april': 4, 'apr': 4, 'may': 5, 'june': 6, 'jun': 6, 'july': 7, 'jul': 7,
+    'august': 8, 'aug': 8, 'september': 9, 'sep': 9, 'sept': 9,
+    'october': 10, 'oct': 10, 'november': 11, 'nov': 11, 'december': 12, 'dec': 12
+}
+
+WEEKDAYS = {
+    'monday': 0, 'tuesday': 1, 'tues': 1, 'wednesday': 2, 'thursday': 3,
+    'thurs': 3, 'friday': 4, 'saturday': 5, 'sunday': 6
+}
+
+NUMBER_WORDS = {
+    'a': 1, 'an': 1, 'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5,
+    'six': 6, 'seven': 7, 'eight': 8, 'nine': 9, 'ten': 10, 'eleven': 11,
+    'twelve': 12, 'fifteen': 15, 'twenty': 20, 'thirty': 30, 'couple': 2,
+    'a couple of': 2, 'few': 3, 'a few': 3
+}
+
+_MONTH_RE = '|'.join(sorted(MONTHS, key=len, reverse=True))
+_WEEKDAY_RE = '|'.join(sorted(WEEKDAYS, key=len, reverse=True))
+_NUMBER_RE = r'\d+|' + '|'.join(sorted((re.escape(w) for w in NUMBER_WORDS), key=len, reverse=True))
+_UNIT_RE = r'days?|weeks?|months?|years?'
+# Words that make "<month> <number>" a count rather than a date ("may 3 times a day")
+_COUNT_RE = r'(?:times?|x|mg|ml|mcg|g|pills?|tablets?|capsules?|doses?|hours?|' + _UNIT_RE + r')\b'
+
+# Ordered so that more specific expressions win over their substrings
+# ("day before yesterday" before "yesterday", ISO before month names).
+_DATE_PATTERNS = [
+    ('iso', re.compile(r'\b(\d{4})-(\d{1,2})-(\d{1,2})\b')),
+    ('numeric', re.compile(r'\b(\d{1,2})/(\d{1,2})/(\d{2,4})\b')),
+    ('day_before_yesterday', re.compile(r'\bday before yesterday\b')),
+    ('day_after_tomorrow', re.compile(r'\bday after tomorrow\b')),
+    ('yesterday', re.compile(r'\byesterday\b')),
+    ('today', re.compile(r'\b(?:today|this morning|this afternoon|this evening|tonight)\b')),
+    ('tomorrow', re.compile(r'\btomorrow\b')),
+    ('month_day', re.compile(
+        r'\b(' + _MONTH_RE + r')\.?\s+(\d{1,2})(st|nd|rd|th)?(?!\d)(?!\s+' + _COUNT_RE + r')'
+        r'(?:,?\s+(\d{4}))?\b')),
+    # A bare "<number> may" is usually the verb ("2 may help"), so May needs
+    # an ordinal, "of" or a year with it
+    ('day_month', re.compile(
+        r'\b(\d{1,2})(?:(?:st|nd|rd|th)?\s+of\s+|(?:st|nd|rd|th)\s+|\s+(?!may\b)|\s+(?=may,?\s+\d{4}\b))'
+        r'(' + _MONTH_RE + r')\b(?:,?\s+(\d{4}))?')),
+    ('ago', re.compile(r'\b(' + _NUMBER_RE + r')\s+(' + _UNIT_RE + r')\s+ago\b')),
+    ('in', re.compile(r'\b(?:in|after|within)\s+(' + _NUMBER_RE + r')\s+(' + _UNIT_RE + r')\b')),
+    ('relative_unit', re.compile(r'\b(last|next|this)\s+(week|month|year)\b')),
+    ('relative_weekday', re.compile(r'\b(last|next|this|on|coming)\s+(' + _WEEKDAY_RE + r')\b')),
+    ('weekday', re.compile(r'\b(' + _WEEKDAY_RE + r')\b')),
+]
+
+# "return" and "checkup" also describe past visits ("I had a checkup
+# yesterday"), so they only count when a future expression follows
+_FOLLOW_UP_RE = re.compile(
+    r'\b(?:follow[\s-]?up|followup|come back|revisit|next visit|next appointment|'
+    r'(?:return|check[\s-]?up)(?=\s+(?:in|after|within|next|coming)\b))\b'
+)
+# Without a cue, the first expression pointing ahead starts the follow-up
+# ("back pain since monday, see you in two weeks")
+_FUTURE_RE = re.compile(
+    r'\b(?:(?:in|after|within)\s+(?:' + _NUMBER_RE + r')\s+(?:' + _UNIT_RE + r')|'
+    r'(?:next|coming)\s+(?:week|month|year|' + _WEEKDAY_RE + r')|day after tomorrow|tomorrow)\b'
+)
+# A bare "may <number>" is usually the verb ("i may 2 go"), so as a month it
+# needs an ordinal, a year or one of these words right before it
+_DATE_CONTEXT_RE = re.compile(r'\b(?:on|of|since|from|until|till|by|before|after|in|early|mid|late)\s+$')
+
+
+def _to_number(token: str) -> int:
+    token = token.strip()
+    if token.isdigit():
+        return int(token)
+    return NUMBER_WORDS[token]
+
+
+def _add_months(base: date, months: int) -> date:
+    month_index = base.month - 1 + months
+    year = base.year + month_index // 12
+    month = month_index % 12 + 1
+    day = min(base.day, calendar.monthrange(year, month)[1])
+    return date(year, month, day)
+
+
+def _shift(base: date, amount: int, unit: str) -> date:
+    unit = unit.rstrip('s')
+    if unit == 'day':
+        return base + timedelta(days=amount)
+    if unit == 'week':
+        return base + timedelta(weeks=amount)
+    if unit == 'month':
+        return _add_months(base, amount)
+    return _add_months(base, amount * 12)
+
+
+def _is_date(kind: str, match, text: str) -> bool:
+    """False for a "may <number>" without an ordinal, year or date word before it"""
+    if kind != 'month_day' or match.group(1) != 'may':
+        return True
+    return bool(match.group(3) or match.group(4) or _DATE_CONTEXT_RE.search(text, 0, match.start()))
+
+
+@lru_cache(maxsize=1024)
+def _parse_expression(text: str) -> Optional[Tuple]:
+    """Parse the first date expression in normalized text into a reference-free spec.
+
+    The spec only describes the expression (e.g. ``('offset', -1, 'day')``), so it
+    can be cached and later applied to any reference date.
+    """
+    best = None
+    for kind, pattern in _DATE_PATTERNS:
+        match = next((m for m in pattern.finditer(text) if _is_date(kind, m, text)), None)
+        if match and (best is None or match.start() < best[1].start()):
+            best = (kind, match)
+    if best is None:
+        return None
+
+    kind, match = best
+    groups = match.groups()
+    if kind == 'iso':
+        return ('absolute', int(groups[0]), int(groups[1]), int(groups[2]))
+    if kind == 'numeric':
+        # Read as DD/MM/YYYY; fall back to MM/DD/YYYY when the second
+        # number cannot be a month.
+        first, second, year = int(groups[0]), int(groups[1]), int(groups[2])
+        if year < 100:
+            year += 2000
+        day, month = (first, second) if second <= 12 else (second, first)
+        return ('absolute', year, month, day)
+    if kind == 'day_before_yesterday':
+        return ('offset', -2, 'day')
+    if kind == 'day_after_tomorrow':
+        return ('offset', 2, 'day')
+    if kind == 'yesterday':
+        return ('offset', -1, 'day')
+    if kind == 'today':
+        return ('offset', 0, 'day')
+    if kind == 'tomorrow':
+        return ('offset', 1, 'day')
+    if kind == 'month_day':
+        year = int(groups[3]) if groups[3] else None
+        return ('month_day', MONTHS[groups[0]], int(groups[1]), year)
+    if kind == 'day_month':
+        year = int(groups[2]) if groups[2] else None
+        return ('month_day', MONTHS[groups[1]], int(groups[0]), year)
+    if kind == 'ago':
+        return ('offset', -_to_number(groups[0]), groups[1])
+    if kind == 'in':
+        return ('offset', _to_number(groups[0]), groups[1])
+    if kind == 'relative_unit':
+        direction = {'last': -1, 'next': 1, 'this': 0}[groups[0]]
+        return ('offset', direction, groups[1])
+    if kind == 'relative_weekday':
+        return ('weekday', WEEKDAYS[groups[1]], groups[0])
+    return ('weekday', WEEKDAYS[groups[0]], None)
+
+
+def _apply(spec: Tuple, reference: date, prefer_future: bool) -> Optional[date]:
+    kind = spec[0]
+    try:
+        if kind == 'absolute':
+            return date(spec[1], spec[2], spec[3])
+        if kind == 'offset':
+            return _shift(reference, spec[1], spec[2])
+        if kind == 'month_day':
+            _, month, day, year = spec
+            if year is not None:
+                return date(year, month, day)
+            candidate = date(reference.year, month, day)
+            # Without a year, pick the nearest occurrence on the expected side
+            if prefer_future and candidate < reference:
+                candidate = date(reference.year + 1, month, day)
+            elif not prefer_future and candidate > reference:
+                candidate = date(reference.year - 1, month, day)
+            return candidate
+        if kind == 'weekday':
+            _, weekday, modifier = spec
+            delta = weekday - reference.weekday()
+            if modifier == 'last':
+                return reference + timedelta(days=delta - 7 if delta >= 0 else delta)
+            if modifier in ('next', 'coming'):
+                return reference + timedelta(days=delta + 7 if delta <= 0 else delta)
+            if modifier == 'this':
+                return reference + timedelta(days=delta)
+            # Bare weekday ("on Tuesday"): most recent for past events,
+            # upcoming for follow-ups
+            if prefer_future:
+                return reference + timedelta(days=delta if delta > 0 else delta + 7)
+            return reference + timedelta(days=delta if delta <= 0 else delta - 7)
+    except (ValueError, OverflowError):
+        # Out of range for date ("in 99999999 days", "February 30th")
+        return None
+    return None
+
+
+def _normalize(text: str) -> str:
+    return ' '.join(text.lower().replace(',', ', ').split())
+
+
+def resolve_date(text: str, reference: Optional[date] = None, prefer_future: bool = False) -> Optional[date]:
+    """Resolve the first date expression in text, or None if there is none"""
+    if not text:
+        return None
+    reference = reference or datetime.now().date()
+    spec = _parse_expression(_normalize(text))
+    if spec is None:
+        return None
+    return _apply(spec, reference, prefer_future)
+
+
+def resolve_record_and_follow_up(text: str, reference: Optional[date] = None) -> Tuple[Optional[date], Optional[date]]:
+    """Split voice text into a record date and a follow-up date.
+
+    Anything after a follow-up cue ("follow up in 10 days", "come back next Monday"),
+    or from the first forward-looking expression ("in two weeks", "next week")
+    when there is no cue, is resolved as a future follow-up date; the rest
+    resolves the visit date.
+    A visit after the reference date or a follow-up before it is not trusted
+    and comes back None, so callers keep whatever date they had.
+    """
+    if not text:
+        return None, None
+    normalized = _normalize(text)
+    follow_up_match = _FOLLOW_UP_RE.search(normalized)
+    future_match = None if follow_up_match else _FUTURE_RE.search(normalized)
+    if follow_up_match:
+        visit_text = normalized[:follow_up_match.start()]
+        follow_up_text = normalized[follow_up_match.end():]
+    elif future_match:
+        visit_text = normalized[:future_match.start()]
+        follow_up_text = normalized[future_match.start():]
+    else:
+        visit_text, follow_up_text = normalized, ''
+
+    reference = reference or datetime.now().date()
+    record_date = resolve_date(visit_text, reference)
+    follow_up_date = resolve_date(follow_up_text, reference, prefer_future=True)
+    if record_date and record_date > reference:
+        record_date = None
+    if follow_up_date and follow_up_date < reference:
+        follow_up_date = None
+    return record_date, follow_up_date
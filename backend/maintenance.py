@@ -0,0 +1,338 @@
+"""
+Database Maintenance
+Background upkeep for every shard's SQLite file, so a long-running server
+keeps its WAL short, its planner statistics fresh and a recent backup on
+disk.
+
+Every tick the scheduler checkpoints WAL files that grew past a limit.
+PASSIVE checkpoints never wait on readers or writers; the WAL is truncated
+only once a passive run has copied every frame back. The heavier tasks run
+only inside the off-peak window, at most once per interval each:
+
+- archiving old records to the cold databases (see archive.py);
+- PRAGMA optimize (ANALYZE, bounded by analysis_limit, the first time) so
+  the query planner has statistics;
+- incremental vacuum, a few pages per write transaction, returning free
+  pages to the filesystem;
+- an online backup of every shard, its cold database included, through
+  the SQLite backup API.
+
+The backup reads one snapshot of each file inside a read transaction and
+copies it a few pages per step, sleeping in between. In WAL mode writers
+never wait for it, and the copy never restarts because of their commits.
+Shards are copied one after another, so a backup set is consistent per
+shard, not across shards.
+
+Task runs are claimed in a catalog table, so with several worker processes
+each task still runs once per interval.
+"""
+
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from datetime import time as day_time
+from typing import List, Optional, Tuple
+
+from shards import Shard, ShardSet
+
+CATALOG_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS maintenance_runs (
+        task TEXT NOT NULL,
+        shard INTEGER NOT NULL,
+        last_run REAL NOT NULL,
+        detail TEXT,
+        PRIMARY KEY (task, shard)
+    )
+"""
+# maintenance_runs.shard of tasks covering every shard (backups)
+ALL_SHARDS = -1
+# Rows examined per index by ANALYZE; keeps the first run short on big tables
+ANALYSIS_LIMIT = 1000
+# How long a WAL truncate waits for readers before giving up until the next tick
+TRUNCATE_BUSY_MS = 100
+
+
+def parse_window(spec: str) -> Optional[Tuple[day_time, day_time]]:
+    """'HH:MM-HH:MM' in local time (may wrap past midnight); None for an empty spec"""
+    if not spec:
+        return None
+    start, end = (day_time.fromisoformat(part.strip()) for part in spec.split('-'))
+    return start, end
+
+
+def in_window(window: Optional[Tuple[day_time, day_time]], now: datetime) -> bool:
+    """Whether now falls in window; with no window every time is off-peak"""
+    if window is None:
+        return True
+    start, end = window
+    current = now.time()
+    if start <= end:
+        return start <= current < end
+    return current >= start or current < end
+
+
+class MaintenanceScheduler:
+    """Checkpoints, optimizes, vacuums and backs up the shards in the background"""
+
+    def __init__(self, shards: ShardSet, logger: Optional[logging.Logger] = None, window: str = '',
+                 interval: float = 60, checkpoint_bytes: int = 16 << 20, optimize_interval: float = 86400,
+                 vacuum_interval: float = 86400, vacuum_pages: int = 256, vacuum_convert_ratio: float = 0.2,
+                 backup_dir: str = '', backup_interval: float = 86400, backup_keep: int = 7,
+                 backup_pages: int = 256, step_sleep: float = 0.05, archiver=None,
+                 archive_interval: float = 86400):
+        self.shards = shards
+        self.logger = logger or logging.getLogger(__name__)
+        self.window = parse_window(window)
+        self.interval = interval
+        self.checkpoint_bytes = checkpoint_bytes
+        self.optimize_interval = optimize_interval
+        self.vacuum_interval = vacuum_interval
+        self.vacuum_pages = vacuum_pages
+        self.vacuum_convert_ratio = vacuum_convert_ratio
+        self.backup_dir = backup_dir
+        self.backup_interval = backup_interval
+        self.backup_keep = backup_keep
+        self.backup_pages = backup_pages
+        self.step_sleep = step_sleep  # pause between vacuum and backup steps
+        self.archiver = archiver  # archive.Archiver, run in the window like the other tasks
+        self.archive_interval = archive_interval
+        self._backup_lock = threading.Lock()
+        self._thread = None
+
+    def init_schema(self):
+        with self.shards.catalog.connection() as conn:
+            conn.execute(CATALOG_SCHEMA)
+
+    def _claim(self, task: str, shard: int, interval: float) -> Optional[float]:
+        """Mark task as run now if it last ran interval or more ago; returns
+        the previous run time when claimed, else None"""
+        now = time.time()
+        catalog = self.shards.catalog
+        with catalog.write_lock, catalog.connection() as conn:
+            conn.execute("INSERT OR IGNORE INTO maintenance_runs (task, shard, last_run) VALUES (?, ?, 0)",
+                         (task, shard))
+            previous = conn.execute("SELECT last_run FROM maintenance_runs WHERE task = ? AND shard = ?",
+                                    (task, shard)).fetchone()[0]
+            claimed = conn.execute("""
+                UPDATE maintenance_runs SET last_run = ? WHERE task = ? AND shard = ? AND last_run <= ?
+            """, (now, task, shard, now - interval)).rowcount
+        return previous if claimed else None
+
+    def _finish(self, task: str, shard: int, detail: str, previous: Optional[float] = None):
+        """Record a task's outcome; a failed run (previous given) is released for retry"""
+        catalog = self.shards.catalog
+        with catalog.write_lock, catalog.connection() as conn:
+            if previous is None:
+                conn.execute("UPDATE maintenance_runs SET detail = ? WHERE task = ? AND shard = ?",
+                             (detail, task, shard))
+            else:
+                conn.execute("UPDATE maintenance_runs SET last_run = ?, detail = ? WHERE task = ? AND shard = ?",
+                             (previous, detail, task, shard))
+
+    def _run(self, task: str, shard: int, interval: float, fn) -> bool:
+        """fn() if the task is due; False when it was not"""
+        previous = self._claim(task, shard, interval)
+        if previous is None:
+            return False
+        started = time.perf_counter()
+        try:
+            detail = fn()
+        except Exception as e:
+            self.logger.warning(f"Maintenance task {task} on shard {shard} failed: {e}")
+            self._finish(task, shard, f"failed: {e}", previous)
+            return True
+        self._finish(task, shard, f"{detail} in {time.perf_counter() - started:.2f}s")
+        self.logger.info(f"Maintenance task {task} on shard {shard}: {detail}")
+        return True
+
+    @staticmethod
+    def wal_size(path: str) -> int:
+        try:
+            return os.path.getsize(path + '-wal')
+        except OSError:
+            return 0
+
+    @staticmethod
+    def databases(conn) -> List[Tuple[str, str]]:
+        """(schema, file) of each database open on conn: main and the attached ones"""
+        return [(name, path) for _, name, path in conn.execute('PRAGMA database_list') if name != 'temp' and path]
+
+    def checkpoint(self, shard: Shard, schema: str = 'main') -> Tuple[int, int, int]:
+        """Checkpoint a WAL of shard without blocking anyone, then truncate the
+        file if that copied every frame; returns (busy, log frames, checkpointed)"""
+        with shard.connection() as conn:
+            busy, log, checkpointed = conn.execute(f'PRAGMA {schema}.wal_checkpoint(PASSIVE)').fetchone()
+            if busy or checkpointed < log:
+                return busy, log, checkpointed
+            # Truncating waits for readers; holding the writer lock keeps this
+            # process's writers queued in Python rather than on SQLite's busy timeout
+            with shard.write_lock:
+                timeout = conn.execute('PRAGMA busy_timeout').fetchone()[0]
+                conn.execute(f'PRAGMA busy_timeout = {TRUNCATE_BUSY_MS}')
+                try:
+                    return tuple(conn.execute(f'PRAGMA {schema}.wal_checkpoint(TRUNCATE)').fetchone())
+                finally:
+                    conn.execute(f'PRAGMA busy_timeout = {timeout}')
+
+    def optimize(self, shard: Shard) -> str:
+        """Refresh the planner statistics: ANALYZE on first run, PRAGMA optimize after"""
+        with shard.connection() as conn:
+            conn.execute(f'PRAGMA analysis_limit = {ANALYSIS_LIMIT}')
+            analyzed = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone()
+            with shard.write_lock:
+                if analyzed:
+                    conn.execute('PRAGMA optimize').fetchall()
+                else:
+                    conn.execute('ANALYZE')
+                conn.commit()
+        return 'optimized' if analyzed else 'analyzed'
+
+    def vacuum(self, shard: Shard) -> str:
+        """Return free pages to the filesystem, vacuum_pages per write transaction.
+
+        Databases created before auto_vacuum was set need one full VACUUM to
+        switch to incremental mode; that only happens once their free pages
+        reach vacuum_convert_ratio of the file.
+        """
+        with shard.connection() as conn:
+            mode = conn.execute('PRAGMA auto_vacuum').fetchone()[0]
+            free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            pages = conn.execute('PRAGMA page_count').fetchone()[0]
+            if mode != 2:  # not INCREMENTAL
+                if not pages or free / pages < self.vacuum_convert_ratio:
+                    return f"{free} of {pages} pages free"
+                with shard.write_lock:
+                    conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+                    conn.execute('VACUUM')
+                return f"switched to incremental auto_vacuum, {free} pages freed"
+            freed = 0
+            while free > 0:
+                with shard.write_lock:
+                    # execute() would step the pragma once, freeing a single page
+                    conn.executescript(f'PRAGMA incremental_vacuum({self.vacuum_pages})')
+                    remaining = conn.execute('PRAGMA freelist_count').fetchone()[0]
+                if remaining >= free:
+                    break
+                freed += free - remaining
+                free = remaining
+                time.sleep(self.step_sleep)
+            return f"{freed} pages freed"
+
+    def backup(self) -> str:
+        """Copy every shard into a new timestamped directory under backup_dir
+        and drop the oldest sets beyond backup_keep; returns the directory"""
+        with self._backup_lock:
+            name = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+            target = os.path.join(self.backup_dir, name)
+            partial = target + '.partial'
+            os.makedirs(partial, exist_ok=True)
+            try:
+                for shard in self.shards:
+                    self._backup_shard(shard, partial)
+                os.replace(partial, target)
+            except BaseException:
+                shutil.rmtree(partial, ignore_errors=True)
+                raise
+            self.prune_backups()
+            return target
+
+    def _backup_shard(self, shard: Shard, directory: str):
+        """Copy each database open on the shard's connections (its file and
+        any attached ones) into directory under its own file name"""
+        with shard.connection() as conn:
+            # One read transaction: every step copies the same snapshot,
+            # so concurrent commits never restart the copy
+            conn.execute('BEGIN')
+            databases = self.databases(conn)
+            for schema, _ in databases:
+                conn.execute(f'SELECT 1 FROM {schema}.sqlite_master LIMIT 1').fetchall()
+            for schema, source in databases:
+                destination = sqlite3.connect(os.path.join(directory, os.path.basename(source)))
+                try:
+                    conn.backup(destination, pages=self.backup_pages, name=schema, sleep=self.step_sleep)
+                    result = destination.execute('PRAGMA quick_check').fetchone()[0]
+                    if result != 'ok':
+                        raise sqlite3.DatabaseError(f"backup of {source} failed quick_check: {result}")
+                finally:
+                    destination.close()
+            conn.commit()
+
+    def backups(self) -> List[str]:
+        """Completed backup sets, oldest first"""
+        if not self.backup_dir or not os.path.isdir(self.backup_dir):
+            return []
+        return sorted(name for name in os.listdir(self.backup_dir)
+                      if not name.endswith('.partial') and os.path.isdir(os.path.join(self.backup_dir, name)))
+
+    def prune_backups(self):
+        for name in self.backups()[:-max(self.backup_keep, 1)]:
+            shutil.rmtree(os.path.join(self.backup_dir, name), ignore_errors=True)
+
+    def run_once(self, now: Optional[datetime] = None):
+        """One scheduler tick: checkpoints always, the rest when off-peak and due"""
+        for shard in self.shards:
+            with shard.connection() as conn:
+                databases = self.databases(conn)
+            for schema, path in databases:
+                if self.wal_size(path) >= self.checkpoint_bytes:
+                    busy, log, checkpointed = self.checkpoint(shard, schema)
+                    self.logger.debug(f"Checkpointed {path}: {checkpointed}/{log} frames, busy={busy}")
+        if not in_window(self.window, now or datetime.now()):
+            return
+        # Before vacuuming, which returns the pages archiving frees
+        if self.archiver is not None and self.archive_interval > 0:
+            self._run('archive', ALL_SHARDS, self.archive_interval, self.archiver.run_once)
+        for shard in self.shards:
+            if self.optimize_interval > 0:
+                self._run('optimize', shard.index, self.optimize_interval, lambda: self.optimize(shard))
+            if self.vacuum_interval > 0:
+                self._run('vacuum', shard.index, self.vacuum_interval, lambda: self.vacuum(shard))
+        if self.backup_dir and self.backup_interval > 0:
+            self._run('backup', ALL_SHARDS, self.backup_interval, self.backup)
+
+    def start(self):
+        """Run a tick every interval seconds in the background"""
+        if self._thread is not None:
+            return
+
+        def loop():
+            while True:
+                try:
+                    self.run_once()
+                except Exception as e:
+                    self.logger.warning(f"Database maintenance failed: {e}")
+                time.sleep(self.interval)
+
+        self._thread = threading.Thread(target=loop, name='db-maintenance', daemon=True)
+        self._thread.start()
+
+    def status(self) -> dict:
+        """Per-shard file state, the last task runs and the backup sets"""
+        shard_status = []
+        for shard in self.shards:
+            with shard.connection() as conn:
+                shard_status.append({
+                    'shard': shard.index,
+                    'path': shard.path,
+                    'wal_bytes': {path: self.wal_size(path) for _, path in self.databases(conn)},
+                    'page_count': conn.execute('PRAGMA page_count').fetchone()[0],
+                    'freelist_count': conn.execute('PRAGMA freelist_count').fetchone()[0],
+                    'auto_vacuum': ('none', 'full', 'incremental')[conn.execute('PRAGMA auto_vacuum').fetchone()[0]],
+                })
+        with self.shards.catalog.connection() as conn:
+            runs = [{'task': task, 'shard': shard, 'last_run': datetime.fromtimestamp(last_run).isoformat(),
+                     'detail': detail}
+                    for task, shard, last_run, detail in conn.execute(
+                        "SELECT task, shard, last_run, detail FROM maintenance_runs WHERE last_run > 0 "
+                        "ORDER BY task, shard")]
+        return {
+            'window': None if self.window is None else '-'.join(t.strftime('%H:%M') for t in self.window),
+            'off_peak': in_window(self.window, datetime.now()),
+            'shards': shard_status,
+            'runs': runs,
+            'backups': self.backups(),
+        }
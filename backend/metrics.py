@@ -0,0 +1,251 @@
+"""
+Request, SQLite and LLM Metrics in Prometheus Text Format
+Counters, gauges and histograms keep one shard per thread, so recording a
+sample never takes a lock: each thread only writes its own shard and a
+scrape sums the shards. Thread idents are reused by the OS, so the shard
+count stays bounded by the peak number of live threads.
+
+SQLite statement timings come from TimedConnection, passed as the
+connection factory; it times execute() up to the first result row, so
+rows fetched afterwards are not included. Threads registered in
+sql_captures (see profiling.py) also get each statement and its time.
+"""
+
+import bisect
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Sequence, Tuple
+
+# Request and LLM latencies span milliseconds to a minute
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# SQLite statements and lock waits are mostly sub-millisecond
+DB_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0, 5.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Sequence[str], values: Sequence, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    """Base for sharded metrics; values are keyed by a tuple of label values"""
+
+    kind = ''
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._shards: Dict[int, dict] = {}
+
+    def _shard(self) -> dict:
+        ident = threading.get_ident()
+        shard = self._shards.get(ident)
+        if shard is None:
+            # setdefault is atomic; only this thread ever writes to its shard
+            shard = self._shards.setdefault(ident, {})
+        return shard
+
+    def _merged(self) -> dict:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        merged = self._merged()
+        if not merged and not self.labels:
+            merged = {(): 0}
+        for key, value in sorted(merged.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, *label_values, amount: float = 1):
+        shard = self._shard()
+        shard[label_values] = shard.get(label_values, 0) + amount
+
+    def _merged(self) -> dict:
+        totals = {}
+        for shard in list(self._shards.values()):
+            for key, value in list(shard.items()):
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def value(self, *label_values) -> float:
+        return self._merged().get(label_values, 0)
+
+
+class Gauge(Counter):
+    """Up/down gauge; per-thread shards may go negative, their sum never does"""
+
+    kind = 'gauge'
+
+    def dec(self, *label_values, amount: float = 1):
+        self.inc(*label_values, amount=-amount)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, seconds: float, *label_values):
+        shard = self._shard()
+        state = shard.get(label_values)
+        if state is None:
+            # Per-bucket (non-cumulative) counts, then +Inf, sum
+            state = shard[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+        state[bisect.bisect_left(self.buckets, seconds)] += 1
+        state[-1] += seconds
+
+    def time(self, *label_values) -> '_Timer':
+        return _Timer(self, label_values)
+
+    def _merged(self) -> dict:
+        totals = {}
+        for shard in list(self._shards.values()):
+            for key, state in list(shard.items()):
+                merged = totals.get(key)
+                if merged is None:
+                    totals[key] = list(state)
+                else:
+                    for i, value in enumerate(state):
+                        merged[i] += value
+        return totals
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, state in sorted(self._merged().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), state):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound!r}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {state[-1]!r}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ('histogram', 'label_values', 'start')
+
+    def __init__(self, histogram: Histogram, label_values: Tuple):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.label_values)
+        return False
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[_Metric] = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+http_requests = registry.register(Counter(
+    'phr_http_requests_total', 'HTTP requests by route and status', ('method', 'route', 'status')))
+http_latency = registry.register(Histogram(
+    'phr_http_request_duration_seconds', 'Time to produce the response (streams: time to first byte)',
+    ('method', 'route')))
+http_in_flight = registry.register(Gauge(
+    'phr_http_requests_in_flight', 'Requests currently being handled', ('method', 'route')))
+
+db_query_latency = registry.register(Histogram(
+    'phr_sqlite_statement_duration_seconds', 'SQLite statement execution time by statement kind',
+    ('kind',), buckets=DB_BUCKETS))
+db_write_lock_wait = registry.register(Histogram(
+    'phr_sqlite_write_lock_wait_seconds', 'Time execute_write waited for the process write lock',
+    buckets=DB_BUCKETS))
+db_write_latency = registry.register(Histogram(
+    'phr_sqlite_write_duration_seconds', 'Time spent inside execute_write transactions',
+    buckets=DB_BUCKETS))
+db_write_retries = registry.register(Counter(
+    'phr_sqlite_write_retries_total', "execute_write retries after 'database is locked'"))
+db_write_failures = registry.register(Counter(
+    'phr_sqlite_write_failures_total', 'execute_write calls that raised'))
+
+llm_latency = registry.register(Histogram(
+    'phr_llm_request_duration_seconds', 'LLM completion call time per model and outcome',
+    ('feature', 'model', 'outcome')))
+
+
+# thread ident -> list collecting (sql, seconds) for a profiled request
+sql_captures: Dict[int, list] = {}
+
+STATEMENT_KINDS = frozenset(('select', 'insert', 'update', 'delete', 'with', 'create', 'pragma'))
+
+
+def _statement_kind(sql: str) -> str:
+    words = sql.lstrip()[:7].split(None, 1)
+    kind = words[0].lower() if words else ''
+    return kind if kind in STATEMENT_KINDS else 'other'
+
+
+def _observe_statement(sql: str, seconds: float):
+    db_query_latency.observe(seconds, _statement_kind(sql))
+    if sql_captures:
+        capture = sql_captures.get(threading.get_ident())
+        if capture is not None:
+            capture.append((' '.join(sql.split()), seconds))
+
+
+class TimedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _observe_statement(sql, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _observe_statement(sql, time.perf_counter() - start)
+
+
+class TimedConnection(sqlite3.Connection):
+    """Connection whose execute() shortcuts and cursors record statement timings"""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
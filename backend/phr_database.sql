@@ -1,6 +1,10 @@
 -- SQLite version of PHR Database
 -- Converted from MySQL dump files
 
+-- Full-text search indexes are rebuilt from the tables below on app start
+DROP TABLE IF EXISTS health_records_fts;
+DROP TABLE IF EXISTS treatment_fts;
+
 -- Table: users
 DROP TABLE IF EXISTS users;
 CREATE TABLE users (
@@ -51,6 +55,50 @@ INSERT INTO treatment (treatment_id, record_id, medication, procedure, follow_up
 (1,1,'Amlodipine','1 Tablet after Breakfast','2025-06-24'),
 (2,2,'Salbutamol Inhaler','Use 2 puffs when experiencing breathing difficulty ','2025-08-05');
 
+-- Shard catalog (see shards.py): rebuilt from users on app start; any
+-- other shard files are removed by reset_db.py
+DROP TABLE IF EXISTS user_directory;
+DROP TABLE IF EXISTS shard_meta;
+
+-- Table: sessions (login tokens, stored as SHA-256 digests)
+DROP TABLE IF EXISTS sessions;
+CREATE TABLE sessions (
+    token_hash TEXT PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX idx_sessions_user ON sessions(user_id);
+
+-- Table: change_log (row changes followed by clients through /changes)
+-- Kept across resets so sequence numbers never repeat; raising the floor
+-- to the last issued seq makes every client cursor resync, and dropping
+-- db_id gives the reset database a new identity that no snapshot matches
+CREATE TABLE IF NOT EXISTS change_log (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    table_name TEXT NOT NULL,
+    op TEXT NOT NULL CHECK (op IN ('insert', 'update', 'delete')),
+    row_id INTEGER NOT NULL,
+    user_id INTEGER,
+    payload TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_change_log_user ON change_log(user_id, seq);
+CREATE INDEX IF NOT EXISTS idx_change_log_row ON change_log(table_name, row_id);
+CREATE TABLE IF NOT EXISTS change_log_meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR REPLACE INTO change_log_meta (key, value)
+SELECT 'floor_seq', COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'change_log'), 0);
+DELETE FROM change_log_meta WHERE key = 'db_id';
+DELETE FROM change_log;
+
+-- Indexes on foreign-key columns (per-user reads and cascading deletes)
+CREATE INDEX idx_health_records_user ON health_records(user_id);
+CREATE INDEX idx_health_records_doctor ON health_records(doctor_id);
+CREATE INDEX idx_treatment_record ON treatment(record_id);
+
 -- Table: doctors (creating basic structure since original was empty)
 DROP TABLE IF EXISTS doctors;
 CREATE TABLE doctors (
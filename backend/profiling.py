@@ -0,0 +1,156 @@
+"""
+On-Demand Request Profiling
+A request is profiled when it carries 'X-Profile: 1' with the admin token,
+or when it is picked by PROFILE_SAMPLE_RATE. One shared sampler thread
+reads the stacks of the profiled request threads every PROFILE_INTERVAL_MS,
+and the SQL statements they run are captured with their timings (see
+metrics.TimedCursor). Results are folded stacks, which flamegraph.pl and
+speedscope read directly. They are kept in a bounded buffer of recent
+profiles. With both triggers off the only cost per request is one header
+lookup.
+"""
+
+import heapq
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from typing import Dict, List, Optional
+
+import metrics
+
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', '2'))
+PROFILE_BUFFER_SIZE = int(os.getenv('PROFILE_BUFFER_SIZE', '200'))
+MAX_STACK_DEPTH = 64
+
+
+class RequestProfile:
+    """Stack samples and SQL statements collected for one request"""
+
+    def __init__(self, profile_id: int, method: str, path: str, trigger: str):
+        self.id = profile_id
+        self.method = method
+        self.path = path
+        self.trigger = trigger
+        self.thread_id = threading.get_ident()
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.duration_ms = None
+        self.status = None
+        self.stacks = Counter()
+        self.sql: List[tuple] = []
+
+    def folded(self) -> str:
+        """'frame;frame;frame count' lines, root first"""
+        return '\n'.join(f"{stack} {count}" for stack, count in self.stacks.most_common()) + '\n'
+
+    def summary(self) -> dict:
+        return {
+            'id': self.id,
+            'method': self.method,
+            'path': self.path,
+            'status': self.status,
+            'trigger': self.trigger,
+            'started_at': self.started_at,
+            'duration_ms': self.duration_ms,
+            'samples': sum(self.stacks.values()),
+            'sql_count': len(self.sql),
+            'sql_ms': round(sum(seconds for _, seconds in self.sql) * 1000, 3),
+        }
+
+    def detail(self, top_stacks: int = 50) -> dict:
+        detail = self.summary()
+        detail['sql'] = [{'statement': statement, 'ms': round(seconds * 1000, 3)} for statement, seconds in self.sql]
+        detail['top_stacks'] = [{'stack': stack, 'samples': count}
+                                for stack, count in self.stacks.most_common(top_stacks)]
+        return detail
+
+
+def _frame_label(code) -> str:
+    # parent/file keeps flask/app.py apart from backend/app.py
+    directory, filename = os.path.split(code.co_filename)
+    return f"{code.co_name} ({os.path.basename(directory)}/{filename}:{code.co_firstlineno})"
+
+
+class Profiler:
+    """Starts and finishes request profiles; keeps the most recent ones"""
+
+    def __init__(self, sample_rate: float = PROFILE_SAMPLE_RATE, interval_ms: float = PROFILE_INTERVAL_MS,
+                 buffer_size: int = PROFILE_BUFFER_SIZE):
+        self.sample_rate = sample_rate
+        self.interval = interval_ms / 1000
+        self.recent = deque(maxlen=buffer_size)
+        self._active: Dict[int, RequestProfile] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._sampler = None
+
+    def should_sample(self) -> bool:
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def start(self, method: str, path: str, trigger: str) -> RequestProfile:
+        profile = RequestProfile(next(self._ids), method, path, trigger)
+        with self._lock:
+            self._active[profile.thread_id] = profile
+            metrics.sql_captures[profile.thread_id] = profile.sql
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._sample_loop, name='profiler', daemon=True)
+                self._sampler.start()
+        self._wake.set()
+        return profile
+
+    def finish(self, profile: RequestProfile, status: Optional[int] = None):
+        profile.duration_ms = round((time.perf_counter() - profile.start) * 1000, 3)
+        profile.status = status
+        with self._lock:
+            self._active.pop(profile.thread_id, None)
+            metrics.sql_captures.pop(profile.thread_id, None)
+            self.recent.append(profile)
+
+    def discard(self, profile: RequestProfile):
+        with self._lock:
+            self._active.pop(profile.thread_id, None)
+            metrics.sql_captures.pop(profile.thread_id, None)
+
+    def _sample_loop(self):
+        while True:
+            # Clear before checking, so a profile started in between still wakes us
+            self._wake.clear()
+            if not self._active:
+                self._wake.wait()
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                active = list(self._active.items())
+            samples = []
+            for thread_id, profile in active:
+                frame = frames.get(thread_id)
+                labels = []
+                while frame is not None and len(labels) < MAX_STACK_DEPTH:
+                    labels.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                if labels:
+                    samples.append((profile, ';'.join(reversed(labels))))
+            del frames
+            with self._lock:
+                # Finished profiles are read by the admin endpoint; leave them alone
+                for profile, stack in samples:
+                    if self._active.get(profile.thread_id) is profile:
+                        profile.stacks[stack] += 1
+
+    def slowest(self, limit: int = 20) -> List[RequestProfile]:
+        with self._lock:
+            recent = list(self.recent)
+        return heapq.nlargest(limit, recent, key=lambda profile: profile.duration_ms)
+
+    def get(self, profile_id: int) -> Optional[RequestProfile]:
+        with self._lock:
+            return next((profile for profile in self.recent if profile.id == profile_id), None)
+
+
+profiler = Profiler()
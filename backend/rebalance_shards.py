@@ -0,0 +1,221 @@
+"""
+Rebalance User Shards
+Moves users, with their health records and treatments, to the shard their
+user_id hashes to for a new shard count, and records that count so the
+server starts with SHARD_COUNT set to it. Run it with the server stopped:
+
+    python rebalance_shards.py --shards 4 [--dry-run]
+
+Going from n to m > n shards moves about 1 - n/m of the users, all into the
+new shards, and their rows keep their ids. Shrinking renumbers the rows it
+moves into the remaining shards' id ranges, and deletes the emptied shard
+files. Archived records of moved users are read from the old shard's cold
+database too, and land in the new shard's hot tables until the next archive
+run. Each batch of users is copied and removed from its old shard in one
+transaction, so an interrupted run can simply be repeated. The doctors copy
+on every shard is also re-synced from the catalog.
+
+Moved users' change feed cursors point into their old shard's log, so
+their clients resync once.
+"""
+
+import argparse
+import glob
+import os
+import re
+import sqlite3
+from collections import defaultdict
+
+from archive import cold_path
+from shards import ShardSet, jump_hash, shard_path
+
+DATABASE = 'phr_database.db'
+# Users moved per transaction
+BATCH_USERS = 500
+
+
+def connect(path):
+    return sqlite3.connect(path, timeout=30)
+
+
+def existing_shards(database):
+    """index -> path of every shard file on disk, including ones past the new count"""
+    root, ext = os.path.splitext(database)
+    found = {0: database}
+    for path in glob.glob(f"{glob.escape(root)}.shard*{ext}"):
+        match = re.fullmatch(re.escape(root) + r'\.shard(\d+)' + re.escape(ext), path)
+        if match:
+            found[int(match.group(1))] = path
+    return dict(sorted(found.items()))
+
+
+def columns(conn, table, schema='main'):
+    return [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({table})")]
+
+
+def plan_moves(sources, count):
+    """(source index, target index) -> user_ids whose rows are on the wrong shard"""
+    moves = defaultdict(list)
+    for index, path in sources.items():
+        conn = connect(path)
+        try:
+            # Records whose user row is missing still belong with that user_id
+            sql = "SELECT user_id FROM users UNION SELECT user_id FROM health_records"
+            if os.path.exists(cold_path(path)):
+                conn.execute("ATTACH DATABASE ? AS cold", (cold_path(path),))
+                sql += " UNION SELECT user_id FROM cold.health_records"
+            user_ids = conn.execute(sql).fetchall()
+        except sqlite3.OperationalError:
+            user_ids = []  # a shard file without tables yet
+        finally:
+            conn.close()
+        for (user_id,) in user_ids:
+            home = jump_hash(user_id, count)
+            if home != index:
+                moves[(index, home)].append(user_id)
+    return moves
+
+
+def sync_doctors(catalog_path, path):
+    """Make the doctors table at path an exact copy of the catalog's"""
+    conn = connect(path)
+    try:
+        conn.execute("ATTACH DATABASE ? AS catalog", (catalog_path,))
+        names = ', '.join(columns(conn, 'doctors'))
+        with conn:
+            conn.execute("DELETE FROM main.doctors WHERE doctor_id NOT IN (SELECT doctor_id FROM catalog.doctors)")
+            conn.execute(f"INSERT OR REPLACE INTO main.doctors ({names}) SELECT {names} FROM catalog.doctors")
+        conn.execute("DETACH DATABASE catalog")
+    finally:
+        conn.close()
+
+
+def _next_id(conn, table):
+    """The id AUTOINCREMENT would give the next row of table on the target shard"""
+    key = 'record_id' if table == 'health_records' else 'treatment_id'
+    row = conn.execute("SELECT seq FROM main.sqlite_sequence WHERE name = ?", (table,)).fetchone()
+    top = conn.execute(f"SELECT COALESCE(MAX({key}), 0) FROM main.{table}").fetchone()[0]
+    return max(row[0] if row else 0, top) + 1
+
+
+def move_users(source_path, target_path, user_ids):
+    """Copy user_ids' rows from source into target and delete them from
+    source, in one transaction; returns (users, records, treatments) moved"""
+    conn = connect(target_path)
+    try:
+        conn.execute("ATTACH DATABASE ? AS source", (source_path,))
+        schemas = ['source']
+        if os.path.exists(cold_path(source_path)):
+            conn.execute("ATTACH DATABASE ? AS source_cold", (cold_path(source_path),))
+            schemas.append('source_cold')
+        for table in ('health_records', 'treatment'):
+            conn.execute(f"CREATE TEMP VIEW source_{table} AS " +
+                         ' UNION ALL '.join(f"SELECT * FROM {schema}.{table}" for schema in schemas))
+        marks = ','.join('?' * len(user_ids))
+        user_columns = ', '.join(columns(conn, 'users'))
+        record_columns = columns(conn, 'health_records')
+        treatment_columns = columns(conn, 'treatment')
+        with conn:
+            users = conn.execute(f"""
+                INSERT OR IGNORE INTO main.users ({user_columns})
+                SELECT {user_columns} FROM source.users WHERE user_id IN ({marks})
+            """, user_ids).rowcount
+            records = conn.execute(f"""
+                SELECT {', '.join(record_columns)} FROM source_health_records
+                WHERE user_id IN ({marks}) ORDER BY record_id
+            """, user_ids).fetchall()
+            treatments = conn.execute(f"""
+                SELECT {', '.join('t.' + name for name in treatment_columns)} FROM source_treatment t
+                JOIN source_health_records hr ON hr.record_id = t.record_id
+                WHERE hr.user_id IN ({marks}) ORDER BY t.treatment_id
+            """, user_ids).fetchall()
+
+            # Ids below the target's next id keep it; anything above would
+            # drag the target's allocation into another shard's range
+            keep_ids = (all(row[0] < _next_id(conn, 'health_records') for row in records) and
+                        all(row[0] < _next_id(conn, 'treatment') for row in treatments))
+            if keep_ids:
+                conn.executemany(f"""
+                    INSERT OR IGNORE INTO main.health_records ({', '.join(record_columns)})
+                    VALUES ({','.join('?' * len(record_columns))})
+                """, records)
+                conn.executemany(f"""
+                    INSERT OR IGNORE INTO main.treatment ({', '.join(treatment_columns)})
+                    VALUES ({','.join('?' * len(treatment_columns))})
+                """, treatments)
+            else:
+                new_record_ids = {}
+                for row in records:
+                    new_record_ids[row[0]] = conn.execute(f"""
+                        INSERT INTO main.health_records ({', '.join(record_columns[1:])})
+                        VALUES ({','.join('?' * (len(record_columns) - 1))})
+                    """, row[1:]).lastrowid
+                record_index = treatment_columns.index('record_id')
+                for row in treatments:
+                    values = list(row[1:])
+                    values[record_index - 1] = new_record_ids[row[record_index]]
+                    conn.execute(f"""
+                        INSERT INTO main.treatment ({', '.join(treatment_columns[1:])})
+                        VALUES ({','.join('?' * (len(treatment_columns) - 1))})
+                    """, values)
+                if conn.execute("SELECT 1 FROM main.sqlite_master WHERE name = 'change_log_meta'").fetchone():
+                    # Renumbered rows no longer match snapshots of this shard;
+                    # the server draws a new db_id at startup
+                    conn.execute("DELETE FROM main.change_log_meta WHERE key = 'db_id'")
+
+            for schema in schemas:
+                conn.execute(f"""
+                    DELETE FROM {schema}.treatment WHERE record_id IN
+                        (SELECT record_id FROM source_health_records WHERE user_id IN ({marks}))
+                """, user_ids)
+            for schema in schemas:
+                conn.execute(f"DELETE FROM {schema}.health_records WHERE user_id IN ({marks})", user_ids)
+            conn.execute(f"DELETE FROM source.users WHERE user_id IN ({marks})", user_ids)
+        return users, len(records), len(treatments)
+    finally:
+        conn.close()
+
+
+def remove_shard_file(path):
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Move users to their shards for a new shard count')
+    parser.add_argument('--shards', type=int, required=True, help='new shard count (SHARD_COUNT)')
+    parser.add_argument('--database', default=DATABASE, help='shard 0 / catalog database file')
+    parser.add_argument('--dry-run', action='store_true', help='only print the users that would move')
+    args = parser.parse_args()
+
+    sources = existing_shards(args.database)
+    moves = plan_moves(sources, args.shards)
+    print(f"Shards on disk: {len(sources)}, target: {args.shards}")
+    for (source, target), user_ids in sorted(moves.items()):
+        print(f"  shard {source} -> shard {target}: {len(user_ids)} users")
+    if args.dry_run:
+        return
+
+    shards = ShardSet(args.database, args.shards, connect)
+    shards.init_schema(check_layout=False)
+    for shard in shards.shards[1:]:
+        sync_doctors(args.database, shard.path)
+
+    totals = [0, 0, 0]
+    for (source, target), user_ids in sorted(moves.items()):
+        for start in range(0, len(user_ids), BATCH_USERS):
+            moved = move_users(sources[source], shards[target].path, user_ids[start:start + BATCH_USERS])
+            totals = [total + count for total, count in zip(totals, moved)]
+
+    for index, path in sources.items():
+        if index >= args.shards:
+            remove_shard_file(shard_path(args.database, index))
+            remove_shard_file(cold_path(shard_path(args.database, index)))
+    shards.set_layout(args.shards)
+    print(f"Moved {totals[0]} users, {totals[1]} health records and {totals[2]} treatments; "
+          f"start the server with SHARD_COUNT={args.shards}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,294 @@
+"""
+Aggregator Replica
+Keeps the in-memory health_aggregator in step with SQLite by following the
+change_log. The aggregator is loaded from the tables once, then every entry
+committed after that seq is applied in order, whichever process wrote it. With
+several worker processes on one database each worker holds its own replica,
+so the summary, analytics and urgency endpoints answer the same from any of
+them.
+
+Entries are applied as upserts and deletes that tolerate missing rows:
+compaction may have dropped an insert that a later update superseded. A
+replica that fell behind the change log floor reloads from the tables.
+
+A restart can start from a snapshot file (see snapshot.py) instead of the
+tables: its seqs mark where replay picks up.
+
+The autocomplete index is kept the same way, so suggestions in every worker
+follow every worker's writes. It is not in the snapshot: a restore loads it
+from the tables and skips the entries that load already covers. An entry
+only carries the new row, so the text being replaced comes from the
+replica's own state: the aggregator's records and doctors, and a map of
+treatment medications.
+
+With several shards (see shards.py) every shard has its own change log and
+the replica follows each one; a row only ever changes on one shard, so
+per-shard order is all the replay needs. Doctors are written to every
+shard, and only shard 0's entries for them are applied.
+"""
+
+import logging
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import snapshot
+
+from changelog import ChangeLog
+from cohort_analytics import cohort_engine
+from data_structures import AutocompleteIndex, Doctor, HealthMetricsAggregator, classify_severity
+from shards import ShardSet
+from versioning import table_versions
+
+# Entries read per query while catching up
+CATCH_UP_BATCH = 1000
+
+
+class AggregatorReplica:
+    """Applies change_log entries to an aggregator, once each and in seq order per shard"""
+
+    def __init__(self, shards: ShardSet, change_logs: List[ChangeLog], aggregator: HealthMetricsAggregator,
+                 logger: Optional[logging.Logger] = None, autocomplete: Optional[AutocompleteIndex] = None):
+        self.shards = shards
+        self.change_logs = change_logs
+        self.aggregator = aggregator
+        self.autocomplete = autocomplete
+        self.logger = logger or logging.getLogger(__name__)
+        self.applied_seqs = [log.seq_base for log in change_logs]
+        # Last seq per shard the autocomplete index reflects; replay past it only
+        self.autocomplete_seqs = list(self.applied_seqs)
+        self.medications: Dict[int, str] = {}  # treatment_id -> medication counted in autocomplete
+        self._lock = threading.Lock()
+        self._poller = None
+
+    @property
+    def db_ids(self) -> List[int]:
+        return [log.db_id for log in self.change_logs]
+
+    def rebuild(self):
+        """Load the aggregator from the tables"""
+        with self._lock:
+            with self.shards.connections() as conns:
+                self._rebuild(conns)
+
+    def _rebuild(self, conns):
+        # One read transaction per shard: each shard's tables and the seq
+        # they correspond to come from the same snapshot
+        for conn in conns:
+            conn.execute('BEGIN')
+        seqs = [log.max_seq(conn) for log, conn in zip(self.change_logs, conns)]
+        self.aggregator.load(*conns)
+        self._load_autocomplete(conns)
+        for conn in conns:
+            conn.commit()
+        self.applied_seqs = seqs
+        self.autocomplete_seqs = list(seqs)
+
+    def _load_autocomplete(self, conns):
+        """Load the autocomplete index and the medication map inside the
+        caller's read transactions"""
+        if self.autocomplete is None:
+            return
+        self.autocomplete.load(*conns)
+        self.medications = {treatment_id: sys.intern(medication)
+                            for conn in conns
+                            for treatment_id, medication in conn.execute(
+                                "SELECT treatment_id, medication FROM treatment_all WHERE medication IS NOT NULL")}
+
+    def restore(self, path: str) -> bool:
+        """Load the aggregator from the snapshot at path and replay the change
+        logs after it. False when there is no usable snapshot (rebuild instead)."""
+        with self._lock:
+            try:
+                arguments, seqs, db_ids = snapshot.read(path)
+            except snapshot.SnapshotError as e:
+                if os.path.exists(path):
+                    self.logger.warning(f"Aggregator snapshot {path} unusable: {e}")
+                return False
+            usable = db_ids == self.db_ids
+            if usable:
+                with self.shards.connections() as conns:
+                    for seq, log, conn in zip(seqs, self.change_logs, conns):
+                        if not log.refresh_floor(conn) <= seq <= log.max_seq(conn):
+                            usable = False
+            if not usable:
+                self.logger.info(f"Aggregator snapshot {path} at seq {seqs} does not match the database; rebuilding")
+                return False
+            self.aggregator.restore(**arguments)
+            self.applied_seqs = seqs
+            with self.shards.connections() as conns:
+                for conn in conns:
+                    conn.execute('BEGIN')
+                self.autocomplete_seqs = [log.max_seq(conn) for log, conn in zip(self.change_logs, conns)]
+                self._load_autocomplete(conns)
+                for conn in conns:
+                    conn.commit()
+        self.catch_up()
+        return True
+
+    def save_snapshot(self, path: str) -> List[int]:
+        """Write the aggregator to path unless the file is already this current;
+        returns the seqs saved"""
+        with self._lock:
+            seqs, db_ids = list(self.applied_seqs), self.db_ids
+            if snapshot.read_header(path) == (seqs, db_ids):
+                return seqs
+            # Taken with replay paused, so the state is exactly seqs
+            state = self.aggregator.capture()
+        snapshot.write(path, state, seqs, db_ids)
+        return seqs
+
+    def catch_up(self, shard: Optional[int] = None):
+        """Apply the entries committed since the last call, on one shard or all.
+
+        Cheap when nothing changed: one indexed MAX(seq) lookup per shard.
+        """
+        for index in (range(len(self.shards)) if shard is None else (shard,)):
+            log = self.change_logs[index]
+            with self.shards[index].connection() as conn:
+                if log.max_seq(conn) <= self.applied_seqs[index]:
+                    continue
+                with self._lock:
+                    if log.max_seq(conn) > self.applied_seqs[index]:
+                        self._apply_pending(index, conn)
+                    applied = self.applied_seqs[index]
+            log.notify(applied)
+
+    def _apply_pending(self, index: int, conn):
+        log = self.change_logs[index]
+        conn.execute('BEGIN')
+        if self.applied_seqs[index] < log.refresh_floor(conn):
+            conn.commit()
+            self.logger.info("Replica at seq %d on shard %d is behind the change log floor; reloading",
+                             self.applied_seqs[index], index)
+            with self.shards.connections() as conns:
+                self._rebuild(conns)
+            for table in ('health_records', 'treatment'):
+                cohort_engine.invalidate(table)
+            table_versions.bump('users', 'doctors', 'health_records', 'treatment', all_users=True)
+            return
+
+        touched = set()  # (table, user_id) whose version counters move
+        invalidated = {'users': [], 'health_records': [], 'treatment': []}
+        while True:
+            entries = log.changes_since(conn, self.applied_seqs[index], limit=CATCH_UP_BATCH)
+            for entry in entries:
+                # Every shard logs its copy of a doctor change; shard 0's stands for all
+                if entry['table'] != 'doctors' or index == 0:
+                    if entry['seq'] > self.autocomplete_seqs[index]:
+                        self._apply_autocomplete(entry)
+                    self._apply(conn, entry)
+                touched.add((entry['table'], entry['user_id']))
+                # user_ids come from the catalog, so one shard can commit them out of order
+                if entry['table'] in invalidated and (entry['op'] != 'insert' or entry['table'] == 'users'):
+                    invalidated[entry['table']].append(entry['id'])
+                self.applied_seqs[index] = entry['seq']
+            if len(entries) < CATCH_UP_BATCH:
+                break
+        conn.commit()
+
+        # Same order as the write paths: cohort marks before the version bump
+        for table, ids in invalidated.items():
+            if ids:
+                cohort_engine.invalidate(table, ids)
+        for table, user_id in touched:
+            if user_id is None:
+                table_versions.bump(table, all_users=True)
+            else:
+                table_versions.bump(table, user_id=user_id)
+
+    def _apply_autocomplete(self, entry: dict):
+        """Move the entry's text field in the autocomplete index from the
+        replica's current row to the entry's; call before _apply"""
+        if self.autocomplete is None:
+            return
+        table, row_id, data = entry['table'], entry['id'], entry['data']
+        if table == 'health_records':
+            field, new = 'diagnosis', data and data.get('diagnosis')
+            old = self.aggregator.record_diagnosis(entry['user_id'], row_id)
+        elif table == 'treatment':
+            field, new = 'medication', data and data.get('medication')
+            old = self.medications.pop(row_id, None)
+            if new:
+                self.medications[row_id] = sys.intern(new)
+        elif table == 'doctors':
+            field, new = 'specialization', data and data.get('specialization')
+            doctor = self.aggregator.doctor_analytics.doctors.get(row_id)
+            old = doctor.specialization if doctor is not None else None
+        else:
+            return
+        if entry['op'] == 'delete':
+            self.autocomplete.remove(field, old)
+        else:
+            self.autocomplete.replace(field, old, new)
+
+    def _apply(self, conn, entry: dict):
+        table, op, row_id, data = entry['table'], entry['op'], entry['id'], entry['data']
+        aggregator = self.aggregator
+        if table == 'health_records':
+            if op == 'delete':
+                aggregator.remove_health_record(entry['user_id'], row_id)
+            else:
+                aggregator.upsert_health_record(data)
+        elif table == 'treatment':
+            if op == 'delete' or not data.get('follow_up_date'):
+                aggregator.treatment_queue.remove_treatment(row_id)
+                return
+            try:
+                follow_up_date = datetime.fromisoformat(data['follow_up_date'])
+            except ValueError:
+                aggregator.treatment_queue.remove_treatment(row_id)
+                return
+            severity = aggregator.record_severity(entry['user_id'], data['record_id'])
+            if severity is None:
+                # The record's own entry may come later (a compacted insert)
+                row = conn.execute("SELECT diagnosis FROM health_records_all WHERE record_id = ?",
+                                   (data['record_id'],)).fetchone()
+                if row is None:
+                    return
+                severity = classify_severity(row[0] or '')
+            aggregator.treatment_queue.add_treatment(row_id, follow_up_date, severity)
+        elif table == 'doctors':
+            analytics = aggregator.doctor_analytics
+            if op == 'delete':
+                analytics.remove_doctor(row_id)
+            elif row_id in analytics.doctors:
+                analytics.update_doctor(row_id, data.get('name'), data.get('specialization'),
+                                        data.get('contact_number'), data.get('email'))
+            else:
+                analytics.add_doctor(Doctor(row_id, data.get('name'), data.get('specialization') or '',
+                                            data.get('contact_number'), data.get('email')))
+
+    def start_polling(self, interval: float):
+        """Catch up every interval seconds in the background, so change streams
+        wake for writes made by other processes"""
+        if self._poller is not None:
+            return
+
+        def poll():
+            while True:
+                try:
+                    self.catch_up()
+                except Exception as e:
+                    self.logger.warning(f"Replica catch-up failed: {e}")
+                time.sleep(interval)
+
+        self._poller = threading.Thread(target=poll, name='replica-poller', daemon=True)
+        self._poller.start()
+
+    def start_snapshots(self, path: str, interval: float):
+        """Save a snapshot now and every interval seconds after, in the background"""
+        def run():
+            while True:
+                try:
+                    started = time.perf_counter()
+                    seqs = self.save_snapshot(path)
+                    self.logger.debug(f"Aggregator snapshot at seq {seqs} took {time.perf_counter() - started:.3f}s")
+                except Exception as e:
+                    self.logger.warning(f"Aggregator snapshot failed: {e}")
+                time.sleep(interval)
+
+        threading.Thread(target=run, name='aggregator-snapshot', daemon=True).start()
@@ -1,3 +1,5 @@
+import glob
+import os
 import sqlite3
 
 # Connect to database
@@ -9,6 +11,11 @@ with open('phr_database.sql', 'r') as f:
 
 conn.commit()
 
+# The data now lives hot on one shard; rebalance_shards.py spreads it out again
+# and the archive job moves old records back to cold storage
+for path in glob.glob('phr_database.shard*.db*') + glob.glob('phr_database.cold.db*'):
+    os.remove(path)
+
 # Verify data
 cur = conn.cursor()
 print('✅ Database reinitialized successfully!')
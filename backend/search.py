@@ -0,0 +1,171 @@
+"""
+Full-Text Search over Diagnoses, Medications and Procedures
+SQLite FTS5 indexes mirror health_records and treatment through triggers and
+are queried with prefix matching and BM25 ranking. The archive's cold
+database has its own indexes, so archiving moves rows between indexes
+instead of out of search.
+"""
+
+import heapq
+import re
+import sqlite3
+from typing import List, Optional, Sequence
+
+# External-content FTS5 tables: the index stores only tokens, the text stays
+# in the base tables. prefix='2 3' keeps short prefix queries index-only.
+# Created in {schema}; names in trigger bodies resolve to that schema too.
+SCHEMA = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS {schema}.health_records_fts USING fts5(
+        diagnosis,
+        content='health_records', content_rowid='record_id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """,
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS {schema}.treatment_fts USING fts5(
+        medication, procedure,
+        content='treatment', content_rowid='treatment_id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS {schema}.health_records_fts_ai AFTER INSERT ON health_records BEGIN
+        INSERT INTO health_records_fts(rowid, diagnosis) VALUES (new.record_id, new.diagnosis);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS {schema}.health_records_fts_ad AFTER DELETE ON health_records BEGIN
+        INSERT INTO health_records_fts(health_records_fts, rowid, diagnosis)
+        VALUES ('delete', old.record_id, old.diagnosis);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS {schema}.health_records_fts_au AFTER UPDATE OF diagnosis ON health_records BEGIN
+        INSERT INTO health_records_fts(health_records_fts, rowid, diagnosis)
+        VALUES ('delete', old.record_id, old.diagnosis);
+        INSERT INTO health_records_fts(rowid, diagnosis) VALUES (new.record_id, new.diagnosis);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS {schema}.treatment_fts_ai AFTER INSERT ON treatment BEGIN
+        INSERT INTO treatment_fts(rowid, medication, procedure)
+        VALUES (new.treatment_id, new.medication, new.procedure);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS {schema}.treatment_fts_ad AFTER DELETE ON treatment BEGIN
+        INSERT INTO treatment_fts(treatment_fts, rowid, medication, procedure)
+        VALUES ('delete', old.treatment_id, old.medication, old.procedure);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS {schema}.treatment_fts_au AFTER UPDATE OF medication, procedure ON treatment BEGIN
+        INSERT INTO treatment_fts(treatment_fts, rowid, medication, procedure)
+        VALUES ('delete', old.treatment_id, old.medication, old.procedure);
+        INSERT INTO treatment_fts(rowid, medication, procedure)
+        VALUES (new.treatment_id, new.medication, new.procedure);
+    END
+    """,
+]
+
+RECORDS_QUERY = """
+    SELECT 'record' AS type, hr.record_id AS id, hr.record_id, hr.user_id,
+           hr.diagnosis AS title, NULL AS detail, hr.record_date,
+           highlight(health_records_fts, 0, '<mark>', '</mark>') AS highlight,
+           bm25(health_records_fts) AS score
+    FROM {schema}.health_records_fts
+    JOIN {schema}.health_records hr ON hr.record_id = health_records_fts.rowid
+    WHERE health_records_fts MATCH :match {user_filter}
+"""
+
+TREATMENTS_QUERY = """
+    SELECT 'treatment' AS type, t.treatment_id AS id, t.record_id, hr.user_id,
+           t.medication AS title, t.procedure AS detail, hr.record_date,
+           highlight(treatment_fts, 0, '<mark>', '</mark>') AS highlight,
+           bm25(treatment_fts, 2.0, 1.0) AS score
+    FROM {schema}.treatment_fts
+    JOIN {schema}.treatment t ON t.treatment_id = treatment_fts.rowid
+    JOIN {records} hr ON hr.record_id = t.record_id
+    WHERE treatment_fts MATCH :match {user_filter}
+"""
+
+SEARCH_TYPES = ('all', 'records', 'treatments')
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def init_search_schema(conn: sqlite3.Connection, schema: str = 'main') -> bool:
+    """Create FTS tables and sync triggers in schema; backfill indexes created just now.
+
+    Returns False when this SQLite build lacks FTS5.
+    """
+    existing = {row[0] for row in conn.execute(
+        f"SELECT name FROM {schema}.sqlite_master WHERE name IN ('health_records_fts', 'treatment_fts')"
+    )}
+    try:
+        for statement in SCHEMA:
+            conn.execute(statement.format(schema=schema))
+    except sqlite3.OperationalError as e:
+        if 'fts5' in str(e).lower():
+            return False
+        raise
+    for table in ('health_records_fts', 'treatment_fts'):
+        if table not in existing:
+            conn.execute(f"INSERT INTO {schema}.{table}({table}) VALUES ('rebuild')")
+    return True
+
+
+def build_match_query(text: str) -> Optional[str]:
+    """Turn free text into an FTS5 query: every word must match as a prefix.
+
+    Words are quoted so user input can never inject FTS5 syntax.
+    """
+    tokens = _TOKEN_RE.findall(text or '')
+    if not tokens:
+        return None
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def search(conn: sqlite3.Connection, text: str, user_id: Optional[int] = None,
+           search_type: str = 'all', limit: int = 20, offset: int = 0,
+           schemas: Sequence[str] = ('main',)) -> List[dict]:
+    """Ranked search over diagnoses, medications and procedures (best match first).
+
+    schemas are the indexed databases to search; with more than one, a
+    treatment's record is looked up in the health_records_all view, since
+    it can be hot while its record is archived.
+    """
+    match = build_match_query(text)
+    if match is None:
+        return []
+
+    user_filter = 'AND hr.user_id = :user_id' if user_id is not None else ''
+    records = 'health_records_all' if len(schemas) > 1 else 'health_records'
+    parts = []
+    for schema in schemas:
+        if search_type in ('all', 'records'):
+            parts.append(RECORDS_QUERY.format(schema=schema, user_filter=user_filter))
+        if search_type in ('all', 'treatments'):
+            parts.append(TREATMENTS_QUERY.format(schema=schema, records=records, user_filter=user_filter))
+
+    # bm25() is lower-is-better
+    sql = ' UNION ALL '.join(parts) + ' ORDER BY score, id LIMIT :limit OFFSET :offset'
+    cursor = conn.execute(sql, {
+        'match': match,
+        'user_id': user_id,
+        'limit': limit,
+        'offset': offset
+    })
+    return [dict(row) for row in cursor.fetchall()]
+
+
+def merge_results(parts: Sequence[List[dict]], limit: int = 20, offset: int = 0) -> List[dict]:
+    """Merge ranked results of several shards, each searched with offset 0 and
+    limit + offset, into the requested page.
+
+    BM25 weights terms by each shard's own statistics, so the interleaving
+    is approximate; with evenly hashed users the shards' statistics agree.
+    """
+    merged = heapq.merge(*parts, key=lambda result: (result['score'], result['id']))
+    return list(merged)[offset:offset + limit]
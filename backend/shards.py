@@ -0,0 +1,266 @@
+"""
+User-Sharded Storage
+users, health_records and treatment rows live in one of N SQLite files,
+chosen by a jump consistent hash of user_id, so writes for users on
+different shards never wait on the same SQLite writer. doctors is a
+reference table written on the catalog and copied to every shard, which
+keeps the per-user joins local to one file.
+
+Shard 0 is the original database file and also holds the catalog: login
+sessions and the user directory that hands out user_ids (a user's shard is
+a function of the id, so the id has to exist before the row is placed).
+Every other shard is <name>.shard<i>.db next to it. With one shard the
+layout is exactly the single-file database.
+
+Row ids stay unique across shards: shard i allocates record, treatment and
+change log ids from its own range starting at i << SHARD_ID_BITS. Adding
+shards only moves users into the new ones (a property of the jump hash),
+whose ranges lie above every moved id, so moved rows keep their ids;
+rebalance_shards.py renumbers the rows it moves when shrinking.
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from typing import Callable, Iterator, List, Optional, Tuple
+
+# Width of each shard's id range (about 10^12 rows per table per shard)
+SHARD_ID_BITS = 40
+# Tables with per-shard id ranges; users get their ids from the directory
+RANGED_TABLES = ('health_records', 'treatment')
+# Tables created on new shards from the catalog's own definitions
+SHARDED_TABLES = ('users', 'health_records', 'treatment')
+REFERENCE_TABLES = ('doctors',)
+
+CATALOG_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS user_directory (
+        user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        email TEXT NOT NULL UNIQUE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS shard_meta (
+        key TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    )
+    """,
+]
+
+
+class ShardLayoutError(Exception):
+    """The data on disk is spread over a different number of shards"""
+
+
+def jump_hash(key: int, buckets: int) -> int:
+    """Jump consistent hash (Lamping and Veach): going from n to n + 1
+    buckets moves only 1 / (n + 1) of the keys, all into the new bucket"""
+    key &= 0xFFFFFFFFFFFFFFFF
+    b, j = -1, 0
+    while j < buckets:
+        b = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((b + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return b
+
+
+def shard_path(database: str, index: int) -> str:
+    """File of shard index: the database itself for shard 0"""
+    if index == 0:
+        return database
+    root, ext = os.path.splitext(database)
+    return f"{root}.shard{index}{ext}"
+
+
+class ConnectionPool:
+    """Reuses idle connections to one database file.
+
+    Never blocks: when every pooled connection is busy a new one is opened,
+    and connections beyond size are closed on release instead of kept.
+    """
+
+    def __init__(self, connect: Callable[[], sqlite3.Connection], size: int = 8):
+        self.connect = connect
+        self.idle: 'queue.LifoQueue[sqlite3.Connection]' = queue.LifoQueue(maxsize=size)
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """A connection for one unit of work, committed on success and rolled
+        back on error, like `with sqlite3.connect(...) as conn`"""
+        try:
+            conn = self.idle.get_nowait()
+        except queue.Empty:
+            conn = self.connect()
+        try:
+            with conn:
+                yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            try:
+                self.idle.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+
+class Shard:
+    """One database file with its own writer lock and connection pool"""
+
+    def __init__(self, index: int, path: str, connect: Callable[[str], sqlite3.Connection], pool_size: int):
+        self.index = index
+        self.path = path
+        self.id_base = index << SHARD_ID_BITS
+        self.id_limit = (index + 1) << SHARD_ID_BITS
+        self.write_lock = threading.Lock()
+        self.pool = ConnectionPool(lambda: connect(path), pool_size)
+
+    def connection(self):
+        return self.pool.connection()
+
+    def __repr__(self):
+        return f"Shard({self.index}, {self.path!r})"
+
+
+class ShardSet:
+    """Routes rows to shards by user_id and fans queries out to all of them"""
+
+    def __init__(self, database: str, count: int, connect: Callable[[str], sqlite3.Connection],
+                 pool_size: int = 8):
+        if count < 1 or count > 1 << (63 - SHARD_ID_BITS):
+            raise ValueError(f"shard count must be between 1 and {1 << (63 - SHARD_ID_BITS)}")
+        self.database = database
+        self.shards = [Shard(i, shard_path(database, i), connect, pool_size) for i in range(count)]
+        self.catalog = self.shards[0]
+        self._executor = ThreadPoolExecutor(max_workers=count, thread_name_prefix='shard') if count > 1 else None
+
+    def __len__(self):
+        return len(self.shards)
+
+    def __iter__(self):
+        return iter(self.shards)
+
+    def __getitem__(self, index: int) -> Shard:
+        return self.shards[index]
+
+    def for_user(self, user_id) -> Shard:
+        """The shard holding user_id's rows"""
+        if len(self.shards) == 1:
+            return self.catalog
+        return self.shards[jump_hash(int(user_id), len(self.shards))]
+
+    def fan_out(self, fn: Callable[[sqlite3.Connection], object]) -> List[object]:
+        """fn(conn) on every shard, in parallel; results in shard order.
+
+        sqlite3 releases the GIL while a statement runs, so the shards'
+        queries overlap even though fn is Python.
+        """
+        def run(shard: Shard):
+            with shard.connection() as conn:
+                return fn(conn)
+
+        if self._executor is None:
+            return [run(self.catalog)]
+        return list(self._executor.map(run, self.shards))
+
+    def locate(self, sql: str, params=()) -> Tuple[Optional[Shard], Optional[sqlite3.Row]]:
+        """The shard where sql (a lookup by row id) finds a row, and that row.
+
+        With one shard this is the catalog without running the query; the
+        caller's own statements notice a missing row.
+        """
+        if len(self.shards) == 1:
+            return self.catalog, None
+        rows = self.fan_out(lambda conn: conn.execute(sql, params).fetchone())
+        for shard, row in zip(self.shards, rows):
+            if row is not None:
+                return shard, row
+        return None, None
+
+    @contextmanager
+    def connections(self) -> Iterator[List[sqlite3.Connection]]:
+        """One pooled connection per shard, in shard order"""
+        with ExitStack() as stack:
+            yield [stack.enter_context(shard.connection()) for shard in self.shards]
+
+    def init_schema(self, check_layout: bool = True):
+        """Create the catalog tables, then any missing shard files.
+
+        New shards get the catalog's table definitions, their id ranges and
+        a copy of the reference tables. With check_layout, raises
+        ShardLayoutError when users are stored for another shard count
+        (run rebalance_shards.py).
+        """
+        with self.catalog.connection() as conn:
+            for statement in CATALOG_SCHEMA:
+                conn.execute(statement)
+            definitions = dict(conn.execute(
+                f"SELECT name, sql FROM sqlite_master WHERE type = 'table' AND name IN "
+                f"({','.join('?' * len(SHARDED_TABLES + REFERENCE_TABLES))})",
+                SHARDED_TABLES + REFERENCE_TABLES
+            ).fetchall())
+            row = conn.execute("SELECT value FROM shard_meta WHERE key = 'shard_count'").fetchone()
+        stored = row[0] if row else 1
+
+        for shard in self.shards[1:]:
+            with shard.connection() as conn:
+                existing = {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+                if not existing:
+                    # Only settable before the first table; lets maintenance.py vacuum incrementally
+                    conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+                for table in SHARDED_TABLES + REFERENCE_TABLES:
+                    if table not in existing:
+                        conn.execute(definitions[table])
+                for table in RANGED_TABLES:
+                    # AUTOINCREMENT continues from sqlite_sequence, so seeding it starts the range
+                    conn.execute("""
+                        INSERT INTO sqlite_sequence (name, seq)
+                        SELECT ?, ? WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = ?)
+                    """, (table, shard.id_base, table))
+                if 'doctors' not in existing:
+                    conn.commit()  # ATTACH is not allowed inside a transaction
+                    conn.execute("ATTACH DATABASE ? AS catalog", (self.catalog.path,))
+                    conn.execute("INSERT INTO doctors SELECT * FROM catalog.doctors")
+                    conn.commit()
+                    conn.execute("DETACH DATABASE catalog")
+
+        if stored != len(self.shards):
+            if check_layout and any(self.fan_out(lambda conn: conn.execute("SELECT 1 FROM users LIMIT 1").fetchone())):
+                raise ShardLayoutError(
+                    f"users are stored for {stored} shard(s) but {len(self.shards)} are configured; "
+                    f"run rebalance_shards.py --shards {len(self.shards)}")
+            self.set_layout(len(self.shards))
+
+    def set_layout(self, count: int):
+        with self.catalog.connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO shard_meta (key, value) VALUES ('shard_count', ?)", (count,))
+
+    def backfill_directory(self):
+        """Register users created before the directory existed"""
+        users = [row for rows in self.fan_out(lambda conn: conn.execute("SELECT user_id, email FROM users").fetchall())
+                 for row in rows]
+        with self.catalog.connection() as conn:
+            conn.executemany("INSERT OR IGNORE INTO user_directory (user_id, email) VALUES (?, ?)", users)
+
+    def reserve_user_id(self, conn, email: str) -> int:
+        """user_id for a new user with email, inside the caller's catalog
+        write transaction: a fresh id, or the one left behind by a
+        registration that failed before its users row was written.
+
+        Raises sqlite3.IntegrityError when a user already has this email.
+        """
+        row = conn.execute("SELECT user_id FROM user_directory WHERE email = ?", (email,)).fetchone()
+        if row is None:
+            return conn.execute("INSERT INTO user_directory (email) VALUES (?)", (email,)).lastrowid
+        user_id = row[0]
+        with self.for_user(user_id).connection() as user_conn:
+            if user_conn.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,)).fetchone():
+                raise sqlite3.IntegrityError("UNIQUE constraint failed: user_directory.email")
+        return user_id
+
+    def lookup_user_id(self, email: str) -> Optional[int]:
+        with self.catalog.connection() as conn:
+            row = conn.execute("SELECT user_id FROM user_directory WHERE email = ?", (email,)).fetchone()
+        return row[0] if row else None
@@ -0,0 +1,234 @@
+"""
+Aggregator Snapshots
+Saves the HealthMetricsAggregator to one binary file tagged with the change
+log seq it reflects on each shard, so a restart loads the file and replays
+only the entries after those seqs instead of rebuilding from every table.
+
+The file is a header, a section table and flat little-endian columns, each
+aligned to 8 bytes: the timelines of all users laid end to end (with
+per-user offsets), the doctors' running totals and the treatment queue.
+Strings are one UTF-8 blob plus offsets. Loading maps the file and copies
+each column out with one memcpy; there is no per-record parsing.
+
+A snapshot is only used for the databases it was taken from (each shard's
+change_log db_id), with the same diagnosis severity rules, and while every
+change log still holds all entries after its seq.
+"""
+
+import mmap
+import os
+import struct
+import sys
+from array import array
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from data_structures import DiagnosisDictionary, PatientTimeline
+
+MAGIC = b'PHRAGGS1'
+FORMAT_VERSION = 3
+# magic, format version, section count
+HEADER = struct.Struct('<8sII')
+# name, typecode, offset, length in bytes
+SECTION = struct.Struct('<32s1s7xqq')
+
+# Doctor row fields after doctor_id, as DoctorAnalytics.capture() lists them
+DOCTOR_FIELDS = ('name', 'specialization', 'contact_number', 'email')
+
+_EPOCH = datetime.min
+_MICROSECOND = timedelta(microseconds=1)
+
+
+class SnapshotError(Exception):
+    """The file is missing, truncated, or from another format version"""
+
+
+def _native(column: array) -> array:
+    # Columns are stored little-endian
+    if sys.byteorder != 'little':
+        column = array(column.typecode, column)
+        column.byteswap()
+    return column
+
+
+def _pack_strings(texts: List[str]) -> Tuple[array, array]:
+    encoded = [text.encode('utf-8') for text in texts]
+    offsets = array('q', [0])
+    for text in encoded:
+        offsets.append(offsets[-1] + len(text))
+    return array('B', b''.join(encoded)), offsets
+
+
+def _unpack_strings(blob: array, offsets: array) -> List[str]:
+    data = blob.tobytes()
+    return [data[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(offsets) - 1)]
+
+
+def _columns(state: dict) -> Dict[str, array]:
+    """Flatten aggregator.capture() into named columns"""
+    columns: Dict[str, array] = {}
+    texts = state['diagnoses']
+    columns['diagnosis_text'], columns['diagnosis_text_offsets'] = _pack_strings(texts)
+    dictionary = DiagnosisDictionary()
+    columns['diagnosis_severity'] = array('B', (dictionary.severity_codes[dictionary.encode(text)]
+                                                for text in texts))
+
+    user_ids, offsets = array('q'), array('q', [0])
+    record_ids, doctor_ids = array('q'), array('q')
+    diagnosis_ids, date_ordinals, severity_codes = array('I'), array('I'), array('B')
+    file_record_ids, file_paths, file_offsets = array('q'), [], array('q', [0])
+    for user_id, timeline in sorted(state['timelines'].items()):
+        user_ids.append(user_id)
+        record_ids.extend(timeline.record_ids)
+        doctor_ids.extend(timeline.doctor_ids)
+        diagnosis_ids.extend(timeline.diagnosis_ids)
+        date_ordinals.extend(timeline.date_ordinals)
+        severity_codes.extend(timeline.severity_codes)
+        offsets.append(len(record_ids))
+        for record_id, path in timeline.file_paths.items():
+            file_record_ids.append(record_id)
+            file_paths.append(path)
+        file_offsets.append(len(file_record_ids))
+    columns.update({
+        'user_ids': user_ids, 'user_offsets': offsets, 'record_ids': record_ids,
+        'doctor_ids': doctor_ids, 'diagnosis_ids': diagnosis_ids,
+        'date_ordinals': date_ordinals, 'severity_codes': severity_codes,
+        'file_record_ids': file_record_ids, 'file_offsets': file_offsets,
+    })
+    columns['file_paths'], columns['file_path_offsets'] = _pack_strings(file_paths)
+
+    doctors = state['doctors']
+    columns['doctor_rows'] = array('q', (row[0] for row in doctors['doctors']))
+    for i, field in enumerate(DOCTOR_FIELDS, start=1):
+        values = [row[i] for row in doctors['doctors']]
+        columns[f'doctor_{field}'], columns[f'doctor_{field}_offsets'] = _pack_strings(
+            [value or '' for value in values])
+        # NULL and '' pack alike; the mask tells them apart again on restore
+        columns[f'doctor_{field}_null'] = array('B', (value is None for value in values))
+    columns['patient_doctor'] = array('q', (row[0] for row in doctors['patients']))
+    columns['patient_user'] = array('q', (row[1] for row in doctors['patients']))
+    columns['patient_count'] = array('q', (row[2] for row in doctors['patients']))
+    columns['total_doctor'] = array('q', (row[0] for row in doctors['totals']))
+    columns['total_records'] = array('q', (row[1] for row in doctors['totals']))
+    columns['total_severity'] = array('d', (row[2] for row in doctors['totals']))
+
+    treatments = state['treatments']
+    columns['treatment_ids'] = array('q', (entry[2] for entry in treatments))
+    columns['treatment_priority'] = array('q', (entry[0] for entry in treatments))
+    columns['treatment_due_us'] = array('q', ((entry[1] - _EPOCH) // _MICROSECOND for entry in treatments))
+    return columns
+
+
+def write(path: str, state: dict, seqs: List[int], db_ids: List[int]):
+    """Write aggregator.capture() taken at seqs (one per shard); the file is
+    replaced atomically"""
+    columns = {'shard_seqs': array('q', seqs), 'shard_db_ids': array('q', db_ids)}
+    columns.update(_columns(state))
+    table, offset = [], HEADER.size + SECTION.size * len(columns)
+    for name, column in columns.items():
+        offset += -offset % 8
+        table.append((name, column, offset))
+        offset += len(column) * column.itemsize
+
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(columns)))
+        for name, column, offset in table:
+            f.write(SECTION.pack(name.encode('ascii'), column.typecode.encode('ascii'), offset,
+                                 len(column) * column.itemsize))
+        for name, column, offset in table:
+            f.write(b'\0' * (offset - f.tell()))
+            _native(column).tofile(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+
+
+def _sections(mapped) -> Dict[str, Tuple[str, int, int]]:
+    magic, version, count = HEADER.unpack_from(mapped, 0)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise SnapshotError(f"not a version {FORMAT_VERSION} aggregator snapshot")
+    sections = {}
+    for i in range(count):
+        name, typecode, offset, length = SECTION.unpack_from(mapped, HEADER.size + i * SECTION.size)
+        if offset + length > len(mapped):
+            raise SnapshotError("truncated snapshot")
+        sections[name.rstrip(b'\0').decode('ascii')] = (typecode.decode('ascii'), offset, length)
+    return sections
+
+
+def _column(view: memoryview, section: Tuple[str, int, int]) -> array:
+    typecode, offset, length = section
+    column = array(typecode)
+    column.frombytes(view[offset:offset + length])
+    return _native(column)
+
+
+def _open(path: str):
+    with open(path, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def read_header(path: str) -> Optional[Tuple[List[int], List[int]]]:
+    """(seqs, db_ids) of the snapshot at path, or None when there is no usable one"""
+    try:
+        with _open(path) as mapped, memoryview(mapped) as view:
+            sections = _sections(mapped)
+            return list(_column(view, sections['shard_seqs'])), list(_column(view, sections['shard_db_ids']))
+    except (OSError, ValueError, KeyError, struct.error, SnapshotError):
+        return None
+
+
+def read(path: str) -> Tuple[dict, List[int], List[int]]:
+    """Load a snapshot; returns (HealthMetricsAggregator.restore arguments, seqs, db_ids)"""
+    try:
+        with _open(path) as mapped, memoryview(mapped) as view:
+            columns = {name: _column(view, section) for name, section in _sections(mapped).items()}
+    except (OSError, ValueError, struct.error) as e:
+        raise SnapshotError(str(e)) from e
+    try:
+        return _restore_arguments(columns), list(columns['shard_seqs']), list(columns['shard_db_ids'])
+    except (KeyError, IndexError) as e:
+        raise SnapshotError(f"incomplete snapshot: {e}") from e
+
+
+def _restore_arguments(columns: Dict[str, array]) -> dict:
+    dictionary = DiagnosisDictionary()
+    for text in _unpack_strings(columns['diagnosis_text'], columns['diagnosis_text_offsets']):
+        dictionary.encode(text)
+    if dictionary.severity_codes != columns['diagnosis_severity']:
+        # Severity rules changed since the snapshot: its stored codes are stale
+        raise SnapshotError("diagnosis severity rules changed")
+
+    file_record_ids = columns['file_record_ids']
+    file_paths = _unpack_strings(columns['file_paths'], columns['file_path_offsets'])
+    file_offsets = columns['file_offsets']
+    offsets = columns['user_offsets']
+    timelines: Dict[int, PatientTimeline] = {}
+    for i, user_id in enumerate(columns['user_ids']):
+        start, end = offsets[i], offsets[i + 1]
+        timeline = PatientTimeline(dictionary)
+        timeline.record_ids = columns['record_ids'][start:end]
+        timeline.doctor_ids = columns['doctor_ids'][start:end]
+        timeline.diagnosis_ids = columns['diagnosis_ids'][start:end]
+        timeline.date_ordinals = columns['date_ordinals'][start:end]
+        timeline.severity_codes = columns['severity_codes'][start:end]
+        timeline.severity_counts = [timeline.severity_codes.count(code)
+                                    for code in range(len(timeline.severity_counts))]
+        start, end = file_offsets[i], file_offsets[i + 1]
+        if end > start:
+            timeline.file_paths = dict(zip(file_record_ids[start:end], file_paths[start:end]))
+        timelines[user_id] = timeline
+
+    fields = [[None if null else value for value, null in zip(
+                  _unpack_strings(columns[f'doctor_{field}'], columns[f'doctor_{field}_offsets']),
+                  columns[f'doctor_{field}_null'])]
+              for field in DOCTOR_FIELDS]
+    doctors = {
+        'doctors': list(zip(columns['doctor_rows'], *fields)),
+        'patients': zip(columns['patient_doctor'], columns['patient_user'], columns['patient_count']),
+        'totals': zip(columns['total_doctor'], columns['total_records'], columns['total_severity']),
+    }
+    treatments = [(priority, _EPOCH + due * _MICROSECOND, treatment_id) for treatment_id, priority, due
+                  in zip(columns['treatment_ids'], columns['treatment_priority'], columns['treatment_due_us'])]
+    return {'diagnoses': dictionary, 'timelines': timelines, 'doctors': doctors, 'treatments': treatments}
@@ -0,0 +1,61 @@
+"""
+Table Version Counters for Conditional GET
+Every write path bumps the counters of the tables (and users) it touched, so
+read endpoints can derive ETag/Last-Modified validators without querying SQLite
+"""
+
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Optional, Tuple
+
+
+class TableVersions:
+    """Monotonic per-table and per-user version counters"""
+
+    def __init__(self):
+        # Restarting the process may have missed out-of-band writes
+        # (e.g. reset_db.py), so validators from a previous boot never match
+        self.boot_id = uuid.uuid4().hex[:8]
+        self.table_versions: Dict[str, int] = {}
+        self.user_versions: Dict[int, int] = {}
+        self.all_users_version = 0
+        self.modified_at: Dict[object, float] = {}
+        self.boot_time = time.time()
+        self._lock = threading.Lock()
+
+    def bump(self, *tables: str, user_id: Optional[int] = None, all_users: bool = False):
+        """Record a committed write to tables, scoped to one user or to every user"""
+        now = time.time()
+        with self._lock:
+            for table in tables:
+                self.table_versions[table] = self.table_versions.get(table, 0) + 1
+                self.modified_at[table] = now
+            if all_users:
+                self.all_users_version += 1
+                self.modified_at['all_users'] = now
+            elif user_id is not None:
+                user_id = int(user_id)
+                self.user_versions[user_id] = self.user_versions.get(user_id, 0) + 1
+                self.modified_at[('user', user_id)] = now
+
+    def validators(self, tables: Iterable[str] = (), user_id: Optional[int] = None) -> Tuple[str, datetime]:
+        """Return (etag, last_modified) for a view over tables, optionally per-user"""
+        tables = sorted(tables)
+        keys = list(tables)
+        with self._lock:
+            parts = [f"{table}.{self.table_versions.get(table, 0)}" for table in tables]
+            if user_id is not None:
+                user_id = int(user_id)
+                parts.append(f"u{user_id}.{self.user_versions.get(user_id, 0)}.{self.all_users_version}")
+                keys += [('user', user_id), 'all_users']
+            modified = max([self.modified_at.get(key, self.boot_time) for key in keys] or [self.boot_time])
+
+        etag = f"{self.boot_id}-" + '-'.join(parts)
+        last_modified = datetime.fromtimestamp(int(modified), tz=timezone.utc)
+        return etag, last_modified
+
+
+# Global instance for the application
+table_versions = TableVersions()
@@ -10,6 +10,7 @@ import Treatments from './pages/Treatments';
 import Chatbot from './pages/Chatbot';
 import APITest from './pages/APITest';
 import { ThemeProvider } from './context/ThemeContext';
+import { apiService } from './services/api';
 import './modern-ui.css';
 import './light-theme.css';
 
@@ -40,6 +41,8 @@ function App() {
   };
 
   const handleLogout = () => {
+    // Revoke the server-side session token
+    apiService.logout();
     setUser(null);
     // Clear user data from localStorage
     localStorage.removeItem('user');
@@ -1,5 +1,6 @@
 import React, { useState } from 'react';
 import { apiService } from '../services/api';
+import useAutocomplete from '../hooks/useAutocomplete';
 
 const AddDoctorModal = ({ isOpen, onClose, onSuccess }) => {
   const [formData, setFormData] = useState({
@@ -10,6 +11,7 @@ const AddDoctorModal = ({ isOpen, onClose, onSuccess }) => {
   });
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState('');
+  const specializationSuggestions = useAutocomplete('specialization', formData.specialization);
 
   const handleSubmit = async (e) => {
     e.preventDefault();
@@ -81,10 +83,17 @@ const AddDoctorModal = ({ isOpen, onClose, onSuccess }) => {
               type="text"
               className="neo-input"
               name="specialization"
+              list="specialization-suggestions"
+              autoComplete="off"
               value={formData.specialization}
               onChange={handleChange}
               placeholder="e.g., Cardiologist, General Practice, etc."
             />
+            <datalist id="specialization-suggestions">
+              {specializationSuggestions.map(suggestion => (
+                <option key={suggestion} value={suggestion} />
+              ))}
+            </datalist>
           </div>
 
           <div className="form-group">
@@ -1,5 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import { apiService } from '../services/api';
+import useAutocomplete from '../hooks/useAutocomplete';
 
 const AddRecordModal = ({ isOpen, onClose, onSuccess, user }) => {
   const [formData, setFormData] = useState({
@@ -11,6 +12,7 @@ const AddRecordModal = ({ isOpen, onClose, onSuccess, user }) => {
   const [doctors, setDoctors] = useState([]);
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState('');
+  const diagnosisSuggestions = useAutocomplete('diagnosis', formData.diagnosis);
 
   useEffect(() => {
     const fetchDoctors = async () => {
@@ -90,11 +92,18 @@ const AddRecordModal = ({ isOpen, onClose, onSuccess, user }) => {
               type="text"
               className="neo-input"
               name="diagnosis"
+              list="diagnosis-suggestions"
+              autoComplete="off"
               value={formData.diagnosis}
               onChange={handleChange}
               required
               placeholder="Enter diagnosis or condition"
             />
+            <datalist id="diagnosis-suggestions">
+              {diagnosisSuggestions.map(suggestion => (
+                <option key={suggestion} value={suggestion} />
+              ))}
+            </datalist>
           </div>
 
           <div className="form-group">
@@ -1,5 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import { apiService } from '../services/api';
+import useAutocomplete from '../hooks/useAutocomplete';
 
 const AddTreatmentModal = ({ isOpen, onClose, onSuccess, user }) => {
   const [formData, setFormData] = useState({
@@ -11,6 +12,7 @@ const AddTreatmentModal = ({ isOpen, onClose, onSuccess, user }) => {
   const [userRecords, setUserRecords] = useState([]);
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState('');
+  const medicationSuggestions = useAutocomplete('medication', formData.medication);
 
   useEffect(() => {
     const fetchUserRecords = async () => {
@@ -121,11 +123,18 @@ const AddTreatmentModal = ({ isOpen, onClose, onSuccess, user }) => {
               type="text"
               className="neo-input"
               name="medication"
+              list="medication-suggestions"
+              autoComplete="off"
               value={formData.medication}
               onChange={handleChange}
               required
               placeholder="Enter medication name and dosage"
             />
+            <datalist id="medication-suggestions">
+              {medicationSuggestions.map(suggestion => (
+                <option key={suggestion} value={suggestion} />
+              ))}
+            </datalist>
           </div>
 
           <div className="form-group">
@@ -0,0 +1,39 @@
+import { useState, useEffect } from 'react';
+import { apiService } from '../services/api';
+
+// Debounced prefix suggestions for a free-text field (diagnosis, medication, specialization)
+const useAutocomplete = (field, value, delay = 150) => {
+  const [suggestions, setSuggestions] = useState([]);
+
+  useEffect(() => {
+    const prefix = (value || '').trim();
+    if (!prefix) {
+      setSuggestions([]);
+      return undefined;
+    }
+
+    let cancelled = false;
+    const timer = setTimeout(async () => {
+      try {
+        const results = await apiService.autocomplete(field, prefix);
+        if (!cancelled) {
+          setSuggestions(results.map(suggestion => suggestion.text));
+        }
+      } catch (error) {
+        // Suggestions are optional; keep the input usable without them
+        if (!cancelled) {
+          setSuggestions([]);
+        }
+      }
+    }, delay);
+
+    return () => {
+      cancelled = true;
+      clearTimeout(timer);
+    };
+  }, [field, value, delay]);
+
+  return suggestions;
+};
+
+export default useAutocomplete;
@@ -0,0 +1,53 @@
+import { useEffect, useRef } from 'react';
+import { apiService, invalidateCache } from '../services/api';
+
+// Apply a single change-log entry to a list of rows keyed by idField
+export const applyChange = (rows, idField, change) => {
+  if (change.op === 'delete') {
+    return rows.filter(row => row[idField] !== change.id);
+  }
+  const index = rows.findIndex(row => row[idField] === change.id);
+  if (index === -1) {
+    return [...rows, change.data];
+  }
+  const next = rows.slice();
+  next[index] = { ...rows[index], ...change.data };
+  return next;
+};
+
+// Follow the backend change log over Server-Sent Events: one user's changes
+// with feed.userId, everyone's without, starting at the feed.since cursor
+// returned with the data being kept current (or now). A null feed is off.
+// EventSource reconnects on its own and resumes from the last seen cursor;
+// onResync fires when that cursor has been compacted away and data must be refetched.
+// Changes made elsewhere also expire the matching entries in the API query cache.
+const useChangeStream = (feed, onChange, onResync) => {
+  const handlers = useRef({ onChange, onResync });
+  handlers.current = { onChange, onResync };
+  const enabled = Boolean(feed);
+  const userId = feed?.userId;
+  const since = feed?.since;
+
+  useEffect(() => {
+    if (!enabled || typeof EventSource === 'undefined') {
+      return undefined;
+    }
+
+    const source = new EventSource(apiService.changeStreamUrl(userId, since));
+    source.addEventListener('change', (event) => {
+      const change = JSON.parse(event.data);
+      invalidateCache(change.table);
+      handlers.current.onChange(change);
+    });
+    source.addEventListener('resync', () => {
+      invalidateCache();
+      if (handlers.current.onResync) {
+        handlers.current.onResync();
+      }
+    });
+
+    return () => source.close();
+  }, [enabled, userId, since]);
+};
+
+export default useChangeStream;
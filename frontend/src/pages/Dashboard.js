@@ -1,7 +1,16 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useCallback } from 'react';
 import Navbar from '../components/Navbar';
 import { apiService } from '../services/api';
 import HealthInsights from '../components/HealthInsights';
+import useChangeStream, { applyChange } from '../hooks/useChangeStream';
+
+// Change-log table -> [state key, id field]
+const CHANGE_TARGETS = {
+  users: ['users', 'user_id'],
+  doctors: ['doctors', 'doctor_id'],
+  health_records: ['healthRecords', 'record_id'],
+  treatment: ['treatments', 'treatment_id']
+};
 
 const Dashboard = ({ user, onLogout }) => {
   const [data, setData] = useState({
@@ -10,37 +19,43 @@ const Dashboard = ({ user, onLogout }) => {
     healthRecords: [],
     treatments: []
   });
+  const [cursor, setCursor] = useState(undefined);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState('');
 
-  useEffect(() => {
-    const fetchData = async () => {
-      try {
-        setLoading(true);
-        const [users, doctors, healthRecords, treatments] = await Promise.all([
-          apiService.getUsers(),
-          apiService.getDoctors(),
-          apiService.getHealthRecords(),
-          apiService.getTreatments()
-        ]);
-
-        setData({
-          users,
-          doctors,
-          healthRecords,
-          treatments
-        });
-      } catch (err) {
-        setError('Failed to load dashboard data');
-        console.error('Dashboard data fetch error:', err);
-      } finally {
-        setLoading(false);
-      }
-    };
+  const fetchData = useCallback(async () => {
+    try {
+      setLoading(true);
+      const { users, doctors, healthRecords, treatments, cursor } = await apiService.getSystemOverview();
 
-    fetchData();
+      setData({
+        users,
+        doctors,
+        healthRecords,
+        treatments
+      });
+      setCursor(cursor);
+    } catch (err) {
+      setError('Failed to load dashboard data');
+      console.error('Dashboard data fetch error:', err);
+    } finally {
+      setLoading(false);
+    }
   }, []);
 
+  useEffect(() => {
+    fetchData();
+  }, [fetchData]);
+
+  // Apply live changes instead of reloading every table. The totals cover
+  // every user, so follow the unfiltered feed from where the fetch left off.
+  useChangeStream(user && !loading ? { since: cursor } : null, (change) => {
+    const target = CHANGE_TARGETS[change.table];
+    if (!target) return;
+    const [key, idField] = target;
+    setData(prev => ({ ...prev, [key]: applyChange(prev[key], idField, change) }));
+  }, fetchData);
+
   const formatDate = (dateString) => {
     return new Date(dateString).toLocaleDateString();
   };
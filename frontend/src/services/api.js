@@ -20,6 +20,15 @@ api.get('/')
   .then(response => console.log('✅ Backend connection successful:', response.data))
   .catch(error => console.error('❌ Backend connection failed:', error.message));
 
+// Attach the session token issued by /login, if any
+api.interceptors.request.use((config) => {
+  const token = localStorage.getItem('token');
+  if (token) {
+    config.headers.Authorization = `Bearer ${token}`;
+  }
+  return config;
+});
+
 // Add response interceptor for better error handling
 api.interceptors.response.use(
   (response) => {
@@ -43,47 +52,169 @@ api.interceptors.response.use(
   }
 );
 
+// Query cache: concurrent GETs for the same URL share one request, fresh
+// entries are served without a round trip, and expired entries are
+// revalidated with If-None-Match so an unchanged table costs a bodiless 304.
+// Cached data is shared between callers and must be treated as read-only.
+// Each entry also keeps the X-Change-Cursor sent with it: the change stream
+// position from which nothing in that data can have been missed.
+const CACHE_TTL_MS = [
+  [/^\/users\/\d+\/(dashboard|health_records|treatments)/, 10000],
+  [/^\/(users|doctors)$/, 60000],
+  [/^\/(health_records|treatment)$/, 15000],
+];
+const DEFAULT_CACHE_TTL_MS = 10000;
+
+// GET paths to invalidate after a successful write to a table; the per-user
+// dashboard joins records, treatments and doctors, so it follows all three,
+// and a user's treatment list is picked by their records.
+// Deleting a doctor also deletes their health records and treatments.
+const CACHE_DEPENDENTS = {
+  users: [/^\/users/],
+  doctors: [/^\/doctors/, /^\/health_records/, /^\/treatment/, /^\/users\/\d+\/(dashboard|health_records|treatments)/],
+  health_records: [/^\/health_records/, /^\/treatment/, /^\/users\/\d+\/(dashboard|health_records|treatments)/],
+  treatment: [/^\/treatment/, /^\/users\/\d+\/(dashboard|treatments)/],
+};
+
+const queryCache = new Map();  // key -> { path, data, cursor, etag, expiresAt, promise }
+
+const cacheTtl = (path) => {
+  const match = CACHE_TTL_MS.find(([pattern]) => pattern.test(path));
+  return match ? match[1] : DEFAULT_CACHE_TTL_MS;
+};
+
+// Resolves to { data, cursor }
+const cachedFetch = (path, params) => {
+  const key = params ? `${path}?${new URLSearchParams(params).toString()}` : path;
+  const entry = queryCache.get(key);
+  if (entry?.promise) {
+    return entry.promise;
+  }
+  if (entry && entry.expiresAt > Date.now()) {
+    return Promise.resolve({ data: entry.data, cursor: entry.cursor });
+  }
+
+  const promise = api.get(path, {
+    params,
+    headers: entry?.etag ? { 'If-None-Match': entry.etag } : {},
+    validateStatus: (status) => (status >= 200 && status < 300) || status === 304,
+  }).then((response) => {
+    const data = response.status === 304 ? entry.data : response.data;
+    const cursor = response.headers['x-change-cursor'];
+    // A write that landed while this request was in flight replaced the
+    // entry; keep the answer for this caller but don't cache it
+    if (queryCache.get(key)?.promise === promise) {
+      queryCache.set(key, {
+        path,
+        data,
+        cursor,
+        etag: response.headers.etag,
+        expiresAt: Date.now() + cacheTtl(path),
+      });
+    }
+    return { data, cursor };
+  }, (error) => {
+    if (queryCache.get(key)?.promise === promise) {
+      queryCache.delete(key);
+    }
+    throw error;
+  });
+  queryCache.set(key, { ...entry, path, promise });
+  return promise;
+};
+
+const cachedGet = (path, params) => cachedFetch(path, params).then(result => result.data);
+
+// Earliest of several change cursors (comma-separated seqs, one per shard),
+// so a stream started from it misses nothing in any of their data
+const earliestCursor = (cursors) => {
+  if (cursors.some(cursor => !cursor)) {
+    return undefined;
+  }
+  const seqs = cursors.map(cursor => cursor.split(',').map(Number));
+  if (seqs.some(parts => parts.length !== seqs[0].length)) {
+    return undefined;
+  }
+  return seqs[0].map((_, index) => Math.min(...seqs.map(parts => parts[index]))).join(',');
+};
+
+// Expire cached GETs that depend on table (or every entry when table is
+// omitted). ETags are kept, so unchanged data still revalidates as a 304.
+export const invalidateCache = (table) => {
+  const patterns = table ? CACHE_DEPENDENTS[table] || [] : null;
+  queryCache.forEach((entry, key) => {
+    if (patterns && !patterns.some(pattern => pattern.test(entry.path))) {
+      return;
+    }
+    if (entry.promise) {
+      queryCache.delete(key);
+    } else {
+      entry.expiresAt = 0;
+    }
+  });
+};
+
+// Successful writes invalidate the tables they touch
+api.interceptors.response.use((response) => {
+  const method = response.config?.method;
+  if (method === 'post' || method === 'put' || method === 'delete') {
+    const table = (response.config.url || '').split('/')[1];
+    if (CACHE_DEPENDENTS[table]) {
+      invalidateCache(table);
+    }
+  }
+  return response;
+});
+
 // API functions to interact with your Flask backend
 export const apiService = {
   // Get all users
   getUsers: async () => {
     try {
-      const response = await api.get('/users');
-      return response.data;
+      return await cachedGet('/users');
     } catch (error) {
       console.error('Error fetching users:', error);
       throw new Error(`Failed to fetch users: ${error.response?.data?.message || error.message}`);
     }
   },
 
+  // Every user, doctor, health record and treatment, with the change cursor
+  // to follow the unfiltered change stream from
+  getSystemOverview: async () => {
+    try {
+      const results = await Promise.all(
+        ['/users', '/doctors', '/health_records', '/treatment'].map(path => cachedFetch(path))
+      );
+      const [users, doctors, healthRecords, treatments] = results.map(result => result.data);
+      return { users, doctors, healthRecords, treatments, cursor: earliestCursor(results.map(result => result.cursor)) };
+    } catch (error) {
+      throw new Error('Failed to fetch system overview');
+    }
+  },
+
   // Get all doctors
   getDoctors: async () => {
     try {
-      const response = await api.get('/doctors');
-      return response.data;
+      return await cachedGet('/doctors');
     } catch (error) {
       throw new Error('Failed to fetch doctors');
     }
   },
 
+  // Get the pre-joined dashboard view for a user (records, treatments, doctors, follow-ups)
+  getUserDashboard: async (userId, recent = 10) => {
+    try {
+      return await cachedGet(`/users/${userId}/dashboard`, { recent });
+    } catch (error) {
+      throw new Error('Failed to fetch dashboard');
+    }
+  },
+
   // Get doctors visited by a specific user
   getDoctorsVisitedByUser: async (userId) => {
     try {
-      const [doctors, records] = await Promise.all([
-        api.get('/doctors'),
-        api.get('/health_records')
-      ]);
-      
-      // Get unique doctor IDs from user's health records
-      const userRecords = records.data.filter(record => record.user_id === userId);
-      const visitedDoctorIds = [...new Set(userRecords.map(record => record.doctor_id))];
-      
-      // Filter doctors to only show visited ones
-      const visitedDoctors = doctors.data.filter(doctor => 
-        visitedDoctorIds.includes(doctor.doctor_id)
-      );
-      
-      return visitedDoctors;
+      const dashboard = await cachedGet(`/users/${userId}/dashboard`, { recent: 0 });
+      return dashboard.visited_doctors;
     } catch (error) {
       throw new Error('Failed to fetch visited doctors');
     }
@@ -92,23 +223,16 @@ export const apiService = {
   // Get all health records
   getHealthRecords: async () => {
     try {
-      const response = await api.get('/health_records');
-      return response.data;
+      return await cachedGet('/health_records');
     } catch (error) {
       throw new Error('Failed to fetch health records');
     }
   },
 
-  // Get health records for a specific user
+  // Get health records for a specific user, most recent first
   getUserHealthRecords: async (userId) => {
     try {
-      const response = await api.get('/health_records');
-      const userRecords = response.data.filter(record => record.user_id === userId);
-      
-      // Sort by date (most recent first)
-      userRecords.sort((a, b) => new Date(b.record_date) - new Date(a.record_date));
-      
-      return userRecords;
+      return await cachedGet(`/users/${userId}/health_records`);
     } catch (error) {
       throw new Error('Failed to fetch user health records');
     }
@@ -117,8 +241,7 @@ export const apiService = {
   // Get all treatments
   getTreatments: async () => {
     try {
-      const response = await api.get('/treatment');
-      return response.data;
+      return await cachedGet('/treatment');
     } catch (error) {
       throw new Error('Failed to fetch treatments');
     }
@@ -127,21 +250,7 @@ export const apiService = {
   // Get treatments for a specific user
   getUserTreatments: async (userId) => {
     try {
-      const [treatments, records] = await Promise.all([
-        api.get('/treatment'),
-        api.get('/health_records')
-      ]);
-      
-      // Get user's health record IDs
-      const userRecords = records.data.filter(record => record.user_id === userId);
-      const userRecordIds = userRecords.map(record => record.record_id);
-      
-      // Filter treatments to only show user's treatments
-      const userTreatments = treatments.data.filter(treatment => 
-        userRecordIds.includes(treatment.record_id)
-      );
-      
-      return userTreatments;
+      return await cachedGet(`/users/${userId}/treatments`);
     } catch (error) {
       throw new Error('Failed to fetch user treatments');
     }
@@ -150,69 +259,87 @@ export const apiService = {
   // Get treatment history with related record info for a user
   getUserTreatmentHistory: async (userId) => {
     try {
-      const [treatments, records, doctors] = await Promise.all([
-        api.get('/treatment'),
-        api.get('/health_records'),
-        api.get('/doctors')
-      ]);
-      
-      // Get user's health records
-      const userRecords = records.data.filter(record => record.user_id === userId);
-      const userRecordIds = userRecords.map(record => record.record_id);
-      
-      // Get user's treatments with related record info
-      const userTreatments = treatments.data
-        .filter(treatment => userRecordIds.includes(treatment.record_id))
-        .map(treatment => {
-          const relatedRecord = userRecords.find(record => record.record_id === treatment.record_id);
-          const doctor = doctors.data.find(doc => doc.doctor_id === relatedRecord?.doctor_id);
-          
-          return {
-            ...treatment,
-            diagnosis: relatedRecord?.diagnosis,
-            record_date: relatedRecord?.record_date,
-            doctor_name: doctor?.name || 'Unknown Doctor',
-            doctor_specialization: doctor?.specialization
-          };
-        });
-      
-      // Sort by record date (most recent first)
-      userTreatments.sort((a, b) => new Date(b.record_date) - new Date(a.record_date));
-      
-      return userTreatments;
+      // Joined and sorted (most recent record first) by the backend
+      const dashboard = await cachedGet(`/users/${userId}/dashboard`, { recent: 0 });
+      return dashboard.treatment_history;
     } catch (error) {
       throw new Error('Failed to fetch user treatment history');
     }
   },
 
-  // Login function - validates user credentials
+  // Full-text search over diagnoses, medications and procedures (type: all | records | treatments)
+  searchHealthData: async (query, userId, { type = 'all', limit = 20, offset = 0 } = {}) => {
+    try {
+      const response = await api.get('/search', {
+        params: { q: query, user_id: userId, type, limit, offset }
+      });
+      return response.data;
+    } catch (error) {
+      throw new Error(error.response?.data?.message || 'Failed to search health data');
+    }
+  },
+
+  // Prefix suggestions for diagnosis, medication or specialization, most frequent first
+  autocomplete: async (field, prefix, limit = 8) => {
+    try {
+      const response = await api.get('/autocomplete', { params: { field, q: prefix, limit } });
+      return response.data.suggestions;
+    } catch (error) {
+      throw new Error('Failed to fetch suggestions');
+    }
+  },
+
+  // Least-busy doctors by live patient load, optionally within one specialization
+  recommendDoctors: async (specialization, k = 3) => {
+    try {
+      const response = await api.get('/doctors/recommend', { params: { specialization, k } });
+      return response.data.doctors;
+    } catch (error) {
+      throw new Error('Failed to fetch doctor recommendations');
+    }
+  },
+
+  // Server-Sent Events URL for a user's change feed, or everyone's without
+  // userId; since is a change cursor (EventSource cannot send headers)
+  changeStreamUrl: (userId, since) => {
+    const params = new URLSearchParams();
+    if (userId) params.set('user_id', userId);
+    if (since !== undefined) params.set('since', since);
+    return `${API_BASE_URL}/changes/stream?${params.toString()}`;
+  },
+
+  // Login function - credentials are verified by the backend
   login: async (email, password) => {
     try {
       console.log('🔐 Login attempt:', { email, password: '***' });
-      const response = await api.get('/users');
-      console.log('✅ Got users response:', response.data);
-      
-      const user = response.data.find(u => u.email === email && u.password === password);
-      console.log('🔍 User found:', user ? 'YES' : 'NO');
-      
-      if (user) {
-        // Don't send password back to frontend
-        const { password: _, ...userWithoutPassword } = user;
-        console.log('✅ Login successful for:', user.email);
-        return userWithoutPassword;
-      } else {
-        console.error('❌ Invalid credentials');
-        throw new Error('Invalid email or password');
-      }
+      const response = await api.post('/login', { email, password });
+      localStorage.setItem('token', response.data.token);
+      console.log('✅ Login successful for:', response.data.user.email);
+      return response.data.user;
     } catch (error) {
       console.error('❌ Login error:', error);
-      if (error.message === 'Invalid email or password') {
-        throw error;
+      if (error.response?.status === 401) {
+        throw new Error('Invalid email or password');
       }
       throw new Error('Login failed. Please try again.');
     }
   },
 
+  logout: async () => {
+    // Read the token before clearing it; the request is sent asynchronously
+    const token = localStorage.getItem('token');
+    localStorage.removeItem('token');
+    queryCache.clear();
+    if (!token) {
+      return;
+    }
+    try {
+      await api.post('/logout', null, { headers: { Authorization: `Bearer ${token}` } });
+    } catch (error) {
+      console.error('Logout error:', error);
+    }
+  },
+
   // POST methods for adding new data
   addHealthRecord: async (recordData) => {
     try {